@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+"""
+gamelaunch-admin: bulk user administration for pygamelaunch.
+"""
+
+import argparse
+import sys
+from gamelaunch import bulk
+from gamelaunch import configfile
+from gamelaunch import db
+
+def open_input(path):
+    """Open an input file, - for stdin."""
+    return sys.stdin if path == "-" else open(path, newline='')
+
+def open_output(path):
+    """Open an output file, - for stdout."""
+    return sys.stdout if path == "-" else open(path, "w", newline='')
+
+def guess_format(path, given):
+    """Use the given format, or guess it from the file name."""
+    if given is not None:
+        return given
+    return 'csv' if path.endswith(".csv") else 'jsonl'
+
+def do_create(database, _):
+    """Create an empty database."""
+    database.create()
+
+def do_import(database, options):
+    """Import users."""
+    importer = bulk.Importer(database, options.batch, options.workers,
+                             options.min_cost, options.skip_existing)
+    with open_input(options.file) as file:
+        importer.run(bulk.read_records(
+            file, guess_format(options.file, options.format)))
+
+    for error in importer.errors:
+        print("skipped " + error, file=sys.stderr)
+    print("imported {} users, skipped {}".format(importer.imported,
+                                                  len(importer.errors)))
+
+def do_export(database, options):
+    """Export users."""
+    with open_output(options.file) as file:
+        bulk.write_records(file, guess_format(options.file, options.format),
+                           bulk.export(database, options.batch))
+
+def do_reset(database, options):
+    """Reset passwords."""
+    with open_input(options.file) as file:
+        updated = bulk.reset_passwords(
+            database,
+            bulk.read_records(file, guess_format(options.file,
+                                                 options.format)),
+            options.batch, options.workers)
+    print("reset {} passwords".format(updated))
+
+def do_delete(database, options):
+    """Delete users."""
+    with open_input(options.file) as file:
+        names = (line.strip() for line in file if line.strip())
+        deleted = bulk.delete_users(database, names, options.batch)
+    print("deleted {} users".format(deleted))
+
+def main():
+    """Parse the command line and run a command."""
+    parser = argparse.ArgumentParser(prog="gamelaunch-admin",
+                                     description=__doc__.strip())
+    parser.add_argument("--config", default="gamelaunch.yml",
+                        help="launcher config to read the database from")
+    parser.add_argument("--database",
+                        help="database file or URL, overrides the config")
+    parser.add_argument("--batch", type=int, default=1000,
+                        help="rows per transaction")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    commands.add_parser("create", help="create an empty database")\
+        .set_defaults(run=do_create)
+
+    def add_file_command(name, run, text):
+        """Add a command that reads or writes a file of users."""
+        command = commands.add_parser(name, help=text)
+        command.add_argument("file", help="file name, - for stdin/stdout")
+        command.add_argument("--format", choices=['csv', 'jsonl'],
+                             help="defaults to csv for .csv files and "
+                             "jsonl otherwise")
+        command.add_argument("--workers", type=int,
+                             help="processes used for hashing")
+        command.set_defaults(run=run)
+        return command
+
+    importer = add_file_command(
+        "import", do_import, "import users with a username, email and "
+        "password or bcrypt hash")
+    importer.add_argument("--min-cost", type=int, default=0,
+                          help="rehash passwords whose hash has a lower "
+                          "bcrypt cost, when the password is given")
+    importer.add_argument("--skip-existing", action="store_true",
+                          help="ignore users that already exist")
+    add_file_command("export", do_export, "export all users")
+    add_file_command("reset-passwords", do_reset,
+                     "set new passwords from username,password records")
+    add_file_command("delete", do_delete,
+                     "delete the users listed one per line")
+
+    options = parser.parse_args()
+    database = options.database
+    if database is None:
+        try:
+            config = configfile.parse(options.config)
+            database = config.get('database', "users.db")
+        except FileNotFoundError:
+            database = "users.db"
+    options.run(db.Database(database), options)
+
+if __name__ == "__main__":
+    main()
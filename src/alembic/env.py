@@ -15,7 +15,7 @@ fileConfig(config.config_file_name)
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
-from gamelaunch.db import Base
+from gamelaunch.models import Base
 target_metadata = Base.metadata
 
 # other values from the config, defined by the needs of env.py,
@@ -33,7 +33,6 @@ def upgrade():
 def downgrade():
     ### commands auto generated by Alembic - please adjust! ###
     op.drop_column('users', 'created')
-    op.add_column('playing', sa.Column('record', sa.VARCHAR(), nullable=True))
     op.drop_index(op.f('ix_logins_username'), table_name='logins')
     op.drop_table('logins')
     ### end Alembic commands ###
@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+
+"""
+The AuthorizedKeysCommand for the shared launcher account. sshd runs it
+with the fingerprint of the key a client offers (%f), and it prints the
+key if a player has registered it, so sshd accepts it. With ssh_keys
+register set and the key's type and base64 (%t %k) as well, any key is
+accepted, so that players can connect with a new key and register it. See
+gamelaunch/sshkeys.py for the sshd config.
+"""
+
+import argparse
+from gamelaunch import configfile
+from gamelaunch import db
+from gamelaunch import sshkeys
+
+# Keys only ever get the launcher, with a terminal.
+OPTIONS = "restrict,pty"
+
+def main():
+    """Print the registered key with the fingerprint, if there is one."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--config", default="gamelaunch.yml",
+                        help="launcher config with the database")
+    parser.add_argument("fingerprint", help="the key's fingerprint, %%f")
+    parser.add_argument("type", nargs="?", help="the key's type, %%t")
+    parser.add_argument("key", nargs="?", help="the key in base64, %%k")
+    options = parser.parse_args()
+
+    config = configfile.parse(options.config)
+    settings = config.get('ssh_keys', {})
+    if not settings.get('login', False):
+        return
+
+    key = db.ssh_key_line(db.Database(config.get('database', "users.db")),
+                          options.fingerprint)
+    if key is None and settings.get('register', False) and options.key:
+        try:
+            key_type, blob, _ = sshkeys.parse_key(
+                "{} {}".format(options.type, options.key))
+        except sshkeys.InvalidKey:
+            return
+        key = sshkeys.format_key(key_type, blob)
+    if key is not None:
+        print("{} {}".format(OPTIONS, key))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+
+"""
+Runs the backfills and index builds left by migrations, in small chunks,
+while the server stays up. Run it after ./upgrade. It can be stopped at any
+time and carries on from where it got to when run again.
+"""
+
+import argparse
+import sys
+from gamelaunch import backfill
+from gamelaunch import configfile
+from gamelaunch import db
+
+def report(name, message):
+    """Print a job's progress."""
+    print("{}: {}".format(name, message), file=sys.stderr)
+
+def main():
+    """Parse the command line and run the jobs."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("jobs", nargs="*",
+                        help="jobs to run, all of them if none are given")
+    parser.add_argument("--config", default="gamelaunch.yml",
+                        help="launcher config to read the database from")
+    parser.add_argument("--database",
+                        help="database file or URL, overrides the config")
+    parser.add_argument("--chunk", type=int, default=500,
+                        help="rows per transaction")
+    parser.add_argument("--duty", type=float, default=0.25,
+                        help="fraction of the time to spend in the database")
+    parser.add_argument("--list", action="store_true",
+                        help="list the jobs and their progress")
+    parser.add_argument("--reset", action="store_true",
+                        help="forget the progress of the given jobs")
+    options = parser.parse_args()
+
+    database = options.database
+    if database is None:
+        try:
+            config = configfile.parse(options.config)
+            database = config.get('database', "users.db")
+        except FileNotFoundError:
+            database = "users.db"
+
+    try:
+        jobs = [backfill.find(name) for name in options.jobs] or \
+            backfill.JOBS
+    except KeyError as error:
+        parser.error("no job called {}".format(error))
+
+    runner = backfill.Runner(db.Database(database), options.chunk,
+                             options.duty, report)
+    for job in jobs:
+        if options.list:
+            state = runner.progress(job.name)
+            if state is None:
+                print("{}: not started".format(job.name))
+            else:
+                print("{}: {}, {} rows".format(
+                    job.name, "done" if state[2] else "stopped", state[1]))
+        elif options.reset:
+            runner.reset(job.name)
+        else:
+            runner.run(job)
+
+if __name__ == "__main__":
+    main()
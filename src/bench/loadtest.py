@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+
+"""Headless load test for the launcher.
+
+Runs launcher.py in pseudo terminals against a temporary SQLite database,
+with stub docker and termrecord_client binaries, and drives each session
+with a key script. Measures time to menu, login latency, play start latency
+and memory per session for N concurrent users, and writes the results to a
+JSON file so runs can be compared between releases.
+
+Usage: loadtest.py [--users N] [--game-time SECONDS] [--output FILE]
+"""
+
+import argparse
+import concurrent.futures
+import fcntl
+import json
+import os
+import platform
+import pty
+import re
+import select
+import shutil
+import signal
+import statistics
+import struct
+import sys
+import tempfile
+import termios
+import time
+import yaml
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUBS = os.path.join(SRC, "bench", "stubs")
+
+sys.path.insert(0, SRC)
+
+#pylint: disable=wrong-import-position
+from gamelaunch import db
+
+PASSWORD = "benchpassword"
+
+ESCAPES = re.compile(rb'\x1b(\[[0-9;?]*[ -/]*[@-~]|[()][0-9A-Za-z]|.)')
+
+class Timeout(Exception):
+    """Thrown when the launcher doesn't show what we expect in time."""
+    pass
+
+def bench_config(workdir):
+    """The launcher configuration used for load tests."""
+    return {
+        'docker': os.path.join(STUBS, "docker"),
+        'idle_time': 60,
+        'log': {'path': os.path.join(workdir, "gamelaunch.log")},
+        'menus': {
+            'main': {
+                'items': [
+                    {'key': 'l', 'title': 'login', 'action': 'login'},
+                    {'key': 'w', 'title': 'watch', 'action': 'watch'},
+                    {'key': 'q', 'title': 'quit', 'action': 'quit'},
+                ],
+                'news': ['bench-main'],
+            },
+            'loggedin': {
+                'items': [
+                    {'key': 'w', 'title': 'watch', 'action': 'watch'},
+                    'games',
+                    {'key': 'q', 'title': 'quit', 'action': 'quit'},
+                ],
+                'news': ['bench-loggedin'],
+            },
+        },
+        'games': [{
+            'name': 'Bench',
+            'image': 'bench',
+            'arguments': ['-u', '{{ user }}'],
+            'menu': {
+                'items': [
+                    {'key': 'p', 'title': 'play',
+                     'action': 'play {{ game.number }}'},
+                    {'key': 'q', 'title': 'return', 'action': 'quit'},
+                ],
+                'news': ['bench-gamemenu'],
+            },
+        }],
+    }
+
+def setup(workdir, users, config=None):
+    """Create the config and a database with the test users."""
+    if config is None:
+        config = bench_config(workdir)
+    with open(os.path.join(workdir, "gamelaunch.yml"), "w") as file:
+        yaml.dump(config, file)
+
+    database = db.Database(os.path.join(workdir, "users.db"))
+    database.create()
+    for user in users:
+        db.add_user(database, db.create_user(user, PASSWORD, ""))
+
+class Terminal:
+    """A launcher process running in a pseudo terminal."""
+    def __init__(self, workdir, env):
+        self.__output = b""
+        self.__seen = 0
+        self.__pid, self.__fd = pty.fork()
+
+        if self.__pid == 0:
+            os.chdir(workdir)
+            os.execve(sys.executable,
+                      [sys.executable, os.path.join(SRC, "launcher.py")],
+                      env)
+
+        fcntl.ioctl(self.__fd, termios.TIOCSWINSZ,
+                    struct.pack("HHHH", 24, 80, 0, 0))
+
+    def send(self, text):
+        """Type some keys."""
+        os.write(self.__fd, text.encode('utf-8'))
+
+    def expect(self, token, timeout=30):
+        """Wait for token to appear on the screen. Returns the time taken."""
+        start = time.monotonic()
+        deadline = start + timeout
+        token = token.encode('utf-8')
+
+        while True:
+            text = ESCAPES.sub(b"", self.__output)
+            found = text.find(token, self.__seen)
+            if found >= 0:
+                self.__seen = found + len(token)
+                return time.monotonic() - start
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.__read(remaining):
+                raise Timeout(token.decode('utf-8'))
+
+    def __read(self, timeout):
+        """Read some more output. Returns False at end of output."""
+        ready, _, _ = select.select([self.__fd], [], [], timeout)
+        if not ready:
+            return True
+        try:
+            data = os.read(self.__fd, 65536)
+        except OSError:
+            return False
+        self.__output += data
+        return len(data) > 0
+
+    def hangup(self):
+        """Hang up, as if the connection dropped."""
+        os.kill(self.__pid, signal.SIGHUP)
+
+    def memory(self):
+        """Current and peak resident memory in kB."""
+        result = {}
+        with open("/proc/{}/status".format(self.__pid)) as status:
+            for line in status:
+                key, _, value = line.partition(":")
+                if key in ('VmRSS', 'VmHWM'):
+                    result[key] = int(value.split()[0])
+        return result
+
+    def wait(self, timeout=10):
+        """Wait for the launcher to exit, killing it if it doesn't."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            pid, status = os.waitpid(self.__pid, os.WNOHANG)
+            if pid != 0:
+                os.close(self.__fd)
+                return status
+            self.__read(0.1)
+
+        os.kill(self.__pid, signal.SIGKILL)
+        _, status = os.waitpid(self.__pid, 0)
+        os.close(self.__fd)
+        return status
+
+def session(workdir, env, user, game_time):
+    """Drive one complete session and return its measurements."""
+    result = {'user': user}
+    start = time.monotonic()
+    term = Terminal(workdir, env)
+
+    try:
+        term.expect("bench-main")
+        result['time_to_menu'] = time.monotonic() - start
+
+        term.send("l")
+        term.expect("username")
+        term.send(user + "\n")
+        term.expect("password")
+        term.send(PASSWORD + "\n")
+        result['login'] = term.expect("bench-loggedin")
+        result['rss_menu_kb'] = term.memory()['VmRSS']
+
+        term.send("1")
+        term.expect("bench-gamemenu")
+        term.send("p")
+        result['play_start'] = term.expect("bench-game-running")
+        result['play_return'] = term.expect("bench-gamemenu",
+                                            game_time + 30) - game_time
+        result['rss_peak_kb'] = term.memory()['VmHWM']
+
+        term.send("q")
+        term.send("q")
+    except (Timeout, OSError) as error:
+        result['error'] = "{}: {}".format(type(error).__name__, error)
+
+    result['status'] = term.wait()
+    result['total'] = time.monotonic() - start
+    return result
+
+def summarise(sessions):
+    """Summary statistics for each measurement."""
+    summary = {}
+    for key in ('time_to_menu', 'login', 'play_start', 'play_return',
+                'rss_menu_kb', 'rss_peak_kb', 'total'):
+        values = sorted(s[key] for s in sessions if key in s)
+        if not values:
+            continue
+        summary[key] = {
+            'min': values[0],
+            'median': statistics.median(values),
+            'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+            'max': values[-1],
+        }
+    summary['errors'] = sum(1 for s in sessions if 'error' in s)
+    return summary
+
+def main():
+    """Run the load test."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=1,
+                        help="number of concurrent simulated users")
+    parser.add_argument("--game-time", type=float, default=1.0,
+                        help="seconds each stub game runs for")
+    parser.add_argument("--output", default="bench_results.json",
+                        help="where to write the JSON results")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the temporary directory")
+    options = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pygamelaunch-bench-")
+    users = ["bench{}".format(i) for i in range(options.users)]
+    setup(workdir, users)
+
+    env = dict(os.environ)
+    env['PATH'] = STUBS + os.pathsep + env.get('PATH', "")
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [SRC, env.get('PYTHONPATH')]))
+    env['TERM'] = "xterm"
+    env['BENCH_GAME_TIME'] = str(options.game_time)
+    env.pop('SSH_CLIENT', None)
+
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(options.users) as pool:
+        sessions = list(pool.map(
+            lambda user: session(workdir, env, user, options.game_time),
+            users))
+
+    results = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'users': options.users,
+        'game_time': options.game_time,
+        'wall_time': time.monotonic() - start,
+        'summary': summarise(sessions),
+        'sessions': sessions,
+    }
+
+    with open(options.output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    print(json.dumps(results['summary'], indent=2))
+
+    if options.keep:
+        print("Kept " + workdir)
+    else:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+#!/usr/bin/python3
+
+"""Replay recorded session traces against a test launcher.
+
+Reads the traces written by sessions with tracing turned on (see
+gamelaunch/sessiontrace.py) and runs each one as a launcher in a pseudo
+terminal, like loadtest.py, with the same stub docker and recorder. Sessions
+start at the same times relative to each other as they did for real, and
+keys are sent with the same gaps, all divided by the speed. Games last as
+long as they did, also divided by the speed.
+
+What was typed isn't in the traces, so logins use test users, with a wrong
+password where the real login failed, and registrations make new users.
+SSH keys aren't added and the options editor is left without changes.
+
+While the sessions run, a probe takes the database's write lock every
+--probe seconds, to measure how long writers wait for each other. The
+results have the launchers' CPU time, the lock waits, the session phase
+times from the launchers' event log, and any errors, and are written to a
+JSON file.
+
+Usage: tracereplay.py TRACES [--speed N] [--limit N] [--config FILE]
+"""
+
+import argparse
+import concurrent.futures
+import curses
+import json
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import yaml
+
+import loadtest
+from loadtest import PASSWORD, STUBS, SRC, Terminal, Timeout
+
+# What to send for keys that curses reads as escape sequences.
+SEQUENCES = {
+    curses.KEY_UP: "\x1bOA",
+    curses.KEY_DOWN: "\x1bOB",
+    curses.KEY_RIGHT: "\x1bOC",
+    curses.KEY_LEFT: "\x1bOD",
+    curses.KEY_HOME: "\x1bOH",
+    curses.KEY_END: "\x1bOF",
+    curses.KEY_PPAGE: "\x1b[5~",
+    curses.KEY_NPAGE: "\x1b[6~",
+    curses.KEY_DC: "\x1b[3~",
+    curses.KEY_BACKSPACE: "\x7f",
+}
+
+# Sent to leave the options editor.
+EDITOR_EXIT = "\x18"
+
+# Seconds a replayed session takes beyond its trace, to start the launcher
+# and for it to exit.
+OVERHEAD = 2.0
+
+def load_traces(path, limit=None):
+    """Read traces, in the order the sessions started."""
+    traces = []
+    with open(path) as file:
+        for line in file:
+            try:
+                trace = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(trace, dict) and 'events' in trace:
+                traces.append(trace)
+    traces.sort(key=lambda trace: trace['start'])
+    return traces[:limit] if limit else traces
+
+def peak_sessions(traces, speed):
+    """The most sessions that run at the same time in a replay. Each is
+    allowed OVERHEAD seconds on top of its sped up duration."""
+    changes = []
+    for trace in traces:
+        start = trace['start'] / speed
+        changes.append((start, 1))
+        changes.append((start + trace['duration'] / speed + OVERHEAD, -1))
+    # A session that ends as another starts doesn't overlap it.
+    changes.sort()
+    running = peak = 0
+    for _, change in changes:
+        running += change
+        peak = max(peak, running)
+    return peak
+
+def key_text(key):
+    """The text to type for a key code."""
+    if key in SEQUENCES:
+        return SEQUENCES[key]
+    if 0 <= key < 128:
+        return chr(key)
+    return None
+
+def replay_config(workdir, path=None):
+    """The load test config, with the menus and games of a real config."""
+    config = loadtest.bench_config(workdir)
+    if path is None:
+        return config
+    with open(path) as file:
+        real = yaml.safe_load(file)
+    config['menus'] = real['menus']
+    config['games'] = [
+        {key: game[key] for key in ('name', 'image', 'arguments', 'menu')
+         if key in game}
+        for game in real['games']]
+    if 'contact' in real:
+        config['contact'] = real['contact']
+    return config
+
+class Script:
+    """Turns a trace's events into what to type and when."""
+    #pylint: disable=too-few-public-methods
+    def __init__(self, trace, user, number):
+        self.__events = trace['events']
+        self.__user = user
+        self.__number = number
+        self.__registered = 0
+
+    def __login_fails(self, index):
+        """Did the login after the event at index fail."""
+        for event in self.__events[index + 1:]:
+            if event[1] == 'login':
+                return not event[2]
+            if event[1] == 'input':
+                break
+        return False
+
+    def __text(self, index, field, action):
+        """What to type into a field."""
+        if field == 'user' and action == 'register':
+            self.__registered += 1
+            return "new{}r{}".format(self.__number, self.__registered)
+        if field == 'user':
+            return self.__user
+        if field == 'password':
+            if self.__login_fails(index):
+                return "wrong" + PASSWORD
+            return PASSWORD
+        if field == 'email':
+            return "bench@example.com"
+        return ""
+
+    def steps(self):
+        """Yields (milliseconds, kind, value): text to type, or the length of
+        a game to wait for."""
+        action = None
+        for index, event in enumerate(self.__events):
+            elapsed, kind = event[0], event[1]
+            if kind == 'key':
+                text = key_text(event[2])
+                if text is not None:
+                    yield elapsed, 'type', text
+            elif kind == 'action':
+                action = event[2]
+            elif kind == 'input':
+                field, typed = event[2], event[3]
+                if field == 'options':
+                    yield elapsed, 'type', EDITOR_EXIT
+                elif typed:
+                    yield elapsed, 'type', \
+                        self.__text(index, field, action) + "\n"
+                else:
+                    yield elapsed, 'type', "\n"
+            elif kind == 'play':
+                yield elapsed, 'play', event[2]
+
+    def games(self):
+        """How long each game lasted, in seconds."""
+        return [event[2] for event in self.__events if event[1] == 'play']
+
+def replay_session(workdir, env, trace, number, speed, start_at):
+    """Replay one trace, from the monotonic time start_at, and return what
+    happened."""
+    #pylint: disable=too-many-arguments
+    result = {'number': number, 'reason': trace['reason']}
+    user = "bench{}".format(number)
+    script = Script(trace, user, number)
+
+    env = dict(env)
+    times = os.path.join(workdir, "games.{}".format(number))
+    with open(times, "w") as file:
+        for seconds in script.games():
+            file.write("{:.3f}\n".format(seconds / speed))
+    env['BENCH_GAME_TIMES'] = times
+
+    time.sleep(max(start_at - time.monotonic(), 0))
+    start = time.monotonic()
+    # A session waits for a thread if more overlap than did for real.
+    result['start_late'] = start - start_at
+    term = Terminal(workdir, env)
+    late = 0.0
+    try:
+        result['time_to_menu'] = term.expect("Pygamelaunch")
+        # The schedule is kept from a point that the real and replayed
+        # session both reached, so a slow launcher doesn't make keys bunch
+        # up. The first is the menu being shown.
+        anchor = time.monotonic()
+        anchor_elapsed = trace['events'][0][0] if trace['events'] else 0
+        for elapsed, kind, value in script.steps():
+            due = anchor + (elapsed - anchor_elapsed) / 1000.0 / speed
+            now = time.monotonic()
+            if due > now:
+                time.sleep(due - now)
+            else:
+                late = max(late, now - due)
+            if kind == 'type':
+                term.send(value)
+            else:
+                term.expect("bench-game-over", value / speed + 30)
+                anchor, anchor_elapsed = time.monotonic(), elapsed
+
+        end = anchor + (trace['duration'] * 1000 - anchor_elapsed) / \
+            1000.0 / speed
+        time.sleep(max(end - time.monotonic(), 0))
+        if trace['reason'] != 'quit':
+            term.hangup()
+    except (Timeout, OSError) as error:
+        result['error'] = "{}: {}".format(type(error).__name__, error)
+        term.hangup()
+
+    result['late'] = late
+    result['status'] = term.wait()
+    result['total'] = time.monotonic() - start
+    return result
+
+class LockProbe(threading.Thread):
+    """Times taking the database write lock, over and over."""
+    def __init__(self, path, interval):
+        super().__init__(daemon=True)
+        self.__path = path
+        self.__interval = interval
+        self.__stop = threading.Event()
+        self.waits = []
+        self.timeouts = 0
+
+    def run(self):
+        connection = sqlite3.connect(self.__path, timeout=10,
+                                     isolation_level=None)
+        while not self.__stop.wait(self.__interval):
+            start = time.monotonic()
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.execute("ROLLBACK")
+            except sqlite3.OperationalError:
+                self.timeouts += 1
+                continue
+            self.waits.append(time.monotonic() - start)
+        connection.close()
+
+    def stop(self):
+        """Stop probing."""
+        self.__stop.set()
+        self.join()
+
+def distribution(values):
+    """Summary statistics of some measurements."""
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        'count': len(values),
+        'median': values[len(values) // 2],
+        'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+        'max': values[-1],
+    }
+
+def read_log(path):
+    """Phase times and exit reasons from the launchers' event log."""
+    phases = {}
+    reasons = {}
+    try:
+        with open(path) as file:
+            for line in file:
+                record = json.loads(line)
+                if record.get('event') == 'phase':
+                    phases.setdefault(record['phase'], []).append(
+                        record['duration'])
+                elif record.get('event') == 'disconnect':
+                    reason = record.get('reason')
+                    reasons[reason] = reasons.get(reason, 0) + 1
+    except FileNotFoundError:
+        pass
+    return {phase: distribution(durations)
+            for phase, durations in phases.items()}, reasons
+
+def main():
+    """Replay the traces."""
+    #pylint: disable=too-many-locals
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("traces", help="the traces to replay")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="how many times faster than real time, "
+                        "from 1 to 100")
+    parser.add_argument("--limit", type=int,
+                        help="only replay the first N sessions")
+    parser.add_argument("--config",
+                        help="take the menus and games from this config")
+    parser.add_argument("--probe", type=float, default=0.1,
+                        help="seconds between database lock probes")
+    parser.add_argument("--output", default="replay_results.json",
+                        help="where to write the JSON results")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the temporary directory")
+    options = parser.parse_args()
+    if not 1 <= options.speed <= 100:
+        parser.error("--speed must be from 1 to 100")
+
+    traces = load_traces(options.traces, options.limit)
+    if not traces:
+        parser.error("there are no traces in " + options.traces)
+
+    workdir = tempfile.mkdtemp(prefix="pygamelaunch-replay-")
+    loadtest.setup(workdir, ["bench{}".format(i) for i in range(len(traces))],
+                   replay_config(workdir, options.config))
+
+    env = dict(os.environ)
+    env['PATH'] = STUBS + os.pathsep + env.get('PATH', "")
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [SRC, env.get('PYTHONPATH')]))
+    env['TERM'] = "xterm"
+    env.pop('SSH_CLIENT', None)
+    env.pop('SSH_USER_AUTH', None)
+
+    probe = LockProbe(os.path.join(workdir, "users.db"), options.probe)
+    probe.start()
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    first = traces[0]['start']
+    start = time.monotonic()
+    # Sessions are handed to the pool as they become due, so there are only
+    # ever as many threads as sessions that ran at once.
+    with concurrent.futures.ThreadPoolExecutor(
+            peak_sessions(traces, options.speed)) as pool:
+        futures = []
+        for number, trace in enumerate(traces):
+            due = start + (trace['start'] - first) / options.speed
+            time.sleep(max(due - time.monotonic(), 0))
+            futures.append(pool.submit(replay_session, workdir, env, trace,
+                                       number, options.speed, due))
+        sessions = [future.result() for future in futures]
+    wall_time = time.monotonic() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    probe.stop()
+
+    phases, reasons = read_log(os.path.join(workdir, "gamelaunch.log"))
+    cpu = (after.ru_utime - before.ru_utime) + \
+        (after.ru_stime - before.ru_stime)
+    results = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'sessions': len(traces),
+        'speed': options.speed,
+        'wall_time': wall_time,
+        'summary': {
+            'launcher_cpu': cpu,
+            'launcher_cpu_per_session': cpu / len(traces),
+            'lock_wait': distribution(probe.waits),
+            'lock_timeouts': probe.timeouts,
+            'phases': phases,
+            'exits': reasons,
+            'late': distribution([s['late'] for s in sessions]),
+            'start_late': distribution([s['start_late'] for s in sessions]),
+            'errors': sum(1 for s in sessions if 'error' in s),
+        },
+        'results': sessions,
+    }
+
+    with open(options.output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    print(json.dumps(results['summary'], indent=2))
+
+    if options.keep:
+        print("Kept " + workdir)
+    else:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
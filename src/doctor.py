@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+
+"""
+Checks the database, docker engines, game images, recorder, disk space and
+password hashing of a launcher host, all at once, and reports how long
+each took and whether it passed. Exits with 0 if everything passed, 1 if
+something warned and 2 if something failed.
+"""
+
+import argparse
+import json
+import sys
+from gamelaunch import configfile
+from gamelaunch import doctor
+
+def main():
+    """Read gamelaunch.yml and run the probes."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--config", default="gamelaunch.yml",
+                        help="launcher config to check")
+    parser.add_argument("--json", action="store_true",
+                        help="write the report as JSON")
+    parser.add_argument("--timeout", type=float,
+                        help="seconds to wait for the probes")
+    options = parser.parse_args()
+
+    config = configfile.parse(options.config)
+    timeout = options.timeout or config.get('doctor', {}).get('timeout', 10)
+
+    report = doctor.run(doctor.probes_from_config(config), timeout)
+    if options.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print("\n".join(doctor.format_report(report)))
+    return doctor.STATUSES.index(report['status'])
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,10 @@
 """A game launcher module."""
 
-import os
 import pyterm
+from gamelaunch import latency
+from gamelaunch import process
+from gamelaunch import spectate
+from gamelaunch.process import execwait
 
 #pylint: disable=too-many-arguments
 def rungame(
@@ -10,8 +13,14 @@ def rungame(
         record_host,
         record_port,
         record_user,
-        idle_time):
-    """Run a game."""
+        idle_time,
+        monitor=None):
+    """Run a game.
+
+    With monitor, a latency.EchoMonitor, the game's echo latency is
+    measured too. Returns the CPU time and peak memory used by the programs
+    it ran.
+    """
 
     executor = pyterm.ExecProgram(program, *arguments)
     net_writer = pyterm.ExecWriter(
@@ -19,10 +28,22 @@ def rungame(
         "-host", record_host, "-port", record_port,
         "-user", record_user, "-send")
     capture = pyterm.Capture(executor, idle_time, [net_writer])
-    capture.run()
+    with process.ChildUsage() as usage:
+        if monitor is None:
+            capture.run()
+        else:
+            latency.run(capture, monitor)
+    return usage
+
+def watch(server, port, watch_user, coalesce=None):
+    """Watch a running game.
+
+    With coalesce, the options of the coalescing watch mode, the viewer is
+    sent frames paced to its link and this returns what was sent.
+    """
+    if coalesce is not None:
+        return spectate.watch(server, port, watch_user, coalesce)
 
-def watch(server, port, watch_user):
-    """Watch a running game."""
     watcher = pyterm.ExecWatcher(
         "termrecord_client",
         [
@@ -35,16 +56,4 @@ def watch(server, port, watch_user):
             "-watch"
         ])
     watcher.watch()
-
-def execwait(prog, *args):
-    pid = os.fork()
-
-    if pid == 0:
-        os.close(0)
-        os.close(1)
-        os.close(2)
-
-        os.execlp(prog, *args)
-        os.exit(1)
-    else:
-        os.waitpid(pid, 0)
+    return None
@@ -0,0 +1,84 @@
+"""Host wide admission control for games.
+
+The number of games that can run at once is capped by a directory of slot
+files. A launcher holds an flock on one slot for as long as its game runs.
+The kernel drops the lock when the process exits, so a crashed launcher
+never leaks a slot. The descriptors are close-on-exec, so games and helpers
+never hold a slot themselves.
+
+A game that the player has detached from keeps running without a launcher,
+so it can't hold a slot. The launcher counts those games itself and passes
+them to try_acquire as reserved.
+"""
+
+import fcntl
+import os
+
+class Slot:
+    """A held game slot."""
+    def __init__(self, fd=None):
+        self.__fd = fd
+
+    def release(self):
+        """Give the slot back."""
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+class Admission:
+    """Hands out a fixed number of game slots between all launchers."""
+    limited = True
+
+    def __init__(self, directory, slots):
+        self.__directory = directory
+        self.__slots = slots
+        os.makedirs(directory, exist_ok=True)
+
+    def try_acquire(self, reserved=0):
+        """Take a free slot, or return None if the host is full. reserved is
+        the number of games running that don't hold a slot."""
+        if reserved > 0 and self.in_use() + reserved >= self.__slots:
+            return None
+        for i in range(self.__slots):
+            path = os.path.join(self.__directory, "slot{}".format(i))
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            return Slot(fd)
+        return None
+
+    def in_use(self):
+        """Count the slots that are currently held."""
+        held = 0
+        for i in range(self.__slots):
+            path = os.path.join(self.__directory, "slot{}".format(i))
+            try:
+                fd = os.open(path, os.O_RDWR | os.O_CLOEXEC)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                held += 1
+            finally:
+                os.close(fd)
+        return held
+
+class Unlimited:
+    """Admission when no limit is configured."""
+    #pylint: disable=too-few-public-methods,no-self-use,unused-argument
+    limited = False
+
+    def try_acquire(self, reserved=0):
+        """There is always a slot."""
+        return Slot()
+
+def from_config(config):
+    """Create the admission controller from the admission config section."""
+    if 'admission' not in config:
+        return Unlimited()
+    options = config['admission']
+    return Admission(options['directory'], options['max_games'])
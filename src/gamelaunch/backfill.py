@@ -0,0 +1,205 @@
+"""Online, chunked backfills and index builds.
+
+Alembic runs each migration in one transaction. That is fine for adding a
+nullable column, but not for touching every row of a large table such as
+logins, which would stay locked, with nobody able to log in, until it
+finished. Migrations should only make the cheap schema change, and leave
+the slow work to a job here, which backfill.py runs while the server stays
+up.
+
+A backfill walks a table in primary key order. Each chunk of rows is
+updated in its own short transaction, which also records the last key done
+in the backfill_progress table, so a job that is stopped carries on where
+it left off. The runner sleeps between chunks so that it only holds the
+database for a fraction of the time.
+
+An index build can't be split up. On PostgreSQL it is built concurrently,
+without blocking writes. SQLite has no concurrent build, so there the
+index is built with one statement, retried while the database is busy.
+"""
+
+import time
+import sqlalchemy
+from gamelaunch import models
+
+class Backfill:
+    """Sets columns of a table in chunks of rows."""
+    def __init__(self, name, table, values, where=None):
+        self.name = name
+        self.__table = table
+        self.__values = values
+        self.__where = where
+        self.__key = list(table.primary_key.columns)[0]
+
+    def __after(self, query, position):
+        """Restrict a query to the rows still to do."""
+        if position is not None:
+            query = query.where(self.__key > position)
+        if self.__where is not None:
+            query = query.where(self.__where)
+        return query
+
+    def remaining(self, conn, position):
+        """Count the rows still to do."""
+        query = sqlalchemy.select(sqlalchemy.func.count()).select_from(
+            self.__table)
+        return conn.execute(self.__after(query, position)).scalar()
+
+    def chunk(self, conn, position, size):
+        """Update the next size rows after position.
+
+        Returns the last key updated, or None when there is nothing left,
+        and the number of rows updated.
+        """
+        query = self.__after(sqlalchemy.select(self.__key), position)
+        keys = [row[0] for row in conn.execute(
+            query.order_by(self.__key).limit(size))]
+        if not keys:
+            return None, 0
+        conn.execute(self.__table.update().where(
+            self.__key.in_(keys)).values(self.__values))
+        return keys[-1], len(keys)
+
+class IndexBuild:
+    """Builds an index without holding up the server."""
+    #pylint: disable=too-few-public-methods
+    def __init__(self, name, index, table, columns):
+        self.name = name
+        self.__index = index
+        self.__table = table
+        self.__columns = columns
+
+    def build(self, database):
+        """Build the index if it doesn't already exist."""
+        concurrently = ""
+        options = {}
+        if database.dialect() == 'postgresql':
+            # CREATE INDEX CONCURRENTLY can't run inside a transaction.
+            concurrently = "CONCURRENTLY "
+            options['isolation_level'] = "AUTOCOMMIT"
+        statement = sqlalchemy.text(
+            "CREATE INDEX {}IF NOT EXISTS {} ON {} ({})".format(
+                concurrently, self.__index, self.__table,
+                ", ".join(self.__columns)))
+
+        def run():
+            with database.connect() as conn:
+                conn = conn.execution_options(**options)
+                conn.execute(statement)
+                if not options:
+                    conn.commit()
+        models.retry_busy(run, attempts=10, delay=0.05)
+
+def _jobs():
+    """The jobs that migrations have left to run, in order."""
+    users = models.User.__table__
+    logins = models.Logins.__table__
+    first_login = sqlalchemy.select(sqlalchemy.func.min(logins.c.date)).where(
+        logins.c.username == users.c.username).scalar_subquery()
+    return [
+        # Users from before f04c63b52c8e have no creation date. Their first
+        # login is the best guess there is.
+        Backfill('users_created', users, {'created': first_login},
+                 users.c.created.is_(None)),
+        IndexBuild('logins_date_index', 'ix_logins_date', 'logins', ['date']),
+    ]
+
+JOBS = _jobs()
+
+def find(name):
+    """Look up a job by name."""
+    for job in JOBS:
+        if job.name == name:
+            return job
+    raise KeyError(name)
+
+class Runner:
+    """Runs jobs, keeping their progress in the database."""
+    def __init__(self, database, chunk=500, duty=0.25, report=None):
+        self.__database = database
+        self.__chunk = chunk
+        self.__duty = duty
+        self.__report = report or (lambda *args: None)
+
+    def progress(self, name):
+        """The (position, rows, done) recorded for a job, or None."""
+        progress = models.BackfillProgress.__table__
+        with self.__database.transaction() as conn:
+            row = conn.execute(sqlalchemy.select(
+                progress.c.position, progress.c.rows, progress.c.done).where(
+                    progress.c.name == name)).first()
+        return None if row is None else tuple(row)
+
+    def reset(self, name):
+        """Forget a job's progress so that it runs again from the start."""
+        progress = models.BackfillProgress.__table__
+        self.__database.execute(progress.delete().where(
+            progress.c.name == name))
+
+    @staticmethod
+    def __save(conn, name, position, rows, done):
+        """Record a job's progress as part of the chunk's transaction."""
+        progress = models.BackfillProgress.__table__
+        values = {'position': position, 'rows': rows, 'done': done,
+                  'updated': int(time.time())}
+        result = conn.execute(progress.update().where(
+            progress.c.name == name).values(values))
+        if result.rowcount == 0:
+            conn.execute(progress.insert().values(name=name, **values))
+
+    def run(self, job):
+        """Run a job to completion, or carry on with one that was stopped."""
+        state = self.progress(job.name)
+        if state is not None and state[2]:
+            self.__report(job.name, "done already")
+            return
+
+        if isinstance(job, IndexBuild):
+            self.__report(job.name, "building")
+            job.build(self.__database)
+            with self.__database.transaction() as conn:
+                self.__save(conn, job.name, None, 0, True)
+            self.__report(job.name, "done")
+            return
+
+        self.__backfill(job, state)
+
+    def __backfill(self, job, state):
+        """Work through a backfill a chunk at a time."""
+        position, rows = (state[0], state[1]) if state else (None, 0)
+        with self.__database.transaction() as conn:
+            total = rows + job.remaining(conn, position)
+        started = time.monotonic()
+        done_before = rows
+
+        while True:
+            begin = time.monotonic()
+
+            def chunk():
+                """One chunk and its progress, in one transaction."""
+                with self.__database.transaction() as conn:
+                    last, count = job.chunk(conn, position, self.__chunk)
+                    self.__save(conn, job.name,
+                                position if last is None else last,
+                                rows + count, last is None)
+                return last, count
+            last, count = models.retry_busy(chunk)
+
+            if last is None:
+                break
+            position = last
+            rows += count
+
+            elapsed = time.monotonic() - started
+            rate = (rows - done_before) / elapsed if elapsed > 0 else 0
+            self.__report(job.name, "{}/{} rows, {:.0f} rows/s{}".format(
+                rows, total, rate,
+                ", {:.0f}s left".format((total - rows) / rate)
+                if rate > 0 and total > rows else ""))
+
+            # Stay idle for long enough that the database is only held for
+            # the duty fraction of the time.
+            busy = time.monotonic() - begin
+            time.sleep(busy * (1 - self.__duty) / self.__duty)
+
+        self.__report(job.name, "done, {} rows".format(rows))
@@ -0,0 +1,241 @@
+"""Bulk user administration.
+
+Users are streamed from CSV or JSON lines files and written in batched
+transactions with executemany, so importing tens of thousands of accounts
+takes seconds instead of a session and commit per user. Passwords can be
+given as bcrypt hashes, which are stored as they are, or in plain text.
+Plain text passwords are hashed across a process pool.
+
+Records have the fields username, email, and either password (plain text)
+or hash (bcrypt), or both, in which case the hash is checked against the
+password. created, when it is given, is kept, so an export imports with
+its users' creation times.
+
+Each batch is committed on its own. A batch with a username that is
+already taken is inserted again a row at a time, and the users that
+clash are reported as errors, so the rest of the file is still imported.
+"""
+
+import concurrent.futures
+import csv
+import datetime
+import json
+import re
+import bcrypt
+import sqlalchemy
+from gamelaunch import db
+from gamelaunch import models
+
+BCRYPT = re.compile(r'^\$2[aby]?\$(\d\d)\$[./A-Za-z0-9]{53}$')
+
+FIELDS = ['username', 'email', 'hash', 'created']
+
+class BadRecord(Exception):
+    """Thrown for a record that can't be imported."""
+    pass
+
+def read_records(file, fmt):
+    """Stream records from an open file in csv or jsonl format."""
+    if fmt == 'csv':
+        for record in csv.DictReader(file):
+            yield record
+    else:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def write_records(file, fmt, records):
+    """Stream records to an open file in csv or jsonl format."""
+    if fmt == 'csv':
+        writer = csv.DictWriter(file, FIELDS)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+    else:
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+
+def batches(records, size):
+    """Group a stream of records into lists of at most size."""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def hash_cost(digest):
+    """The cost of a bcrypt hash, or None if it isn't one."""
+    match = BCRYPT.match(digest)
+    return int(match.group(1)) if match else None
+
+def prepare(record, min_cost=0):
+    """Work out the stored hash for a record. Runs in the process pool."""
+    username = record.get('username', "").strip()
+    if not username:
+        raise BadRecord("missing username")
+
+    password = record.get('password')
+    digest = record.get('hash')
+
+    if digest:
+        cost = hash_cost(digest)
+        if cost is None:
+            raise BadRecord("{}: not a bcrypt hash".format(username))
+        if password:
+            if not bcrypt.checkpw(password.encode('utf-8'),
+                                  digest.encode('utf-8')):
+                raise BadRecord("{}: hash doesn't match".format(username))
+            if cost < min_cost:
+                digest = None
+    elif not password:
+        raise BadRecord("{}: no password or hash".format(username))
+
+    if digest:
+        digest = digest.encode('utf-8')
+    else:
+        _, digest = db.create_password(password)
+
+    return {'username': username, 'password': digest, 'salt': '',
+            'email': record.get('email') or None,
+            'created': parse_created(username, record.get('created'))}
+
+def parse_created(username, created):
+    """When a record's user was created, as a naive UTC time like the
+    database keeps. Users without one were created now."""
+    if not created:
+        return datetime.datetime.now(datetime.timezone.utc).replace(
+            tzinfo=None)
+    try:
+        created = datetime.datetime.fromisoformat(created)
+    except (TypeError, ValueError):
+        raise BadRecord("{}: bad created time {!r}".format(username, created))
+    if created.tzinfo is not None:
+        created = created.astimezone(datetime.timezone.utc).replace(
+            tzinfo=None)
+    return created
+
+def _prepare(args):
+    """Pool entry point for prepare, returning errors instead of raising."""
+    try:
+        return prepare(*args), None
+    except BadRecord as error:
+        return None, str(error)
+
+class Importer:
+    """Imports users in batches."""
+    def __init__(self, database, batch=1000, workers=None, min_cost=0,
+                 skip_existing=False):
+        #pylint: disable=too-many-arguments
+        self.__database = database
+        self.__batch = batch
+        self.__min_cost = min_cost
+        self.__skip_existing = skip_existing
+        self.__pool = concurrent.futures.ProcessPoolExecutor(workers)
+        self.imported = 0
+        self.errors = []
+
+    def __insert(self):
+        """The insert statement for a batch."""
+        if self.__skip_existing:
+            insert = models.insert_or_ignore(self.__database, models.User)
+            if insert is not None:
+                return insert
+        return sqlalchemy.insert(models.User)
+
+    def run(self, records):
+        """Import a stream of records."""
+        for batch in batches(records, self.__batch):
+            prepared = self.__pool.map(
+                _prepare, [(record, self.__min_cost) for record in batch],
+                chunksize=16)
+            rows = []
+            for row, error in prepared:
+                if error is not None:
+                    self.errors.append(error)
+                else:
+                    rows.append(row)
+
+            if rows:
+                self.__write(rows)
+        self.__pool.shutdown()
+
+    def __write(self, rows):
+        """Insert a batch, or its rows one at a time if one of them is
+        already taken."""
+        try:
+            with self.__database.transaction() as conn:
+                result = conn.execute(self.__insert(), rows)
+            self.imported += max(result.rowcount, 0)
+            return
+        except sqlalchemy.exc.IntegrityError:
+            pass
+
+        for row in rows:
+            try:
+                with self.__database.transaction() as conn:
+                    result = conn.execute(self.__insert(), [row])
+            except sqlalchemy.exc.IntegrityError:
+                self.errors.append("{}: already exists".format(
+                    row['username']))
+                continue
+            self.imported += max(result.rowcount, 0)
+
+def export(database, batch=1000):
+    """Stream every user as a record."""
+    table = models.User.__table__
+    query = sqlalchemy.select(table.c.username, table.c.email,
+                              table.c.password, table.c.created).order_by(
+                                  table.c.id)
+    with database.transaction() as conn:
+        result = conn.execution_options(stream_results=True,
+                                        yield_per=batch).execute(query)
+        for row in result:
+            digest = row.password
+            if isinstance(digest, bytes):
+                digest = digest.decode('utf-8')
+            created = row.created
+            if isinstance(created, datetime.datetime):
+                created = created.isoformat()
+            yield {'username': row.username, 'email': row.email,
+                   'hash': digest, 'created': created}
+
+def _hash_for(record):
+    """Pool entry point hashing a new password for a user."""
+    return record['username'], db.create_password(record['password'])[1]
+
+def reset_passwords(database, records, batch=1000, workers=None):
+    """Set new passwords for users. Returns the number of users updated."""
+    table = models.User.__table__
+    update = table.update().where(
+        table.c.username == sqlalchemy.bindparam('name')).values(
+            password=sqlalchemy.bindparam('digest'), salt='')
+    updated = 0
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        for group in batches(records, batch):
+            rows = [{'name': name, 'digest': digest}
+                    for name, digest in pool.map(_hash_for, group,
+                                                 chunksize=16)]
+            with database.transaction() as conn:
+                updated += max(conn.execute(update, rows).rowcount, 0)
+    return updated
+
+def delete_users(database, usernames, batch=1000):
+    """Delete users, their playing rows and their SSH keys. Returns the
+    number deleted."""
+    users = models.User.__table__
+    playing = models.Playing.__table__
+    keys = models.SshKey.__table__
+    deleted = 0
+    for group in batches(usernames, batch):
+        with database.transaction() as conn:
+            ids = sqlalchemy.select(users.c.id).where(
+                users.c.username.in_(group))
+            conn.execute(playing.delete().where(playing.c.id.in_(ids)))
+            conn.execute(keys.delete().where(keys.c.user_id.in_(ids)))
+            deleted += conn.execute(users.delete().where(
+                users.c.username.in_(group))).rowcount
+    return deleted
@@ -0,0 +1,242 @@
+"""Loading and watching gamelaunch.yml.
+
+Parsing the YAML config is slow, and every launcher needs it. The parsed
+config is cached as JSON next to the config file, keyed by the file's
+inode, size and mtime. The first launcher to see a new version parses and
+validates it, under an flock, and the rest read the cache. So the cost is
+paid once per change to the file, not once per session.
+
+A running launcher watches the file from a background thread, with
+inotify on the file's directory, since editors often replace the file
+rather than write to it. Where inotify isn't available, the file's mtime
+is polled instead. A new config is only handed to the launcher once it has
+been validated, and the launcher swaps it in between key presses.
+"""
+
+import ctypes
+import errno
+import fcntl
+import json
+import os
+import struct
+import threading
+import time
+import yaml
+
+MENUS = ('main', 'loggedin')
+
+class ConfigError(Exception):
+    """Thrown for a config that the launcher can't use."""
+    pass
+
+def _check_items(where, items):
+    """Check the items of a menu."""
+    if not isinstance(items, list):
+        raise ConfigError("{} has no list of items".format(where))
+    for item in items:
+        if isinstance(item, str):
+            continue
+        if not isinstance(item, dict) or not all(
+                key in item for key in ('key', 'title', 'action')):
+            raise ConfigError("{} has an item without a key, title and "
+                              "action".format(where))
+        if len(str(item['key'])) != 1:
+            raise ConfigError("{} has a key that isn't one character: "
+                              "{}".format(where, item['key']))
+
+def validate(config):
+    """Check that a config has everything the launcher needs."""
+    if not isinstance(config, dict):
+        raise ConfigError("the config isn't a mapping")
+
+    menus = config.get('menus')
+    if not isinstance(menus, dict):
+        raise ConfigError("there are no menus")
+    for name in MENUS:
+        if name not in menus:
+            raise ConfigError("there is no {} menu".format(name))
+    for name, menu in menus.items():
+        _check_items("menu " + name, menu.get('items'))
+
+    games = config.get('games')
+    if not isinstance(games, list):
+        raise ConfigError("there is no list of games")
+    for game in games:
+        for key in ('name', 'image', 'menu'):
+            if key not in game:
+                raise ConfigError("a game has no {}".format(key))
+        _check_items("the menu of " + game['name'], game['menu'].get('items'))
+
+    if not isinstance(config.get('idle_time', 0), (int, float)):
+        raise ConfigError("idle_time isn't a number")
+
+def parse(path):
+    """Parse and validate a config file. Every script reads its config
+    with this."""
+    with open(path) as file:
+        config = yaml.safe_load(file)
+    validate(config)
+    return config
+
+def identity(path):
+    """What changes when a file is written or replaced."""
+    stat = os.stat(path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+class ConfigCache:
+    """The parsed config, shared between launchers."""
+    def __init__(self, path):
+        directory, name = os.path.split(os.path.abspath(path))
+        self.__path = path
+        self.__cache = os.path.join(directory, ".{}.json".format(name))
+        self.__lock = os.path.join(directory, ".{}.lock".format(name))
+
+    def __read(self, version):
+        """Read the cached config if it is of version."""
+        try:
+            with open(self.__cache) as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return cached['config'] if cached['identity'] == version else None
+
+    def load(self):
+        """Get the config, parsing it if the cache is out of date."""
+        version = identity(self.__path)
+        config = self.__read(version)
+        if config is not None:
+            return config
+
+        try:
+            lock = open(self.__lock, "a")
+        except OSError:
+            return parse(self.__path)
+
+        with lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Someone else may have parsed it while we waited.
+            config = self.__read(version)
+            if config is not None:
+                return config
+
+            config = parse(self.__path)
+            temp = "{}.{}".format(self.__cache, os.getpid())
+            try:
+                with open(temp, "w") as file:
+                    json.dump({'identity': version, 'config': config}, file)
+                os.replace(temp, self.__cache)
+            except (OSError, TypeError, ValueError):
+                # Not everything YAML can hold fits in JSON.
+                if os.path.exists(temp):
+                    os.unlink(temp)
+        return config
+
+class _Inotify:
+    """Just enough of inotify to wait for a file to change."""
+    # pylint: disable=too-few-public-methods
+    EVENT = struct.Struct("iIII")
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.__fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        watch = libc.inotify_add_watch(
+            self.__fd, os.fsencode(directory),
+            self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE)
+        if watch < 0:
+            error = ctypes.get_errno()
+            os.close(self.__fd)
+            raise OSError(error, "inotify_add_watch")
+
+    def wait(self):
+        """Wait for files in the directory to change. Returns their names."""
+        while True:
+            try:
+                data = os.read(self.__fd, 4096)
+                break
+            except InterruptedError:
+                continue
+        names = set()
+        offset = 0
+        while offset + self.EVENT.size <= len(data):
+            _, _, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            names.add(os.fsdecode(data[offset:offset + length].rstrip(b"\0")))
+            offset += length
+        return names
+
+class ConfigWatcher:
+    """Watches the config file and loads new versions in the background."""
+    def __init__(self, path, cache, interval=2.0, settle=0.2):
+        self.__path = path
+        self.__cache = cache
+        self.__interval = interval
+        self.__settle = settle
+        self.__lock = threading.Lock()
+        self.__pending = None
+        self.__version = None
+
+    def start(self):
+        """Start watching, from the version that is loaded now."""
+        try:
+            self.__version = identity(self.__path)
+        except OSError:
+            pass
+        thread = threading.Thread(target=self.__watch, name="config",
+                                  daemon=True)
+        thread.start()
+
+    def take(self):
+        """Get the config or error from the last change, if there is one.
+
+        Returns a (config, error) pair, where config is None if nothing has
+        changed or the new config is no good.
+        """
+        with self.__lock:
+            pending = self.__pending
+            self.__pending = None
+        return pending if pending is not None else (None, None)
+
+    def __watch(self):
+        """The watcher thread."""
+        directory, name = os.path.split(os.path.abspath(self.__path))
+        try:
+            inotify = _Inotify(directory)
+        except (OSError, AttributeError):
+            inotify = None
+
+        while True:
+            if inotify is not None:
+                if name not in inotify.wait():
+                    continue
+                # Let an editor finish writing.
+                time.sleep(self.__settle)
+            else:
+                time.sleep(self.__interval)
+            self.__check()
+
+    def __check(self):
+        """Load the config if it has changed."""
+        try:
+            version = identity(self.__path)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                self.__set(None, error)
+            return
+        if version == self.__version:
+            return
+        self.__version = version
+
+        try:
+            self.__set(self.__cache.load(), None)
+        except (OSError, yaml.YAMLError, ConfigError) as error:
+            self.__set(None, error)
+
+    def __set(self, config, error):
+        """Hand a new config or error to the launcher."""
+        with self.__lock:
+            self.__pending = (config, error)
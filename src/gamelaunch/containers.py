@@ -0,0 +1,103 @@
+"""Game containers.
+
+The docker options a game's container is run with, and what the launcher
+needs to know about containers that were left running. A player can detach
+from a game, which keeps running with no launcher attached until they come
+back to it. Its playing row then has no pid.
+"""
+
+import os
+from gamelaunch import db
+from gamelaunch.engine import EngineError
+from gamelaunch.placement import UnknownNode
+
+# Keys that detach from a game, leaving it running to be resumed later.
+DETACH_KEYS = "ctrl-@,ctrl-^"
+
+# Docker options for the settings in a resources section of the config.
+RESOURCE_FLAGS = {
+    'cpu_shares': "--cpu-shares",
+    'cpus': "--cpus",
+    'cpu_quota': "--cpu-quota",
+    'cpu_period': "--cpu-period",
+    'memory': "--memory",
+    'memory_swap': "--memory-swap",
+    'pids_limit': "--pids-limit",
+    'blkio_weight': "--blkio-weight",
+}
+
+def resource_flags(resources):
+    """Build docker run options that apply resource limits."""
+    flags = []
+    for name, value in sorted(resources.items()):
+        if name not in RESOURCE_FLAGS:
+            raise KeyError("Unknown resource setting " + name)
+        flags.extend([RESOURCE_FLAGS[name], str(value)])
+    return flags
+
+def run_command(game, resources, render, name, args):
+    """The docker arguments that run a game in a new container called name.
+    The game's resource limits are applied over the launcher's, and render
+    renders the templates in its volumes."""
+    limits = dict(resources)
+    limits.update(game.get('resources', {}))
+    docker = ["run", "--rm", "-it", "--detach-keys", DETACH_KEYS]
+    docker.extend(resource_flags(limits))
+    for volume in game.get('volumes', []):
+        docker.extend(["-v", "{}:{}".format(render(volume[0]),
+                                            render(volume[1]))])
+    docker.extend(["--name", name, game['image']])
+    docker.extend(args)
+    return docker
+
+def still_running(engine_client, container):
+    """Check if a game container is still running after we left it."""
+    try:
+        return engine_client.running(container)
+    except EngineError:
+        return False
+
+def owner_alive(playing, owner):
+    """Is a launcher other than owner, a (host, pid) pair, still attached
+    to the game in a playing row.
+
+    Launchers on other hosts can't be checked, so they are taken to be
+    alive.
+    """
+    host, pid = owner
+    if playing.pid is None or (playing.host, playing.pid) == (host, pid):
+        return False
+    if playing.host != host:
+        return True
+    try:
+        os.kill(playing.pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def count_detached(database, host, nodes, cache):
+    """Count the games started from host that are running with no launcher
+    attached. Rows of those that have finished are removed. nodes is the
+    placement the games were put on, and cache the playing list cache."""
+    rows = {}
+    for playing in db.detached_playing(database, host):
+        rows.setdefault(playing.node, []).append(playing)
+
+    count = 0
+    for node, detached in rows.items():
+        try:
+            running = {name.lstrip("/") for container in
+                       nodes.engine(node).containers()
+                       for name in container.get('Names', [])}
+        except (EngineError, UnknownNode):
+            # Games that can't be checked are taken to be running.
+            count += len(detached)
+            continue
+        for playing in detached:
+            if playing.container in running:
+                count += 1
+            elif db.drop_detached(database, playing.id):
+                cache.invalidate()
+    return count
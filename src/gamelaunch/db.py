@@ -1,20 +1,93 @@
 """ The pygamelaunch db module.
 
 Looks after everything database related.
+
+The launcher only needs a few small queries, so they are written here as
+plain SQL and run with the sqlite3 module, on one connection per thread.
+sqlite3 keeps each connection's prepared statements in a cache keyed by
+their text, so each query is only compiled once per process. Rows come
+back as small objects with __slots__ or as dicts, and SQLAlchemy is never
+loaded for them.
+
+The schema is defined by the SQLAlchemy models in gamelaunch.models, for
+Alembic and the admin tools. Those get an engine and sessions from the same
+Database, made the first time they ask. A database given as a URL rather
+than a SQLite file runs these queries through SQLAlchemy too.
 """
+import sqlite3
+import threading
+import time
 import bcrypt
-import sqlalchemy
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Boolean, DateTime, Column, Integer, String, ForeignKey
 
-Base = declarative_base()
+class IntegrityError(Exception):
+    """Thrown when a change breaks a unique or foreign key constraint."""
+    pass
 
 class Database:
     """The database connection class."""
+    #pylint: disable=too-many-instance-attributes
     def __init__(self, path="users.db"):
-        self.__engine = sqlalchemy.create_engine('sqlite:///' + path)
-        self.__session = sqlalchemy.orm.sessionmaker()
-        self.__session.configure(bind=self.__engine)
+        # path is a file name for SQLite, or a full database URL
+        self.__url = path if "://" in path else 'sqlite:///' + path
+        self.__path = None if "://" in path else path
+        self.__local = threading.local()
+        self.__engine = None
+        self.__session = None
+        self.__texts = {}
+
+    def __connection(self):
+        """This thread's SQLite connection."""
+        connection = getattr(self.__local, 'connection', None)
+        if connection is None:
+            # Each statement commits on its own.
+            connection = sqlite3.connect(self.__path, timeout=5,
+                                         isolation_level=None)
+            self.__local.connection = connection
+        return connection
+
+    def __sqlalchemy(self):
+        """The SQLAlchemy engine. It is made the first time it is needed,
+        so that processes that don't need it never load SQLAlchemy."""
+        if self.__engine is None:
+            #pylint: disable=import-outside-toplevel
+            import sqlalchemy
+            import sqlalchemy.orm
+            self.__engine = sqlalchemy.create_engine(self.__url)
+            self.__session = sqlalchemy.orm.sessionmaker(bind=self.__engine)
+        return self.__engine
+
+    def __execute(self, sql, params):
+        """Run SQL with named parameters. Returns its rows, or None if it
+        has none, and the number of rows it changed."""
+        if self.__path is not None:
+            try:
+                cursor = self.__connection().execute(sql, params)
+                rows = cursor.fetchall() if cursor.description else None
+                return rows, cursor.rowcount
+            except sqlite3.IntegrityError as error:
+                raise IntegrityError(str(error)) from error
+
+        #pylint: disable=import-outside-toplevel
+        import sqlalchemy
+        engine = self.__sqlalchemy()
+        if sql not in self.__texts:
+            self.__texts[sql] = sqlalchemy.text(sql)
+        try:
+            with engine.begin() as conn:
+                result = conn.execute(self.__texts[sql], params)
+                rows = [tuple(row) for row in result] \
+                    if result.returns_rows else None
+                return rows, result.rowcount
+        except sqlalchemy.exc.IntegrityError as error:
+            raise IntegrityError(str(error)) from error
+
+    def query(self, sql, **params):
+        """Run a query, returning its rows as tuples."""
+        return self.__execute(sql, params)[0]
+
+    def run(self, sql, **params):
+        """Run a statement, returning the number of rows it changed."""
+        return self.__execute(sql, params)[1]
 
     def create(self):
         """Create a database instance.
@@ -22,47 +95,75 @@ class Database:
         Only use this to create a new database if you don't have an
         existing database file.
         """
-        Base.metadata.create_all(self.__engine)
+        #pylint: disable=import-outside-toplevel
+        from gamelaunch import models
+        models.Base.metadata.create_all(self.__sqlalchemy())
 
     def begin(self):
-        """Start a new database session."""
+        """Start a new SQLAlchemy ORM session."""
+        self.__sqlalchemy()
         return self.__session()
 
-class User(Base):
-    """A user row in the users database."""
-    # pylint: disable=too-few-public-methods, no-init
+    def transaction(self):
+        """A connection in a transaction, for bulk Core statements."""
+        return self.__sqlalchemy().begin()
 
-    __tablename__ = 'users'
+    def connect(self):
+        """A plain connection, for statements that manage their own
+        transactions."""
+        return self.__sqlalchemy().connect()
 
-    id = Column(Integer, primary_key=True)
-    username = Column(String, unique=True, index=True)
-    password = Column(String)
-    salt = Column(String)
-    email = Column(String)
-    created = Column(DateTime, default=sqlalchemy.func.now())
+    def dialect(self):
+        """The name of the database dialect."""
+        if self.__path is not None:
+            return 'sqlite'
+        return self.__sqlalchemy().dialect.name
 
-    def __repr__(self):
-        return "<User(id='{}', name='{}', pass='{}', salt='{}')>".format(
-            self.id, self.username, self.password, self.salt)
+    def execute(self, statement):
+        """Run a single Core statement in its own transaction, retrying if
+        the database is busy."""
+        #pylint: disable=import-outside-toplevel
+        from gamelaunch import models
+        def run():
+            with self.__sqlalchemy().begin() as conn:
+                return conn.execute(statement)
+        return models.retry_busy(run)
+
+class UserRow:
+    """A row of the users table."""
+    #pylint: disable=too-few-public-methods
+    __slots__ = ('id', 'username', 'password', 'salt', 'email', 'created')
 
-class Playing(Base):
-    """A row representing a currently playing user."""
-    # pylint: disable=too-few-public-methods, no-init
-    __tablename__ = 'playing'
+    def __init__(self, id=None, username=None, password=None, salt=None,
+                 email=None, created=None):
+        #pylint: disable=redefined-builtin, invalid-name, too-many-arguments
+        self.id = id
+        self.username = username
+        self.password = password
+        self.salt = salt
+        self.email = email
+        self.created = created
+
+    def __repr__(self):
+        return "<User(id='{}', name='{}')>".format(self.id, self.username)
 
-    id = Column(Integer, ForeignKey('users.id'), primary_key=True)
-    since = Column(Integer)
+class PlayingRow:
+    """A row of the playing table."""
+    #pylint: disable=too-few-public-methods
+    __slots__ = ('id', 'since', 'node', 'container', 'host', 'pid')
 
-class Logins(Base):
-    """A row representing a login attempt."""
-    # pylint: disable=too-few-public-methods, no-init
-    __tablename__ = 'logins'
+    def __init__(self, id=None, since=None, node=None, container=None,
+                 host=None, pid=None):
+        #pylint: disable=redefined-builtin, invalid-name, too-many-arguments
+        self.id = id
+        self.since = since
+        self.node = node
+        self.container = container
+        self.host = host
+        self.pid = pid
 
-    id = Column(Integer, primary_key=True)
-    username = Column(String, index=True)
-    success = Column(Boolean, index=True)
-    date = Column(DateTime, default=sqlalchemy.func.now())
-    client = Column(String)
+_USER_COLUMNS = ", ".join("users." + column for column in UserRow.__slots__)
+_PLAYING_COLUMNS = ", ".join(PlayingRow.__slots__)
 
 class CreateUser:
     """Create a new user."""
@@ -76,10 +177,8 @@ class CreateUser:
         self.__hash = create_password(password)
 
     def create(self):
-        """Create the user database row."""
-        return User(username=self.__user,
-                    password=self.__hash,
-                    salt=self.__salt)
+        """Create the user row."""
+        return UserRow(None, self.__user, self.__hash, self.__salt)
 
 def create_password(password):
     """Create a hashed password."""
@@ -94,10 +193,147 @@ def update_password(user, password):
 def create_user(name, password, email):
     """Create a user."""
     salt, digest = create_password(password)
-    return User(username=name, password=digest, salt=salt, email=email)
+    return UserRow(None, name, digest, salt, email)
 
 def add_user(database, user):
-    """Add a user to the database."""
-    session = database.begin()
-    session.add(user)
-    session.commit()
+    """Add a user to the database. Returns the new user's id."""
+    rows = database.query(
+        "INSERT INTO users (username, password, salt, email, created) "
+        "VALUES (:username, :password, :salt, :email, CURRENT_TIMESTAMP) "
+        "RETURNING id",
+        username=user.username, password=user.password, salt=user.salt,
+        email=user.email)
+    user.id = rows[0][0]
+    return user.id
+
+def get_user(database, username):
+    """Get a user by name, or None."""
+    rows = database.query(
+        "SELECT " + _USER_COLUMNS + " FROM users WHERE username = :username",
+        username=username)
+    return UserRow(*rows[0]) if rows else None
+
+def set_password(database, user_id, password):
+    """Change a user's password."""
+    salt, digest = create_password(password)
+    database.run("UPDATE users SET password = :password, salt = :salt "
+                 "WHERE id = :id", password=digest, salt=salt, id=user_id)
+
+def set_email(database, user_id, email):
+    """Change a user's email."""
+    database.run("UPDATE users SET email = :email WHERE id = :id",
+                 email=email, id=user_id)
+
+def start_playing(database, user_id, node=None, container=None, owner=None):
+    """Mark a user as playing container on node, attached to the launcher
+    owner, a (host, pid) pair.
+
+    This is a single conditional insert. Returns False if the user is
+    already playing.
+    """
+    host, pid = owner or (None, None)
+    return database.run(
+        "INSERT INTO playing (id, since, node, container, host, pid) "
+        "VALUES (:id, :since, :node, :container, :host, :pid) "
+        "ON CONFLICT DO NOTHING",
+        id=user_id, since=time.time(), node=node, container=container,
+        host=host, pid=pid) == 1
+
+def claim_playing(database, playing, owner):
+    """Attach the launcher owner to a game that playing says is running.
+
+    The row is only changed if it hasn't changed since it was read, so
+    only one launcher can claim a game. Returns False if another did.
+    """
+    host, pid = owner
+    return database.run(
+        "UPDATE playing SET host = :host, pid = :pid WHERE id = :id "
+        "AND container = :container AND (pid IS NULL OR pid = :old_pid)",
+        host=host, pid=pid, id=playing.id, container=playing.container,
+        old_pid=playing.pid) == 1
+
+def detach_playing(database, user_id):
+    """Mark a user's game as running with no launcher attached."""
+    database.run("UPDATE playing SET pid = NULL WHERE id = :id", id=user_id)
+
+def drop_detached(database, user_id):
+    """Remove a user's playing row if no launcher is attached to it.
+    Returns True if it was removed."""
+    return database.run("DELETE FROM playing WHERE id = :id AND pid IS NULL",
+                        id=user_id) == 1
+
+def detached_playing(database, host):
+    """Get the games started from host that are running detached."""
+    rows = database.query(
+        "SELECT " + _PLAYING_COLUMNS + " FROM playing "
+        "WHERE host = :host AND pid IS NULL AND container IS NOT NULL",
+        host=host)
+    return [PlayingRow(*row) for row in rows]
+
+def stop_playing(database, user_id):
+    """Mark a user as no longer playing."""
+    database.run("DELETE FROM playing WHERE id = :id", id=user_id)
+
+def get_playing(database, user_id):
+    """Get the playing row of a user, or None if they aren't playing."""
+    rows = database.query(
+        "SELECT " + _PLAYING_COLUMNS + " FROM playing WHERE id = :id",
+        id=user_id)
+    return PlayingRow(*rows[0]) if rows else None
+
+def log_login(database, username, success, client):
+    """Record a login attempt."""
+    database.run(
+        "INSERT INTO logins (username, success, date, client) "
+        "VALUES (:username, :success, CURRENT_TIMESTAMP, :client)",
+        username=username, success=success, client=client)
+
+def playing_list(database):
+    """Get the users that are playing, as plain dicts."""
+    rows = database.query(
+        "SELECT playing.id, playing.since, playing.node, users.username "
+        "FROM playing JOIN users ON users.id = playing.id")
+    return [{'id': row[0], 'since': row[1], 'node': row[2],
+             'username': row[3]} for row in rows]
+
+def add_ssh_key(database, user_id, fingerprint, key, comment):
+    """Add an SSH key to a user. Returns False if the key is already
+    registered, to this user or another."""
+    try:
+        database.run(
+            "INSERT INTO ssh_keys (user_id, fingerprint, key, comment, added) "
+            "VALUES (:user_id, :fingerprint, :key, :comment, "
+            "CURRENT_TIMESTAMP)",
+            user_id=user_id, fingerprint=fingerprint, key=key,
+            comment=comment)
+    except IntegrityError:
+        return False
+    return True
+
+def delete_ssh_key(database, user_id, key_id):
+    """Remove one of a user's SSH keys."""
+    database.run("DELETE FROM ssh_keys WHERE id = :id AND user_id = :user_id",
+                 id=key_id, user_id=user_id)
+
+def ssh_keys(database, user_id):
+    """Get a user's SSH keys, as plain dicts, oldest first."""
+    rows = database.query(
+        "SELECT id, fingerprint, key, comment, added FROM ssh_keys "
+        "WHERE user_id = :user_id ORDER BY id", user_id=user_id)
+    return [{'id': row[0], 'fingerprint': row[1], 'key': row[2],
+             'comment': row[3], 'added': row[4]} for row in rows]
+
+def ssh_key_user(database, fingerprint):
+    """Get the user that an SSH key belongs to, or None."""
+    rows = database.query(
+        "SELECT " + _USER_COLUMNS + " FROM users "
+        "JOIN ssh_keys ON ssh_keys.user_id = users.id "
+        "WHERE ssh_keys.fingerprint = :fingerprint", fingerprint=fingerprint)
+    return UserRow(*rows[0]) if rows else None
+
+def ssh_key_line(database, fingerprint):
+    """Get the public key with a fingerprint, or None."""
+    rows = database.query(
+        "SELECT key FROM ssh_keys WHERE fingerprint = :fingerprint",
+        fingerprint=fingerprint)
+    return rows[0][0] if rows else None
@@ -0,0 +1,256 @@
+"""Checks of everything a launcher host depends on.
+
+Each probe measures one thing: how long the database's write lock takes to
+get, how fast each docker engine answers and whether it has the games'
+images, whether the recorder takes connections, how much disk is left
+where recordings and saves go, and how long a password takes to hash. The
+measurement is graded pass, warn or fail against a pair of thresholds,
+which the doctor section of the config can change.
+
+The probes run at the same time, each in a daemon thread, so the whole
+check takes about as long as the slowest probe. Any probe that hasn't
+finished by the timeout is failed and left behind.
+"""
+
+import collections
+import os
+import socket
+import sqlite3
+import threading
+import time
+from gamelaunch import db
+from gamelaunch import engine
+from gamelaunch import placement
+
+PASS = 'pass'
+WARN = 'warn'
+FAIL = 'fail'
+
+# In order of how bad they are.
+STATUSES = [PASS, WARN, FAIL]
+
+# The default warn and fail thresholds of each probe. Times are in seconds,
+# disk is the fraction of the filesystem that is free.
+THRESHOLDS = {
+    'database': (0.1, 1.0),
+    'docker': (0.2, 2.0),
+    'recorder': (0.1, 1.0),
+    'disk': (0.1, 0.02),
+    'bcrypt': (0.5, 2.0),
+}
+
+Probe = collections.namedtuple('Probe', ['name', 'function', 'arguments'])
+Probe.__doc__ = """A check to run, called as function(*arguments)."""
+
+def grade(value, warn, fail):
+    """The status of a measurement. Larger values are worse, unless the
+    fail threshold is below the warn threshold."""
+    if fail < warn:
+        value, warn, fail = -value, -warn, -fail
+    if value >= fail:
+        return FAIL
+    if value >= warn:
+        return WARN
+    return PASS
+
+def _millis(seconds):
+    """Format a time."""
+    return "{:.1f} ms".format(seconds * 1000)
+
+def probe_database(path, limits, attempts=5):
+    """Time taking the database's write lock a few times."""
+    if "://" in path:
+        database = db.Database(path)
+        start = time.monotonic()
+        database.query("SELECT 1")
+        took = time.monotonic() - start
+        return grade(took, *limits), took, "answered in " + _millis(took)
+
+    if not os.path.exists(path):
+        return FAIL, None, "there is no database at " + path
+    # Waiting longer than the fail threshold would only fail anyway.
+    connection = sqlite3.connect(path, timeout=limits[1],
+                                 isolation_level=None)
+    waits = []
+    try:
+        for _ in range(attempts):
+            start = time.monotonic()
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("ROLLBACK")
+            waits.append(time.monotonic() - start)
+    except sqlite3.OperationalError as error:
+        return FAIL, None, "write lock not taken: {}".format(error)
+    finally:
+        connection.close()
+    worst = max(waits)
+    return grade(worst, *limits), worst, \
+        "write lock taken in {} at worst".format(_millis(worst))
+
+def probe_docker(client, limits):
+    """Time a ping of a docker engine."""
+    start = time.monotonic()
+    try:
+        answered = client.ping()
+    except engine.EngineError as error:
+        return FAIL, None, "{}: {}".format(client.url(), error)
+    took = time.monotonic() - start
+    if not answered:
+        return FAIL, took, client.url() + " didn't answer the ping"
+    return grade(took, *limits), took, \
+        "{} answered in {}".format(client.url(), _millis(took))
+
+def probe_images(client, images):
+    """Check that a docker engine has every game's image."""
+    try:
+        missing = [image for image in images if client.image(image) is None]
+    except engine.EngineError as error:
+        return FAIL, None, "{}: {}".format(client.url(), error)
+    if missing:
+        return FAIL, len(missing), "missing " + ", ".join(missing)
+    return PASS, 0, "has all {} images".format(len(images))
+
+def probe_recorder(host, port, limits):
+    """Time connecting to the recorder."""
+    start = time.monotonic()
+    try:
+        connection = socket.create_connection((host, port), limits[1])
+    except OSError as error:
+        return FAIL, None, "{}:{}: {}".format(host, port, error)
+    took = time.monotonic() - start
+    connection.close()
+    return grade(took, *limits), took, \
+        "{}:{} connected in {}".format(host, port, _millis(took))
+
+def probe_disk(path, limits):
+    """Check the free space of the filesystem a path is on."""
+    # Templates are checked up to the first part that depends on the user.
+    path = path.split("{{", 1)[0]
+    while path and not os.path.isdir(path):
+        path = os.path.dirname(path.rstrip("/"))
+    path = path or "."
+    stat = os.statvfs(path)
+    free = stat.f_bavail / stat.f_blocks if stat.f_blocks else 0.0
+    return grade(free, *limits), free, "{}: {:.0f}% free, {:.1f} GB".format(
+        path, free * 100, stat.f_bavail * stat.f_frsize / 1e9)
+
+def probe_bcrypt(limits):
+    """Time hashing a password the way a new user's is hashed."""
+    start = time.monotonic()
+    db.create_password("doctor")
+    took = time.monotonic() - start
+    return grade(took, *limits), took, "hashed in " + _millis(took)
+
+def probes_from_config(config):
+    """The probes for the launcher described by config."""
+    options = config.get('doctor', {})
+    limits = {name: tuple(options.get(name, default))
+              for name, default in THRESHOLDS.items()}
+
+    probes = [
+        Probe('database', probe_database,
+              (config.get('database', "users.db"), limits['database'])),
+        Probe('bcrypt', probe_bcrypt, (limits['bcrypt'],)),
+    ]
+
+    images = sorted({game['image'] for game in config['games']
+                     if 'image' in game})
+    nodes = placement.from_config(config, None).nodes()
+    if not nodes:
+        nodes = [placement.GameNode(
+            'local', config.get('engine', engine.DEFAULT_URL), 0)]
+    for node in nodes:
+        client = engine.Engine(node.engine, limits['docker'][1])
+        probes.append(Probe('docker ' + node.name, probe_docker,
+                            (client, limits['docker'])))
+        probes.append(Probe('images ' + node.name, probe_images,
+                            (client, images)))
+
+    if 'recorder' in config:
+        recorder = config['recorder']
+        probes.append(Probe('recorder', probe_recorder,
+                            (recorder['host'], recorder['port'],
+                             limits['recorder'])))
+
+    paths = []
+    for game in config['games']:
+        for key in ('recordings', 'root'):
+            if key in game and game[key] not in paths:
+                paths.append(game[key])
+    for path in paths:
+        probes.append(Probe('disk ' + path, probe_disk,
+                            (path, limits['disk'])))
+    return probes
+
+def _run(probe, slot):
+    """Run one probe, putting its result in slot['result']."""
+    start = time.monotonic()
+    try:
+        status, value, message = probe.function(*probe.arguments)
+    #pylint: disable=broad-except
+    except Exception as error:
+        status, value, message = FAIL, None, "{}: {}".format(
+            type(error).__name__, error)
+    # One assignment, so the result is seen whole or not at all.
+    slot['result'] = {
+        'name': probe.name,
+        'status': status,
+        'value': value,
+        'message': message,
+        'seconds': time.monotonic() - start,
+    }
+
+def run(probes, timeout=10.0):
+    """Run the probes at the same time. Returns a report with the results
+    in the same order as the probes.
+
+    Each thread has a slot of its own, and only results that are in their
+    slot by the timeout are copied into the report, so a probe that
+    finishes late can't change a report that has already been made.
+    """
+    start = time.monotonic()
+    slots = [{} for _ in probes]
+    threads = []
+    for probe, slot in zip(probes, slots):
+        thread = threading.Thread(target=_run, args=(probe, slot),
+                                  daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    deadline = start + timeout
+    for thread in threads:
+        thread.join(max(deadline - time.monotonic(), 0))
+
+    results = []
+    for probe, slot in zip(probes, slots):
+        result = slot.get('result')
+        if result is None:
+            result = {
+                'name': probe.name,
+                'status': FAIL,
+                'value': None,
+                'message': "didn't finish in {:g} s".format(timeout),
+                'seconds': timeout,
+            }
+        results.append(dict(result))
+
+    return {
+        'status': max((result['status'] for result in results),
+                      key=STATUSES.index, default=PASS),
+        'seconds': time.monotonic() - start,
+        'probes': results,
+    }
+
+def format_report(report):
+    """A report as lines of text."""
+    width = max([len(result['name']) for result in report['probes']] + [0])
+    lines = []
+    for result in report['probes']:
+        lines.append("{:4}  {:{}}  {:>9}  {}".format(
+            result['status'].upper(), result['name'], width,
+            _millis(result['seconds']), result['message']))
+    counts = collections.Counter(result['status']
+                                 for result in report['probes'])
+    lines.append("")
+    lines.append("{} passed, {} warned, {} failed in {:.2f} s".format(
+        counts[PASS], counts[WARN], counts[FAIL], report['seconds']))
+    return lines
@@ -0,0 +1,224 @@
+"""A text buffer for the built in options editor.
+
+The buffer is a gap buffer of lines, with the gap at the cursor's line.
+The lines above the cursor are on one stack and the lines below it are on
+another, in reverse, so moving the cursor a line moves one line between
+the stacks. The cursor's line is itself a gap buffer of characters. So a
+key press costs about the length of one line, however big the file is,
+and nothing copies the whole buffer until it is saved.
+"""
+
+import os
+import re
+
+class LineBuffer:
+    """An editable text, with a cursor."""
+    #pylint: disable=too-many-instance-attributes
+    def __init__(self, text=""):
+        lines = text.split("\n")
+        self.__above = []
+        self.__below = lines[:0:-1]
+        self.__left = []
+        self.__right = list(reversed(lines[0]))
+        self.__goal = 0
+        self.modified = False
+
+    def __len__(self):
+        return len(self.__above) + 1 + len(self.__below)
+
+    def row(self):
+        """The cursor's line number."""
+        return len(self.__above)
+
+    def column(self):
+        """The cursor's position in its line."""
+        return len(self.__left)
+
+    def line(self, row):
+        """The text of line row."""
+        above = len(self.__above)
+        if row < above:
+            return self.__above[row]
+        if row == above:
+            return "".join(self.__left) + "".join(reversed(self.__right))
+        return self.__below[above - row]
+
+    def lines(self):
+        """Every line, in order."""
+        for line in self.__above:
+            yield line
+        yield self.line(self.row())
+        for line in reversed(self.__below):
+            yield line
+
+    def text(self):
+        """The whole text."""
+        return "\n".join(self.lines())
+
+    def __load(self, line, column):
+        """Make line the cursor's line, with the cursor at column."""
+        column = min(column, len(line))
+        self.__left = list(line[:column])
+        self.__right = list(reversed(line[column:]))
+
+    def up(self):
+        """Move up a line."""
+        if self.__above:
+            self.__below.append(self.line(self.row()))
+            self.__load(self.__above.pop(), self.__goal)
+
+    def down(self):
+        """Move down a line."""
+        if self.__below:
+            self.__above.append(self.line(self.row()))
+            self.__load(self.__below.pop(), self.__goal)
+
+    def goto(self, row):
+        """Move to line row, keeping the column if possible."""
+        row = max(0, min(row, len(self) - 1))
+        while self.row() > row:
+            self.up()
+        while self.row() < row:
+            self.down()
+
+    def left(self):
+        """Move left a character, or to the end of the line above."""
+        if self.__left:
+            self.__right.append(self.__left.pop())
+        elif self.__above:
+            self.__goal = len(self.__above[-1])
+            self.up()
+            return
+        self.__goal = self.column()
+
+    def right(self):
+        """Move right a character, or to the start of the line below."""
+        if self.__right:
+            self.__left.append(self.__right.pop())
+        elif self.__below:
+            self.__goal = 0
+            self.down()
+            return
+        self.__goal = self.column()
+
+    def home(self):
+        """Move to the start of the line."""
+        self.__right.extend(reversed(self.__left))
+        self.__left = []
+        self.__goal = 0
+
+    def end(self):
+        """Move to the end of the line."""
+        self.__left.extend(reversed(self.__right))
+        self.__right = []
+        self.__goal = self.column()
+
+    def insert(self, char):
+        """Insert a character before the cursor."""
+        if char == "\n":
+            self.__above.append("".join(self.__left))
+            self.__left = []
+        else:
+            self.__left.append(char)
+        self.__goal = self.column()
+        self.modified = True
+
+    def backspace(self):
+        """Delete the character before the cursor."""
+        if self.__left:
+            self.__left.pop()
+        elif self.__above:
+            self.__left = list(self.__above.pop())
+        else:
+            return
+        self.__goal = self.column()
+        self.modified = True
+
+    def delete(self):
+        """Delete the character under the cursor."""
+        if self.__right:
+            self.__right.pop()
+        elif self.__below:
+            self.__right = list(reversed(self.__below.pop()))
+        else:
+            return
+        self.modified = True
+
+    def delete_line(self):
+        """Delete the cursor's line."""
+        if self.__below:
+            self.__load(self.__below.pop(), 0)
+        elif self.__above:
+            self.__load(self.__above.pop(), 0)
+        else:
+            self.__load("", 0)
+        self.__goal = 0
+        self.modified = True
+
+def load(path):
+    """Load a file into a buffer. A missing file gives an empty buffer."""
+    try:
+        with open(path, encoding='utf-8', errors='surrogateescape',
+                  newline='') as file:
+            return LineBuffer(file.read())
+    except FileNotFoundError:
+        return LineBuffer()
+
+def save(path, buf):
+    """Save a buffer, replacing the file atomically."""
+    directory, name = os.path.split(os.path.abspath(path))
+    temp = os.path.join(directory, ".{}.{}".format(name, os.getpid()))
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o644
+
+    try:
+        with open(temp, "w", encoding='utf-8', errors='surrogateescape',
+                  newline='') as file:
+            first = True
+            for line in buf.lines():
+                if not first:
+                    file.write("\n")
+                file.write(line)
+                first = False
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temp, mode)
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
+    buf.modified = False
+
+# The directives a NetHack 3.6 config file can have.
+NETHACKRC_DIRECTIVES = {
+    'OPTIONS', 'OPTION', 'AUTOCOMPLETE', 'AUTOPICKUP_EXCEPTION', 'BIND',
+    'BOULDER', 'CHOOSE', 'MENUCOLOR', 'MSGTYPE', 'ROGUESYMSET', 'SOUND',
+    'SOUNDDIR', 'SYMBOLS', 'SYMSET', 'WARNINGS', 'WIZKIT',
+}
+
+NETHACKRC_LINE = re.compile(r'^\s*([A-Za-z_]+)\s*[=:]')
+
+def check_nethackrc(lines):
+    """Check the directives of a .nethackrc. Returns (line, problem)
+    pairs."""
+    problems = []
+    for number, line in enumerate(lines, 1):
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#") or \
+                stripped.startswith("["):
+            continue
+        match = NETHACKRC_LINE.match(line)
+        if match is None:
+            problems.append((number, "not a directive"))
+        elif match.group(1).upper() not in NETHACKRC_DIRECTIVES:
+            problems.append((number, "unknown directive {}".format(
+                match.group(1))))
+    return problems
+
+# Validators for the options_syntax setting of a game.
+VALIDATORS = {
+    'nethackrc': check_nethackrc,
+}
@@ -0,0 +1,118 @@
+"""A minimal Docker Engine API client.
+
+Talking to the engine over its socket costs one HTTP request, where the
+docker CLI costs a fork, an exec and a large Go binary starting up. The
+launcher uses this for the small control operations it needs while a game
+is running.
+"""
+
+import http.client
+import json
+import socket
+import urllib.parse
+
+DEFAULT_URL = "unix:///var/run/docker.sock"
+
+class EngineError(Exception):
+    """Thrown when the engine can't be reached or refuses a request."""
+    pass
+
+class _UnixConnection(http.client.HTTPConnection):
+    """An HTTP connection over a Unix socket."""
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.__path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.__path)
+        self.sock = sock
+
+class Engine:
+    """A connection to a docker engine."""
+    def __init__(self, url=DEFAULT_URL, timeout=5.0):
+        self.__url = url
+        self.__timeout = timeout
+
+    def url(self):
+        """The engine endpoint."""
+        return self.__url
+
+    def __connect(self):
+        """Open a connection to the engine."""
+        parsed = urllib.parse.urlparse(self.__url)
+        if parsed.scheme == "unix":
+            return _UnixConnection(parsed.path, self.__timeout)
+        return http.client.HTTPConnection(parsed.hostname, parsed.port or 2375,
+                                          timeout=self.__timeout)
+
+    def request(self, method, path, body=None):
+        """Make a request, returning the status and decoded JSON body."""
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = "application/json"
+
+        conn = self.__connect()
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException) as error:
+            raise EngineError(str(error))
+        finally:
+            conn.close()
+
+        if response.status >= 500:
+            raise EngineError("{} {}: {}".format(
+                response.status, path, data.decode('utf-8', 'replace')))
+
+        if data and response.getheader('Content-Type', "").startswith(
+                "application/json"):
+            return response.status, json.loads(data.decode('utf-8'))
+        return response.status, data
+
+    def ping(self):
+        """Check that the engine is answering."""
+        status, _ = self.request("GET", "/_ping")
+        return status == 200
+
+    def containers(self):
+        """List the running containers."""
+        _, data = self.request("GET", "/containers/json")
+        return data
+
+    def kill(self, container, sig="SIGHUP"):
+        """Send a signal to a container. Returns False if it isn't running."""
+        status, _ = self.request(
+            "POST", "/containers/{}/kill?signal={}".format(
+                urllib.parse.quote(container), sig))
+        return status == 204
+
+    def inspect(self, container):
+        """Get the state of a container, or None if there is no such
+        container."""
+        status, data = self.request(
+            "GET", "/containers/{}/json".format(urllib.parse.quote(container)))
+        if status == 404:
+            return None
+        return data
+
+    def image(self, name):
+        """Get the details of an image, or None if the engine doesn't have
+        it."""
+        status, data = self.request(
+            "GET", "/images/{}/json".format(urllib.parse.quote(name)))
+        if status == 404:
+            return None
+        return data
+
+    def running(self, container):
+        """Is a container running."""
+        state = self.inspect(container)
+        return state is not None and state['State']['Running']
+
+def from_config(config):
+    """Create the engine client from the config."""
+    return Engine(config.get('engine', DEFAULT_URL))
@@ -0,0 +1,209 @@
+"""Structured launcher event log.
+
+Events are written as one JSON object per line. Lines are buffered in memory
+and appended to the log with a single write on an O_APPEND descriptor, so
+concurrent launcher processes never interleave partial lines. The log is
+rotated by size and by time, with rotation serialised between processes by
+an flock on a side lock file.
+"""
+
+import fcntl
+import json
+import os
+import time
+import uuid
+
+class EventLog:
+    """A buffered, rotating JSON lines log shared between processes."""
+    #pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(self, path, max_bytes=0, backups=5, interval=0,
+                 buffer_size=8192, flush_interval=1.0):
+        self.__path = path
+        self.__max_bytes = max_bytes
+        self.__backups = backups
+        self.__interval = interval
+        self.__buffer_size = buffer_size
+        self.__flush_interval = flush_interval
+        self.__buffer = []
+        self.__buffered = 0
+        self.__last_flush = time.monotonic()
+        self.__pid = os.getpid()
+        self.__fd = None
+        self.__bucket = None
+
+    def __open(self):
+        """Open the log file for appending."""
+        self.__fd = os.open(self.__path,
+                            os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        info = os.fstat(self.__fd)
+        if self.__interval > 0:
+            stamp = info.st_mtime if info.st_size > 0 else time.time()
+            self.__bucket = int(stamp // self.__interval)
+
+    def __close_fd(self):
+        """Close the current log file descriptor."""
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+    def write(self, record):
+        """Add a record to the log buffer."""
+        record.setdefault('time', round(time.time(), 6))
+        record.setdefault('pid', os.getpid())
+        line = json.dumps(record, default=str) + "\n"
+        self.__buffer.append(line)
+        self.__buffered += len(line)
+
+        if self.__buffered >= self.__buffer_size or \
+                time.monotonic() - self.__last_flush >= self.__flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write out any buffered records."""
+        # A forked child that never exec'd must not write out the
+        # parent's buffer a second time.
+        if os.getpid() != self.__pid:
+            self.__buffer = []
+            self.__buffered = 0
+            return
+
+        self.__last_flush = time.monotonic()
+        if not self.__buffer:
+            return
+
+        data = "".join(self.__buffer).encode('utf-8')
+        self.__buffer = []
+        self.__buffered = 0
+
+        try:
+            if self.__fd is None:
+                self.__open()
+            self.__maybe_rotate()
+            os.write(self.__fd, data)
+        except OSError:
+            # Logging must never take the launcher down.
+            self.__close_fd()
+
+    def close(self):
+        """Flush and close the log."""
+        self.flush()
+        self.__close_fd()
+
+    def __should_rotate(self):
+        """Decide if the file we hold open is due for rotation."""
+        if self.__max_bytes > 0 and \
+                os.fstat(self.__fd).st_size >= self.__max_bytes:
+            return True
+
+        if self.__interval > 0:
+            return int(time.time() // self.__interval) != self.__bucket
+
+        return False
+
+    def __maybe_rotate(self):
+        """Rotate the log if it has grown too big or too old."""
+        if not self.__should_rotate():
+            return
+
+        with open(self.__path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another process may have rotated while we waited for the lock.
+            if self.__is_current() and self.__should_rotate():
+                self.__rotate_files()
+            self.__close_fd()
+            self.__open()
+
+    def __is_current(self):
+        """Check that our descriptor still refers to the file at path."""
+        try:
+            on_disk = os.stat(self.__path)
+        except FileNotFoundError:
+            return False
+        held = os.fstat(self.__fd)
+        return (on_disk.st_dev, on_disk.st_ino) == (held.st_dev, held.st_ino)
+
+    def __rotate_files(self):
+        """Shift path.N-1 to path.N and path to path.1."""
+        if self.__backups <= 0:
+            os.unlink(self.__path)
+            return
+
+        for i in range(self.__backups - 1, 0, -1):
+            source = "{}.{}".format(self.__path, i)
+            if os.path.exists(source):
+                os.replace(source, "{}.{}".format(self.__path, i + 1))
+        os.replace(self.__path, self.__path + ".1")
+
+class SessionLog:
+    """Tags events with a session id and user, and times session phases."""
+    def __init__(self, eventlog, started=None):
+        self.__log = eventlog
+        self.__session = uuid.uuid4().hex[:16]
+        self.__user = None
+        if started is None:
+            started = time.monotonic()
+        self.__started = started
+
+    def session_id(self):
+        """Get the id of this session."""
+        return self.__session
+
+    def set_user(self, user):
+        """Set the user that subsequent events belong to."""
+        self.__user = user
+
+    def elapsed(self):
+        """Seconds since the session started."""
+        return time.monotonic() - self.__started
+
+    def event(self, event, **fields):
+        """Log an event for this session."""
+        record = {'session': self.__session, 'user': self.__user,
+                  'event': event}
+        record.update(fields)
+        self.__log.write(record)
+
+    def phase_done(self, phase, duration, **fields):
+        """Log the duration of a completed phase."""
+        self.event('phase', phase=phase, duration=round(duration, 6),
+                   **fields)
+
+    def phase(self, phase, **fields):
+        """A context manager that times a phase of the session."""
+        return _Phase(self, phase, fields)
+
+    def flush(self):
+        """Flush the underlying log."""
+        self.__log.flush()
+
+class _Phase:
+    """Times the body of a with statement and logs it as a phase."""
+    #pylint: disable=too-few-public-methods
+    def __init__(self, session, phase, fields):
+        self.__session = session
+        self.__phase = phase
+        self.__fields = fields
+        self.__start = None
+
+    def __enter__(self):
+        self.__start = time.monotonic()
+        return self.__fields
+
+    def __exit__(self, exc_type, *_):
+        fields = self.__fields
+        if exc_type is not None:
+            fields['error'] = exc_type.__name__
+        self.__session.phase_done(self.__phase,
+                                  time.monotonic() - self.__start, **fields)
+        return False
+
+def from_config(config):
+    """Create an event log from the log section of gamelaunch.yml."""
+    options = config.get('log', {})
+    return EventLog(
+        options.get('path', "/home/pygame/gamelaunch.log"),
+        max_bytes=options.get('max_bytes', 0),
+        backups=options.get('backups', 5),
+        interval=options.get('rotate_interval', 0),
+        buffer_size=options.get('buffer_size', 8192),
+        flush_interval=options.get('flush_interval', 1.0))
@@ -0,0 +1,249 @@
+"""Game statistics from xlogfiles and livelogs.
+
+NetHack appends a line to its xlogfile for each finished game, and to its
+livelog for notable events during a game. The ingester tails these files
+for each game in the config and loads new lines into the game_records and
+live_events tables. How far each file has been read is kept in the
+log_offsets table, so old data is never read again. A file that has been
+rotated or truncated is read from the start.
+
+Each chunk of lines is inserted with executemany, in the same transaction
+that moves the file's offset on. The offset is only moved on from the
+value that was read, so if two ingesters read the same chunk one of them
+rolls back, and no game is counted twice. The same transaction adds the
+chunk's games to the running totals in user_stats and game_stats, which
+is all that the leaderboard reads.
+"""
+
+import collections
+import os
+import sqlalchemy
+from gamelaunch import models
+from gamelaunch import stats
+
+# Columns of game_records and live_events, and the log fields they come from.
+XLOG_FIELDS = {
+    'name': 'name', 'points': 'points', 'turns': 'turns',
+    'maxlvl': 'maxlvl', 'role': 'role', 'race': 'race',
+    'gender': 'gender', 'align': 'align', 'death': 'death',
+    'realtime': 'realtime', 'starttime': 'starttime', 'endtime': 'endtime',
+    'version': 'version',
+}
+LIVELOG_FIELDS = {
+    'name': 'name', 'type': 'lltype', 'turns': 'turns', 'time': 'curtime',
+    'message': 'message',
+}
+INTEGERS = {'points', 'turns', 'maxlvl', 'realtime', 'starttime', 'endtime',
+            'type', 'time'}
+
+LogFile = collections.namedtuple('LogFile', ['game', 'path', 'kind'])
+LogFile.__doc__ = """A game's xlogfile or livelog."""
+
+class _Raced(Exception):
+    """Another ingester read the same chunk first."""
+    pass
+
+def parse_line(line):
+    """Split an xlogfile or livelog line into a dict of its fields."""
+    separator = "\t" if "\t" in line else ":"
+    fields = {}
+    for part in line.split(separator):
+        key, equals, value = part.partition("=")
+        if equals:
+            fields[key] = value
+    return fields
+
+def _integer(value):
+    """Parse a decimal or hex log field, None if it is neither."""
+    for base in (10, 16):
+        try:
+            return int(value, base)
+        except ValueError:
+            pass
+    return None
+
+def to_row(game, fields, columns):
+    """Turn parsed log fields into a table row, or None if it's unusable."""
+    if not fields.get('name'):
+        return None
+    row = {'game': game}
+    for column, field in columns.items():
+        value = fields.get(field)
+        if value is not None and column in INTEGERS:
+            value = _integer(value)
+        row[column] = value
+    if row.get('message') is None and 'achieve' in fields:
+        row['message'] = fields['achieve']
+    return row
+
+def read_chunk(path, offset, inode, size):
+    """Read whole lines from path starting at offset.
+
+    Returns the data, the offset it started at, the offset after it and the
+    inode of the file. The start is 0 if the file has been replaced or
+    truncated since it was last read.
+    """
+    with open(path, "rb") as file:
+        stat = os.fstat(file.fileno())
+        if stat.st_ino != inode or stat.st_size < offset:
+            offset = 0
+        file.seek(offset)
+        data = file.read(size)
+        # Leave a partly written last line for the next read.
+        while data and not data.endswith(b"\n"):
+            more = file.read(size)
+            if not more:
+                data = data[:data.rfind(b"\n") + 1]
+                break
+            data += more
+    return data, offset, offset + len(data), stat.st_ino
+
+def _larger(column, value):
+    """The larger of a column and a value, in any SQL dialect."""
+    return sqlalchemy.case((column.is_(None), value), (column < value, value),
+                           else_=column)
+
+def _add_totals(conn, game, rows):
+    """Add a chunk of finished games to the running totals."""
+    users = {}
+    for row in rows:
+        points = row['points'] or 0
+        total = users.setdefault(row['name'], {
+            'games': 0, 'points': 0, 'best': 0, 'wins': 0, 'turns': 0,
+            'last': 0})
+        total['games'] += 1
+        total['points'] += points
+        total['best'] = max(total['best'], points)
+        total['wins'] += 1 if row['death'] == "ascended" else 0
+        total['turns'] += row['turns'] or 0
+        total['last'] = max(total['last'], row['endtime'] or 0)
+
+    user_stats = models.UserStats.__table__
+    new_players = 0
+    for name, total in users.items():
+        result = conn.execute(user_stats.update().where(
+            (user_stats.c.game == game) & (user_stats.c.name == name)).values(
+                games=user_stats.c.games + total['games'],
+                points=user_stats.c.points + total['points'],
+                best=_larger(user_stats.c.best, total['best']),
+                wins=user_stats.c.wins + total['wins'],
+                turns=user_stats.c.turns + total['turns'],
+                last=_larger(user_stats.c.last, total['last'])))
+        if result.rowcount == 0:
+            conn.execute(user_stats.insert().values(game=game, name=name,
+                                                    **total))
+            new_players += 1
+
+    best_name, best = max(((name, total['best'])
+                           for name, total in users.items()),
+                          key=lambda pair: pair[1])
+    game_stats = models.GameStats.__table__
+    totals = {
+        'games': sum(total['games'] for total in users.values()),
+        'points': sum(total['points'] for total in users.values()),
+        'wins': sum(total['wins'] for total in users.values()),
+    }
+    result = conn.execute(game_stats.update().where(
+        game_stats.c.game == game).values(
+            players=game_stats.c.players + new_players,
+            games=game_stats.c.games + totals['games'],
+            points=game_stats.c.points + totals['points'],
+            wins=game_stats.c.wins + totals['wins'],
+            best_name=sqlalchemy.case((game_stats.c.best < best, best_name),
+                                      else_=game_stats.c.best_name),
+            best=_larger(game_stats.c.best, best)))
+    if result.rowcount == 0:
+        conn.execute(game_stats.insert().values(
+            game=game, players=new_players, best=best, best_name=best_name,
+            **totals))
+
+class Ingester:
+    """Loads new lines from game logs into the database."""
+    def __init__(self, database, logs, chunk_size=1 << 20):
+        self.__database = database
+        self.__logs = logs
+        self.__chunk_size = chunk_size
+        self.skipped = 0
+
+    def ingest(self):
+        """Read everything new in every log. Returns the number of lines
+        loaded."""
+        loaded = 0
+        for log in self.__logs:
+            if os.path.exists(log.path):
+                loaded += self.__ingest(log)
+        return loaded
+
+    def __ingest(self, log):
+        """Read everything new in one log."""
+        offsets = models.LogOffset.__table__
+        insert = models.insert_or_ignore(self.__database, models.LogOffset)
+        if insert is not None:
+            self.__database.execute(insert.values(path=log.path, offset=0))
+        else:
+            try:
+                self.__database.execute(offsets.insert().values(
+                    path=log.path, offset=0))
+            except sqlalchemy.exc.IntegrityError:
+                pass
+
+        loaded = 0
+        while True:
+            try:
+                count = models.retry_busy(lambda: self.__chunk(log))
+            except _Raced:
+                break
+            if count is None:
+                break
+            loaded += count
+        return loaded
+
+    def __chunk(self, log):
+        """Load one chunk of a log, or return None if there is nothing
+        new."""
+        offsets = models.LogOffset.__table__
+        with self.__database.transaction() as conn:
+            inode, offset = conn.execute(sqlalchemy.select(
+                offsets.c.inode, offsets.c.offset).where(
+                    offsets.c.path == log.path)).first()
+            data, _, end, new_inode = read_chunk(
+                log.path, offset, inode, self.__chunk_size)
+            if end == offset and new_inode == inode:
+                return None
+
+            columns, model = (XLOG_FIELDS, models.GameRecord) \
+                if log.kind == 'xlog' else (LIVELOG_FIELDS, models.LiveEvent)
+            rows = []
+            for line in data.decode('utf-8', 'replace').splitlines():
+                row = to_row(log.game, parse_line(line), columns)
+                if row is None:
+                    self.skipped += 1
+                else:
+                    rows.append(row)
+
+            if rows:
+                conn.execute(model.__table__.insert(), rows)
+                if log.kind == 'xlog':
+                    _add_totals(conn, log.game, rows)
+
+            result = conn.execute(offsets.update().where(
+                (offsets.c.path == log.path) & (offsets.c.offset == offset) &
+                (offsets.c.inode == inode)).values(
+                    offset=end, inode=new_inode))
+            if result.rowcount != 1:
+                raise _Raced()
+        return len(rows)
+
+def logs_from_config(config):
+    """The logs of every game that has a root directory."""
+    logs = []
+    for game in config['games']:
+        if 'root' not in game:
+            continue
+        options = game.get('stats', {})
+        for kind, default in (('xlog', "game/xlogfile"),
+                              ('livelog', "game/livelog")):
+            path = options.get(kind + "file", default)
+            logs.append(LogFile(stats.game_key(game),
+                                os.path.join(game['root'], path), kind))
+    return logs
@@ -0,0 +1,376 @@
+"""A WebSocket gateway for watching games from a browser.
+
+GET /games returns the games being played, as JSON, from the playing
+table. GET /watch/<user> upgrades to a WebSocket, and streams the terminal
+output of that user's game as binary messages, for a terminal emulator
+such as xterm.js to draw.
+
+Each game has one upstream, a recorder client, however many people are
+watching it. Its output is fed into a screen model as well as to every
+viewer, so a viewer that joins part way through is first sent the screen
+as it is. Each viewer has a buffer of at most buffer bytes. When a viewer
+can't keep up and its buffer fills, what is buffered is thrown away and
+the viewer is sent the whole screen once it catches up, instead. A slow
+viewer never holds up the upstream or the other viewers.
+
+Everything runs in one asyncio loop, so a single core can serve thousands
+of viewers.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import socket
+import struct
+import time
+from gamelaunch import db
+from gamelaunch import screen
+
+GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+# Viewers only send control messages, which are small.
+MAX_MESSAGE = 4096
+
+# Keep little in each connection's transport and socket, so that a viewer
+# that falls behind does so in its own buffer, where it can be thrown away.
+WRITE_BUFFER = 16384
+SEND_BUFFER = 65536
+
+class ProtocolError(Exception):
+    """Thrown for a client that breaks the WebSocket protocol."""
+    pass
+
+def accept_key(key):
+    """The Sec-WebSocket-Accept for a Sec-WebSocket-Key."""
+    return base64.b64encode(hashlib.sha1(key + GUID).digest())
+
+def encode_frame(opcode, payload):
+    """A final, unmasked frame, as servers send them."""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+async def read_frame(reader):
+    """Read a frame from a client. Returns (opcode, payload)."""
+    first, second = await reader.readexactly(2)
+    if not second & 0x80:
+        raise ProtocolError("client frames must be masked")
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack("!Q", await reader.readexactly(8))
+    if length > MAX_MESSAGE:
+        raise ProtocolError("message too long")
+    mask = await reader.readexactly(4)
+    data = await reader.readexactly(length)
+    payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(data))
+    return first & 0x0F, payload
+
+class Viewer:
+    """One browser watching a game."""
+    def __init__(self, writer, limit):
+        self.writer = writer
+        self.__limit = limit
+        # frames shared with the other viewers, and their total size
+        self.__frames = []
+        self.__size = 0
+        # Send the whole screen next, instead of what is buffered.
+        self.__resync = True
+        self.__wake = asyncio.Event()
+        self.__wake.set()
+        self.closed = False
+        self.resyncs = 0
+
+    def push(self, frame):
+        """Queue a frame of output for the viewer, without waiting."""
+        if self.__resync:
+            return
+        if self.__size + len(frame) > self.__limit:
+            self.__frames = []
+            self.__size = 0
+            self.__resync = True
+            self.resyncs += 1
+        else:
+            self.__frames.append(frame)
+            self.__size += len(frame)
+        self.__wake.set()
+
+    def close(self):
+        """Stop sending to the viewer, once it has what is queued."""
+        self.closed = True
+        self.__wake.set()
+
+    async def send(self, upstream):
+        """Send output to the viewer until it is closed."""
+        while True:
+            await self.__wake.wait()
+            self.__wake.clear()
+            if self.closed and not self.__frames and not self.__resync:
+                return
+            if self.__resync:
+                frames = [upstream.snapshot()]
+                self.__resync = False
+            else:
+                frames = self.__frames
+            self.__frames = []
+            self.__size = 0
+            if frames:
+                self.writer.writelines(frames)
+                await self.writer.drain()
+            if self.closed:
+                self.__wake.set()
+
+class Upstream:
+    """The output of one game, shared by everyone watching it."""
+    def __init__(self, user, command, rows, columns):
+        self.user = user
+        self.__command = command
+        self.__screen = screen.Screen(rows, columns)
+        # the last snapshot, and how much output it was made after
+        self.__snapshot = None
+        self.viewers = set()
+        self.__process = None
+        # The task copying the output. The loop only keeps a weak reference
+        # to it, so it is held here until the game ends. It isn't cancelled:
+        # stopping the client ends it, once it has waited for the process.
+        self.relay = None
+        self.bytes = 0
+
+    def snapshot(self):
+        """A frame that draws the screen as it is now."""
+        if self.__snapshot is None or self.__snapshot[0] != self.bytes:
+            renderer = screen.Renderer(self.__screen.rows,
+                                       self.__screen.columns)
+            self.__snapshot = (self.bytes, encode_frame(
+                OP_BINARY, renderer.frame(self.__screen)))
+        return self.__snapshot[1]
+
+    async def start(self, on_end):
+        """Start the recorder client."""
+        self.__process = await asyncio.create_subprocess_exec(
+            *self.__command, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE)
+        self.relay = asyncio.ensure_future(self.__relay(on_end))
+
+    async def __relay(self, on_end):
+        """Copy the game's output to the viewers."""
+        stdout = self.__process.stdout
+        try:
+            while True:
+                data = await stdout.read(65536)
+                if not data:
+                    break
+                self.bytes += len(data)
+                self.__screen.feed(data)
+                # Framed once, and shared by every viewer.
+                frame = encode_frame(OP_BINARY, data)
+                for viewer in self.viewers:
+                    viewer.push(frame)
+        finally:
+            for viewer in self.viewers:
+                viewer.close()
+            on_end(self)
+            await self.__process.wait()
+
+    def stop(self):
+        """Stop the recorder client."""
+        if self.__process is not None and self.__process.returncode is None:
+            self.__process.terminate()
+
+class Gateway:
+    """The HTTP and WebSocket server."""
+    #pylint: disable=too-many-instance-attributes
+    def __init__(self, database, options, record_host, record_port):
+        self.__database = database
+        self.__record = (record_host, str(record_port))
+        self.__buffer = options.get('buffer', 262144)
+        self.__max_viewers = options.get('max_viewers', 5000)
+        self.__refresh = options.get('refresh', 2)
+        self.__rows = options.get('rows', 24)
+        self.__columns = options.get('columns', 80)
+        self.__upstreams = {}
+        self.__playing = None
+        self.__playing_time = None
+        self.viewers = 0
+
+    async def playing(self):
+        """The games being played, from the database at most every refresh
+        seconds."""
+        now = time.monotonic()
+        if self.__playing_time is None or \
+                now - self.__playing_time >= self.__refresh:
+            self.__playing_time = now
+            # Everyone asking while the query runs waits for it.
+            loop = asyncio.get_event_loop()
+            self.__playing = loop.run_in_executor(
+                None, db.playing_list, self.__database)
+        try:
+            return await asyncio.shield(self.__playing)
+        except Exception:
+            self.__playing_time = None
+            raise
+
+    def __command(self, user):
+        """The recorder client that watches user's game."""
+        host, port = self.__record
+        return ["termrecord_client", "-host", host, "-port", port,
+                "-user", user, "-watch"]
+
+    def __ended(self, upstream):
+        """Forget an upstream whose game has ended."""
+        if self.__upstreams.get(upstream.user) is upstream:
+            del self.__upstreams[upstream.user]
+
+    async def handle(self, reader, writer):
+        """Handle one HTTP connection."""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError):
+            writer.close()
+            return
+        lines = head.decode('latin-1').split("\r\n")
+        parts = lines[0].split(" ")
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            if len(parts) != 3 or parts[0] != "GET":
+                self.__respond(writer, 405, "Method Not Allowed")
+            elif parts[1] == "/games":
+                await self.__games(writer)
+            elif parts[1].startswith("/watch/"):
+                await self.__watch(reader, writer, parts[1][7:], headers)
+            else:
+                self.__respond(writer, 404, "Not Found")
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def __respond(writer, status, reason, body=b"",
+                  content_type="text/plain"):
+        """Write a whole HTTP response."""
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: {}\r\n"
+                     "Content-Length: {}\r\nConnection: close\r\n\r\n"
+                     .format(status, reason, content_type, len(body))
+                     .encode('latin-1') + body)
+
+    async def __games(self, writer):
+        """Serve the list of games being played."""
+        games = []
+        for player in await self.playing():
+            upstream = self.__upstreams.get(player['username'])
+            viewers = 0 if upstream is None else len(upstream.viewers)
+            games.append({'user': player['username'],
+                          'since': player['since'],
+                          'node': player['node'],
+                          'viewers': viewers})
+        self.__respond(writer, 200, "OK", json.dumps(games).encode('utf-8'),
+                       "application/json")
+
+    async def __watch(self, reader, writer, user, headers):
+        """Upgrade to a WebSocket and stream a game."""
+        key = headers.get('sec-websocket-key')
+        if headers.get('upgrade', "").lower() != "websocket" or key is None:
+            self.__respond(writer, 400, "Bad Request")
+            return
+        if user not in [player['username'] for player in
+                        await self.playing()]:
+            self.__respond(writer, 404, "Not Found")
+            return
+        if self.viewers >= self.__max_viewers:
+            self.__respond(writer, 503, "Service Unavailable")
+            return
+
+        upstream = self.__upstreams.get(user)
+        if upstream is None:
+            upstream = Upstream(user, self.__command(user), self.__rows,
+                                self.__columns)
+            self.__upstreams[user] = upstream
+            await upstream.start(self.__ended)
+
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\n"
+                     b"Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                     b"Sec-WebSocket-Accept: " +
+                     accept_key(key.encode('latin-1')) + b"\r\n\r\n")
+
+        writer.transport.set_write_buffer_limits(WRITE_BUFFER)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        viewer = Viewer(writer, self.__buffer)
+        upstream.viewers.add(viewer)
+        self.viewers += 1
+        sender = asyncio.ensure_future(viewer.send(upstream))
+        try:
+            await self.__listen(reader, viewer, sender)
+        finally:
+            self.viewers -= 1
+            upstream.viewers.discard(viewer)
+            if not upstream.viewers:
+                upstream.stop()
+                self.__ended(upstream)
+            viewer.close()
+            sender.cancel()
+
+    @staticmethod
+    async def __listen(reader, viewer, sender):
+        """Answer a viewer's control messages until it goes away."""
+        closing = asyncio.ensure_future(read_frame(reader))
+        while True:
+            done, _ = await asyncio.wait(
+                [closing, sender], return_when=asyncio.FIRST_COMPLETED)
+            if sender in done:
+                # The game ended, or the viewer's connection broke.
+                closing.cancel()
+                if viewer.closed and not sender.cancelled() and \
+                        sender.exception() is None:
+                    viewer.writer.write(encode_frame(OP_CLOSE, b"\x03\xe8"))
+                return
+            try:
+                opcode, payload = closing.result()
+            except ProtocolError:
+                viewer.writer.write(encode_frame(OP_CLOSE, b"\x03\xea"))
+                return
+            if opcode == OP_CLOSE:
+                viewer.writer.write(encode_frame(OP_CLOSE, payload[:2]))
+                return
+            if opcode == OP_PING:
+                viewer.writer.write(encode_frame(OP_PONG, payload))
+            closing = asyncio.ensure_future(read_frame(reader))
+
+def serve(config):
+    """Run the gateway until killed."""
+    options = config.get('gateway', {})
+    recorder = config.get('recorder', {})
+    gateway = Gateway(db.Database(config.get('database', "users.db")),
+                      options, recorder.get('host', 'localhost'),
+                      recorder.get('port', 34234))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(asyncio.start_server(
+        gateway.handle, options.get('host', "127.0.0.1"),
+        options.get('port', 8080), backlog=1024))
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
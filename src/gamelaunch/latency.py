@@ -0,0 +1,250 @@
+"""Keystroke to echo latency of games.
+
+pyterm's Capture relays between the player's terminal and the game in
+native code, so it can't be watched from Python. To measure a game, Capture
+is run in a child on a pseudo terminal of our own, and the launcher relays
+between the player and that terminal. The time from a key reaching the
+terminal to the next output coming back is the latency of Capture, docker
+and the game together, and none of the network. Keys typed before the echo
+arrives are not timed separately.
+
+Latencies go into a histogram with log-linear buckets, as HDR histograms
+have: each power of two microseconds is split into SUB_BUCKETS buckets, so
+recording is constant time and values are kept to within 1/SUB_BUCKETS.
+
+Two kinds of stall are counted: echoes slower than the stall time, which
+are the server's fault, and writes to the player that blocked for longer
+than the stall time, which are the network's.
+"""
+
+import fcntl
+import os
+import pty
+import random
+import select
+import signal
+import termios
+import time
+import tty
+from gamelaunch import process
+
+SUB_BUCKETS = 16
+
+# Output this long after a key isn't counted as its echo.
+MAX_ECHO = 10.0
+
+class LatencyHistogram:
+    """A log-linear histogram of durations."""
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def index(micros):
+        """The bucket for a number of microseconds."""
+        if micros < 2 * SUB_BUCKETS:
+            return micros
+        shift = micros.bit_length() - SUB_BUCKETS.bit_length()
+        return SUB_BUCKETS * shift + (micros >> shift)
+
+    @staticmethod
+    def upper(index):
+        """The largest number of microseconds in a bucket."""
+        if index < 2 * SUB_BUCKETS:
+            return index
+        shift = index // SUB_BUCKETS - 1
+        return ((index - SUB_BUCKETS * shift + 1) << shift) - 1
+
+    def record(self, seconds):
+        """Add a duration to the histogram."""
+        micros = int(seconds * 1e6)
+        index = self.index(micros)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.max = max(self.max, micros)
+
+    def percentile(self, percent):
+        """The duration in seconds that percent of those recorded were
+        within."""
+        if self.total == 0:
+            return 0.0
+        wanted = self.total * percent / 100.0
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= wanted:
+                return min(self.upper(index), self.max) / 1e6
+        return self.max / 1e6
+
+class EchoMonitor:
+    """Times echoes and counts the bytes of one game."""
+    #pylint: disable=too-many-instance-attributes
+    def __init__(self, stats, stall=0.2, interval=10.0, **labels):
+        self.__stats = stats
+        self.__stall = stall
+        self.__interval = interval
+        self.__labels = labels
+        self.histogram = LatencyHistogram()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.echo_stalls = 0
+        self.output_stalls = 0
+        self.unanswered = 0
+        self.__pending = None
+        self.__sent = (0, 0)
+        self.__next_flush = time.monotonic() + interval
+
+    def key(self, now, count):
+        """count bytes of input were passed to the game."""
+        self.bytes_in += count
+        if self.__pending is None:
+            self.__pending = now
+
+    def output(self, now, count):
+        """count bytes of output came from the game."""
+        self.bytes_out += count
+        if self.__pending is not None:
+            latency = now - self.__pending
+            self.__pending = None
+            if latency > MAX_ECHO:
+                self.unanswered += 1
+            else:
+                self.histogram.record(latency)
+                self.__stats.observe('echo_latency_seconds', latency,
+                                     **self.__labels)
+                if latency > self.__stall:
+                    self.echo_stalls += 1
+                    self.__stats.inc('echo_stalls_total', side='server',
+                                     **self.__labels)
+        if now >= self.__next_flush:
+            self.flush()
+            self.__next_flush = now + self.__interval
+
+    def written(self, seconds):
+        """Output took seconds to write to the player."""
+        if seconds > self.__stall:
+            self.output_stalls += 1
+            self.__stats.inc('echo_stalls_total', side='network',
+                             **self.__labels)
+
+    def flush(self):
+        """Send the byte counts so far to the metrics."""
+        sent_in, sent_out = self.__sent
+        if self.bytes_in > sent_in:
+            self.__stats.inc('game_bytes_total', self.bytes_in - sent_in,
+                             direction='in', **self.__labels)
+        if self.bytes_out > sent_out:
+            self.__stats.inc('game_bytes_total', self.bytes_out - sent_out,
+                             direction='out', **self.__labels)
+        self.__sent = (self.bytes_in, self.bytes_out)
+
+    def summary(self):
+        """What was measured, for the session log."""
+        histogram = self.histogram
+        return {
+            'echoes': histogram.total,
+            'p50': histogram.percentile(50),
+            'p90': histogram.percentile(90),
+            'p99': histogram.percentile(99),
+            'max': histogram.max / 1e6,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'echo_stalls': self.echo_stalls,
+            'output_stalls': self.output_stalls,
+            'unanswered': self.unanswered,
+        }
+
+def _write_all(fd, data):
+    """Write all of data to a blocking descriptor."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def _copy_size(source, dest):
+    """Give dest the window size of source."""
+    try:
+        size = fcntl.ioctl(source, termios.TIOCGWINSZ, b"\0" * 8)
+        fcntl.ioctl(dest, termios.TIOCSWINSZ, size)
+    except OSError:
+        pass
+
+def _relay(master, monitor, keys=0, out=1):
+    """Pass keys to the game and its output to the player until the game
+    has finished."""
+    readers = [master, keys]
+    connected = True
+    while True:
+        ready, _, _ = select.select(readers, [], [])
+        now = time.monotonic()
+
+        if master in ready:
+            try:
+                data = os.read(master, 65536)
+            except OSError:
+                # EIO once the game's side has closed
+                data = b""
+            if not data:
+                return
+            monitor.output(now, len(data))
+            if connected:
+                try:
+                    _write_all(out, data)
+                except OSError:
+                    connected = False
+                monitor.written(time.monotonic() - now)
+
+        if keys in ready:
+            try:
+                data = os.read(keys, 4096)
+            except OSError:
+                data = b""
+            if data:
+                monitor.key(now, len(data))
+                _write_all(master, data)
+            else:
+                # The player has gone, the launcher gets a hangup.
+                readers.remove(keys)
+
+def run(capture, monitor):
+    """Run a Capture on a terminal of our own, measuring it with monitor."""
+    pid, master = pty.fork()
+    if pid == 0:
+        status = 1
+        try:
+            signal.set_wakeup_fd(-1)
+            for sig in process.DEFAULT_SIGNALS:
+                signal.signal(sig, signal.SIG_DFL)
+            capture.run()
+            status = 0
+        finally:
+            os._exit(status)
+
+    _copy_size(0, master)
+    previous = signal.signal(signal.SIGWINCH,
+                             lambda *_: _copy_size(0, master))
+    try:
+        saved = termios.tcgetattr(0)
+        tty.setraw(0)
+    except termios.error:
+        saved = None
+    try:
+        _relay(master, monitor)
+    finally:
+        if saved is not None:
+            termios.tcsetattr(0, termios.TCSADRAIN, saved)
+        # ncurses puts its own handler back when it starts again.
+        signal.signal(signal.SIGWINCH, previous or signal.SIG_DFL)
+        os.close(master)
+        os.waitpid(pid, 0)
+        monitor.flush()
+
+def sample(options, stats, **labels):
+    """Create a monitor for a game from the latency section of the config.
+
+    Returns None unless the game has been picked by the sample fraction.
+    """
+    if options is None or random.random() >= options.get('fraction', 0):
+        return None
+    return EchoMonitor(stats, options.get('stall', 0.2),
+                       options.get('interval', 10.0), **labels)
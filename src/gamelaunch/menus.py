@@ -0,0 +1,710 @@
+"""The launcher's menus.
+
+Each menu draws itself into the launcher's window and handles the keys
+pressed while it is on top of the menu stack. Menus only talk to the
+launcher through its public methods, which they are given as app.
+"""
+
+import curses
+import curses.ascii
+import os
+import re
+import textwrap
+import time
+from gamelaunch import editor
+
+class WatchMenu:
+    """The menu to watch other games."""
+    offset = 2
+    help_message = [
+        "Select a game to play with the alphabetic keys.",
+        "Press any key to stop watching."
+    ]
+
+    def __init__(self):
+        self.__playing = []
+
+    def draw_row(self, app, player, row):
+        """Draw a single row in the watch menu."""
+        screen = app.screen()
+        screen.addstr(
+            self.offset + row, 1,
+            "{})  {}".format(chr(row + ord('a')), player['username']))
+
+    def update_playing(self, app):
+        """Update the playing users."""
+        playing = app.playing()
+        self.__playing = playing
+
+        row = 0
+        if len(playing) == 0:
+            message = "It looks like no-one is playing right now."
+            app.screen().addstr(self.offset + row, 1, message)
+            row += 1
+        else:
+            for player in playing:
+                self.draw_row(app, player, row)
+                row += 1
+
+        row += 1
+        app.screen().addstr(
+            self.offset + row,
+            1,
+            "Press q to quit this menu.")
+        row += 1
+
+        # Draw the help
+        if len(playing) > 0:
+            row += 1
+            for line in self.help_message:
+                app.screen().addstr(self.offset + row, 1, line)
+                row += 1
+
+    def draw(self, app):
+        """Draw the watch menu."""
+        self.update_playing(app)
+
+    def key(self, key, app):
+        """Handle a key press."""
+        if key == ord('q'):
+            app.pop_menu()
+        elif key >= ord('a') and key <= ord('z'):
+            which = key - ord('a')
+            if which < len(self.__playing):
+                app.watch(self.__playing[which]['id'])
+
+class ReplayMenu:
+    """The menu to replay old games."""
+    offset = 1
+    rows = 12
+    help_message = [
+        "During a replay: space pauses, + and - change speed,",
+        "f and b (or the arrow keys) skip, and q stops.",
+    ]
+
+    def __init__(self, game):
+        self.__game = game
+        self.__recordings = None
+        self.__page = 0
+
+    def draw(self, app):
+        """Draw a page of recordings."""
+        if self.__recordings is None:
+            self.__recordings = app.recordings(self.__game)
+        screen = app.screen()
+        row = self.offset
+
+        if not self.__recordings:
+            screen.addstr(row, 1, "You haven't recorded any games yet.")
+            screen.addstr(row + 2, 1, "Press q to quit this menu.")
+            return
+
+        pages = (len(self.__recordings) + self.rows - 1) // self.rows
+        screen.addstr(row, 1, "Your recorded games, page {} of {}".format(
+            self.__page + 1, pages))
+        row += 2
+
+        first = self.__page * self.rows
+        for i, (_, entry) in enumerate(
+                self.__recordings[first:first + self.rows]):
+            minutes, seconds = divmod(int(entry['time']), 60)
+            screen.addstr(row, 1, "{})  {}  {:>4}:{:02}  {:>8.1f} MB".format(
+                chr(i + ord('a')),
+                time.strftime("%Y-%m-%d %H:%M",
+                              time.localtime(entry['start'])),
+                minutes, seconds, entry['size'] / 1e6))
+            row += 1
+
+        row += 1
+        screen.addstr(row, 1, "Press q to quit this menu, > and < to "
+                      "change page.")
+        row += 1
+        for line in self.help_message:
+            screen.addstr(row, 1, line)
+            row += 1
+
+    def key(self, key, app):
+        """Handle a key press."""
+        last = max(len(self.__recordings or []) - 1, 0) // self.rows
+        if key == ord('q'):
+            app.pop_menu()
+        elif key == ord('>') and self.__page < last:
+            self.__page += 1
+            app.redraw()
+        elif key == ord('<') and self.__page > 0:
+            self.__page -= 1
+            app.redraw()
+        elif key >= ord('a') and key < ord('a') + self.rows:
+            which = self.__page * self.rows + key - ord('a')
+            if which < len(self.__recordings or []):
+                app.replay(*self.__recordings[which])
+
+class EditorMenu:
+    """The built in editor for game options files."""
+    help_message = "^O save  ^X exit  ^K delete line"
+    # What is typed here is kept out of session traces.
+    field = 'options'
+    unprintable = re.compile('[\x00-\x1f\x7f\ud800-\udfff]')
+
+    def __init__(self, path, validator=None):
+        self.__path = path
+        self.__buffer = editor.load(path)
+        self.__validator = validator
+        self.__top = 0
+        self.__left = 0
+        self.__message = ""
+        # The key that has to be pressed again to confirm, if any.
+        self.__confirm = None
+
+    def draw(self, app):
+        """Draw the visible part of the file and the status line."""
+        screen = app.screen()
+        height, width = screen.getmaxyx()
+        rows = height - 1
+        buf = self.__buffer
+
+        row = buf.row()
+        if row < self.__top:
+            self.__top = row
+        elif row >= self.__top + rows:
+            self.__top = row - rows + 1
+        column = len(buf.line(row)[:buf.column()].expandtabs())
+        if column < self.__left:
+            self.__left = column
+        elif column >= self.__left + width - 1:
+            self.__left = column - width + 2
+
+        for i in range(rows):
+            screen.move(i, 0)
+            screen.clrtoeol()
+            if self.__top + i < len(buf):
+                text = buf.line(self.__top + i).expandtabs()
+                screen.addstr(i, 0, self.unprintable.sub(
+                    "?", text[self.__left:self.__left + width - 1]))
+
+        status = self.__message or "{}  line {}/{}{}  {}".format(
+            os.path.basename(self.__path), row + 1, len(buf),
+            "  (modified)" if buf.modified else "", self.help_message)
+        screen.move(rows, 0)
+        screen.clrtoeol()
+        screen.addstr(rows, 0, status[:width - 1], curses.A_REVERSE)
+        screen.move(row - self.__top, column - self.__left)
+
+    def __save(self):
+        """Save the file, after validating it."""
+        if self.__validator is not None and self.__confirm != 15:
+            problems = self.__validator(self.__buffer.lines())
+            if problems:
+                line, problem = problems[0]
+                more = len(problems) - 1
+                self.__message = "Line {}: {}{}. ^O again to save " \
+                    "anyway.".format(line, problem, " (and {} more)".format(
+                        more) if more else "")
+                self.__buffer.goto(line - 1)
+                return 15
+        try:
+            editor.save(self.__path, self.__buffer)
+            self.__message = "Saved."
+        except OSError as error:
+            self.__message = "Couldn't save: {}".format(error.strerror)
+        return None
+
+    def __edit(self, key, height):
+        """Handle an editing or movement key."""
+        #pylint: disable=too-many-branches
+        buf = self.__buffer
+        if key == curses.KEY_UP:
+            buf.up()
+        elif key == curses.KEY_DOWN:
+            buf.down()
+        elif key == curses.KEY_LEFT:
+            buf.left()
+        elif key == curses.KEY_RIGHT:
+            buf.right()
+        elif key == curses.KEY_HOME or key == 1:
+            buf.home()
+        elif key == curses.KEY_END or key == 5:
+            buf.end()
+        elif key == curses.KEY_PPAGE:
+            buf.goto(buf.row() - (height - 2))
+        elif key == curses.KEY_NPAGE:
+            buf.goto(buf.row() + (height - 2))
+        elif key in (curses.KEY_BACKSPACE, 127, 8):
+            buf.backspace()
+        elif key == curses.KEY_DC:
+            buf.delete()
+        elif key == 11:
+            buf.delete_line()
+        elif key in (ord('\n'), ord('\r'), curses.KEY_ENTER):
+            buf.insert("\n")
+        elif key == ord('\t') or (key < 256 and curses.ascii.isprint(key)):
+            buf.insert(chr(key))
+
+    def key(self, key, app):
+        """Handle a key press."""
+        self.__message = ""
+        confirm = None
+        # ^S is usually taken by flow control, so ^O saves, as in nano.
+        if key == 15:
+            confirm = self.__save()
+        elif key == 24:
+            if not self.__buffer.modified or self.__confirm == 24:
+                app.pop_menu()
+                return
+            self.__message = "You have unsaved changes. ^X again to " \
+                "throw them away."
+            confirm = 24
+        else:
+            self.__edit(key, app.screen().getmaxyx()[0])
+        self.__confirm = confirm
+        self.draw(app)
+        app.screen().refresh()
+
+class SshKeysMenu:
+    """The menu to manage the SSH keys that log a user in."""
+    offset = 1
+    rows = 10
+    help_message = [
+        "Connect with one of these keys and you are logged in straight",
+        "away, without a password. To add a key, connect with it, log in",
+        "with your password and come back here.",
+    ]
+
+    def __init__(self):
+        self.__keys = []
+        self.__connection = None
+        # The key that has to be pressed again to remove, if any.
+        self.__confirm = None
+
+    def draw(self, app):
+        """Draw the user's keys."""
+        self.__keys = app.ssh_keys()
+        self.__connection = app.unregistered_key()
+        screen = app.screen()
+        row = self.offset
+        screen.addstr(row, 1, "Your SSH keys")
+        row += 2
+
+        if not self.__keys:
+            screen.addstr(row, 1, "You haven't added any keys.")
+            row += 1
+        for i, key in enumerate(self.__keys):
+            screen.addstr(row, 1, "{}) {:<51} {}".format(
+                chr(i + ord('a')), key['fingerprint'],
+                key['comment'] or "")[:77])
+            row += 1
+        row += 1
+
+        if self.__confirm is not None:
+            screen.addstr(row, 1, "Press {} again to remove that key.".format(
+                chr(self.__confirm)))
+        else:
+            screen.addstr(row, 1, "Press a key's letter to remove it.")
+        row += 1
+        if self.__connection is not None:
+            screen.addstr(row, 1, "u) add the key you are connected with")
+            row += 1
+        screen.addstr(row, 1, "q) quit this menu")
+        row += 2
+        for line in self.help_message:
+            screen.addstr(row, 1, line)
+            row += 1
+
+    def key(self, key, app):
+        """Handle a key press."""
+        confirm = self.__confirm
+        self.__confirm = None
+        if key == ord('q'):
+            app.pop_menu()
+            return
+        if key == ord('u') and self.__connection is not None:
+            app.add_ssh_key()
+        elif ord('a') <= key < ord('a') + len(self.__keys):
+            if confirm == key:
+                app.delete_ssh_key(self.__keys[key - ord('a')])
+            else:
+                self.__confirm = key
+        app.redraw()
+
+class LeaderboardMenu:
+    """The high scores of a game."""
+    offset = 1
+    rows = 10
+    headings = {'best': "best score", 'wins': "ascensions", 'games': "games"}
+
+    def __init__(self, game):
+        self.__game = game
+        self.__order = 'best'
+
+    def draw(self, app):
+        """Draw the leaderboard."""
+        screen = app.screen()
+        totals, leaders = app.scores(self.__game, self.__order)
+        row = self.offset
+        screen.addstr(row, 1, "{}, by {}".format(
+            self.__game, self.headings[self.__order]))
+        row += 1
+
+        if totals is None:
+            screen.addstr(row + 1, 1, "No games have been recorded yet.")
+            row += 3
+        else:
+            screen.addstr(row, 1, "{} games by {} players, {} ascended, "
+                          "high score {} by {}".format(
+                              totals['games'], totals['players'],
+                              totals['wins'], totals['best'],
+                              totals['best_name'])[:77])
+            row += 2
+            screen.addstr(row, 1, "{:>4}  {:<20} {:>12} {:>6} {:>10}".format(
+                "", "name", "best score", "games", "ascensions"))
+            row += 1
+            for rank, leader in enumerate(leaders, 1):
+                screen.addstr(row, 1,
+                              "{:>4}  {:<20} {:>12} {:>6} {:>10}".format(
+                                  rank, leader['name'][:20], leader['best'],
+                                  leader['games'], leader['wins']))
+                row += 1
+            row += 1
+
+        screen.addstr(row, 1, "Sort by b) best score, a) ascensions or "
+                      "g) games played.")
+        screen.addstr(row + 1, 1, "Press q to quit this menu.")
+
+    def key(self, key, app):
+        """Handle a key press."""
+        orders = {ord('b'): 'best', ord('a'): 'wins', ord('g'): 'games'}
+        if key == ord('q'):
+            app.pop_menu()
+        elif key in orders and orders[key] != self.__order:
+            self.__order = orders[key]
+            app.redraw()
+
+# The menus of a game that show its data rather than the config, by kind.
+GAME_MENUS = {'replay': ReplayMenu, 'leaderboard': LeaderboardMenu}
+
+class KeyInput:
+    """Base class for handling key input."""
+    #pylint: disable=too-many-arguments
+    def __init__(self, echo, key, message, nextmenu, hint=None):
+        self.__text = ""
+        self.__echo = echo
+        self.__next = nextmenu
+        self.__values = {}
+        self.__key = key
+        self.__message = message + " Empty input cancels."
+        # What is being typed, named in session traces instead of the text.
+        self.field = key
+
+        if hint is None:
+            hint = []
+
+        self.__help = hint
+
+    def key(self, key, app):
+        """Handle a key press."""
+        scr = app.screen()
+        chcode = chr(key)
+        if key == ord('\n'):
+            if self.__text == "":
+                app.pop_menu()
+            else:
+                self.__do_next(app)
+        elif key == curses.KEY_BACKSPACE or key == 127:
+            if len(self.__text) > 0:
+                self.__text = self.__text[0: -1]
+
+                if self.__echo:
+                    ypos, xpos = scr.getyx()
+                    scr.move(ypos, xpos-1)
+                    scr.delch()
+                    scr.refresh()
+
+        elif curses.ascii.isgraph(chcode):
+            self.__text += chcode
+
+            if self.__echo:
+                scr.addstr(chcode)
+                scr.refresh()
+
+    def __do_next(self, app):
+        """Do the next menu after taking input."""
+        app.pop_menu(False)
+        values = self.__values.copy()
+        values[self.__key] = self.__text
+        self.__next.start(app, values)
+
+    def start(self, app, values):
+        """Set up the menu."""
+        self.__values = values
+        app.push_menu(self)
+
+    def draw(self, app):
+        """Draw the actual key input menu."""
+
+        # Draw the hint message
+        app.screen().addstr(1, 1, self.__message)
+
+        # Draw the help under the cursor
+        row = 5
+        for paragraph in self.__help:
+            wrapped = textwrap.wrap(paragraph)
+            for line in wrapped:
+                app.screen().addstr(row, 1, line)
+                row += 1
+
+            row += 1
+
+        # Put the cursor in place for input
+        app.screen().move(3, 1)
+
+class UserNameMenu(KeyInput):
+    """A menu that takes a username as input."""
+    def __init__(self, nextmenu):
+        super().__init__(True, "user", "Enter your username.", nextmenu)
+
+class PasswordMenu(KeyInput):
+    """A menu that takes a password as input."""
+    def __init__(self, nextmenu, hint=None):
+        super().__init__(
+            False,
+            "password",
+            "Enter your password.",
+            nextmenu,
+            hint=hint)
+
+class DoLoginMenu:
+    #pylint: disable=too-few-public-methods
+    """A fake menu that does the actual login."""
+    @staticmethod
+    def start(app, values):
+        """Do the actual login."""
+        app.login(values['user'], values['password'])
+
+class DoRegisterMenu:
+    #pylint: disable=too-few-public-methods
+    """A fake menu that does the user registration."""
+    @staticmethod
+    def start(app, values):
+        """Do the user register."""
+        app.register(values)
+
+class EmailMenu(KeyInput):
+    """A menu that takes an email address."""
+    def __init__(self, nextmenu):
+        super().__init__(
+            True,
+            "email",
+            "Enter your email address.",
+            nextmenu,
+            hint=[
+                '''We will never send you email, except if you ask us to
+                reset your password.'''
+            ])
+
+class ChangePasswordMenu:
+    #pylint: disable=too-few-public-methods
+    """Fake menu to do the actual change password."""
+    @staticmethod
+    def start(app, values):
+        """Run the change password."""
+        app.change_password(values['password'])
+        app.redraw()
+
+class ChangeEmailMenu:
+    #pylint: disable=too-few-public-methods
+    """Fake menu to do the actual change email."""
+    @staticmethod
+    def start(app, values):
+        """Run the change email."""
+        app.change_email(values['email'])
+        app.redraw()
+
+class ChoiceRunner:
+    """The choice runner runs actions that are specified in the config."""
+    def __init__(self, app, **kwargs):
+        self.__app = app
+        self.__args = kwargs
+
+    def run(self, command):
+        """Run an action."""
+        parts = self.__app.render_template(command, **self.__args).split(' ')
+        self.__app.trace('action', parts[0])
+        self.__commands[parts[0]](self, parts[1:])
+
+    def login(self, _):
+        """Login."""
+        menu = UserNameMenu(PasswordMenu(DoLoginMenu()))
+        self.__app.push_menu(menu)
+
+    def game(self, args):
+        """Go to a game menu."""
+        self.__app.game_menu(int(args[0]))
+
+    def quit(self, _):
+        """Quit the current menu."""
+        self.__app.quit()
+
+    def play(self, args):
+        """Play a game."""
+        self.__app.play(int(args[0]))
+
+    def register(self, _):
+        """Register a user."""
+
+        password_hint = [
+            'Your password should be a unique memorable phrase.',
+            '''If you forget your password, send us an email from your
+            registered email address and we will reset it.''',
+            '''We store your password using 12 rounds of bcrypt, and it
+            is transmitted securely with SSH, but you should probably
+            not reuse passwords anyway.''',
+        ]
+        menu = UserNameMenu(PasswordMenu(
+            EmailMenu(DoRegisterMenu()),
+            password_hint))
+        self.__app.push_menu(menu)
+
+    def edit(self, args):
+        """Run the edit command."""
+        self.__app.edit_options(self.__render(args[0]),
+                                self.__args.get('game'))
+
+    def __render(self, text):
+        """Render the menu."""
+        return self.__app.render_template(text, **self.__args)
+
+    def changepass(self, _):
+        """Go to the change password menu."""
+        if self.__app.user() == "":
+            pass
+            #self.status("You are not logged in")
+        else:
+            self.__app.push_menu(PasswordMenu(ChangePasswordMenu()))
+
+    def changeemail(self, _):
+        """Go to the change email menu."""
+        if self.__app.user() == "":
+            pass
+            #self.status("You are not logged in")
+        else:
+            self.__app.push_menu(EmailMenu(ChangeEmailMenu()))
+
+    def sshkeys(self, _):
+        """Go to the SSH keys menu."""
+        if self.__app.user() != "":
+            self.__app.push_menu(SshKeysMenu())
+
+    def watch(self, _):
+        """Change to the watch menu."""
+        self.__app.push_menu(WatchMenu())
+
+    def replay(self, args):
+        """Go to the replay menu for a game."""
+        self.__app.game_menu(int(args[0]), 'replay')
+
+    def leaderboard(self, args):
+        """Go to a game's leaderboard."""
+        self.__app.game_menu(int(args[0]), 'leaderboard')
+
+    __commands = {
+        "login" : login,
+        "game" : game,
+        "play" : play,
+        "quit" : quit,
+        "register" : register,
+        "edit" : edit,
+        "changepass" : changepass,
+        "changeemail" : changeemail,
+        "sshkeys" : sshkeys,
+        "watch" : watch,
+        "leaderboard" : leaderboard,
+        "replay" : replay
+    }
+
+class InformationMenu:
+    """ A generic menu for showing information to the user."""
+
+    def __init__(self, app, text: list):
+        rendered = []
+
+        for paragraph in text:
+            rendered.append(textwrap.wrap(app.render_template(paragraph)))
+
+        self.__text = rendered
+
+    @staticmethod
+    def key(_, app):
+        """ Called on key press, just pops the menu."""
+        app.pop_menu()
+
+    def draw(self, app):
+        """ Draw the menu."""
+        row = 1
+        screen = app.screen()
+
+        for paragraph in self.__text:
+            for line in paragraph:
+                screen.addstr(row, 1, line)
+                row += 1
+            row += 1
+
+class Menu:
+    """The main game menu class."""
+    def __init__(self, definition, app, **kwargs):
+        self.__runner = ChoiceRunner(app, **kwargs)
+        self.__lines = []
+        self.__keys = {}
+        self.__args = kwargs
+        # where the launcher built this menu from, to rebuild it on reload
+        self.source = None
+        self.__news = definition['news'] if 'news' in definition else None
+        # menus can either be an array describing the menu,
+        # or a string that the engine expands to some menu items
+        for line in definition['items']:
+            if line is not "blank" and isinstance(line, str):
+                menus = app.generate_menus(line)
+                for i in menus:
+                    self.__add_item(i, app)
+            else:
+                self.__add_item(line, app)
+
+    def __add_item(self, line, app):
+        """Add a menu item to the menu."""
+        if line == "blank":
+            self.__lines.append("")
+        else:
+            text = app.render_template(line['title'], **self.__args)
+            self.__keys[ord(line['key'])] = line
+            self.__lines.append("{}) {}".format(line['key'], text))
+
+    def draw(self, app):
+        """Draw all the lines in a menu."""
+        i = 1
+        scr = app.screen()
+        for line in self.__lines:
+            scr.addstr(i, 1, line)
+            i += 1
+
+        # Draw the news
+        if self.__news is not None:
+            i += 1
+            #pylint: disable=no-member
+            scr.hline(i, 1, curses.ACS_HLINE, 77)
+            i += 1
+
+            for paragraph in self.__news:
+                news = textwrap.wrap(paragraph)
+                i += 1
+                for line in news:
+                    scr.addstr(i, 1, line)
+                    i += 1
+
+    def key(self, pressed, _):
+        """Called on a key press."""
+        if pressed in self.__keys:
+            keydata = self.__keys[pressed]
+            self.__runner.run(keydata['action'])
+
+    def action(self, key):
+        """Return the action for the specified key."""
+        return self.__keys[key]['action']
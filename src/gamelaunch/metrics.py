@@ -0,0 +1,241 @@
+"""Launcher fleet metrics.
+
+Every launcher process sends counter, gauge and histogram updates as single
+datagrams to a Unix socket. Sending never blocks: if the aggregator is not
+running or cannot keep up, the update is dropped. The aggregator sums the
+updates from all processes and serves them in the Prometheus text exposition
+format over HTTP on localhost.
+
+The wire format is one line per datagram:
+
+    <kind> <name> <labels> <value> <pid>
+
+where kind is c (counter), g (gauge delta) or h (histogram observation) and
+labels is a comma separated list of key=value pairs, or - for none.
+"""
+
+import http.server
+import os
+import socket
+import threading
+import time
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           30.0, 60.0)
+
+PREFIX = "pygamelaunch_"
+
+def _labels(labels):
+    """Encode labels for the wire."""
+    if not labels:
+        return "-"
+    return ",".join("{}={}".format(key, str(value).replace(",", "_")
+                                   .replace(" ", "_"))
+                    for key, value in sorted(labels.items()))
+
+class Metrics:
+    """Sends metric updates to the aggregator."""
+    def __init__(self, path=None):
+        self.__path = path
+        self.__sock = None
+        self.__pid = os.getpid()
+
+        if path is not None:
+            self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.__sock.setblocking(False)
+
+    def __send(self, kind, name, value, labels):
+        """Send a single update, dropping it if it can't be sent now."""
+        if self.__sock is None:
+            return
+        line = "{} {} {} {} {}".format(kind, name, _labels(labels), value,
+                                       self.__pid)
+        try:
+            self.__sock.sendto(line.encode('utf-8'), self.__path)
+        except OSError:
+            pass
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter."""
+        self.__send('c', name, value, labels)
+
+    def gauge(self, name, delta, **labels):
+        """Add to a gauge. Gauges are dropped when the process exits."""
+        self.__send('g', name, delta, labels)
+
+    def observe(self, name, value, **labels):
+        """Record an observation in a histogram."""
+        self.__send('h', name, value, labels)
+
+    def time(self, name, **labels):
+        """A context manager that observes the time taken by its body."""
+        return _Timer(self, name, labels)
+
+class _Timer:
+    """Observes the duration of a with statement."""
+    #pylint: disable=too-few-public-methods
+    def __init__(self, metrics, name, labels):
+        self.__metrics = metrics
+        self.__name = name
+        self.__labels = labels
+        self.__start = None
+
+    def __enter__(self):
+        self.__start = time.monotonic()
+        return self
+
+    def __exit__(self, *_):
+        self.__metrics.observe(self.__name, time.monotonic() - self.__start,
+                               **self.__labels)
+        return False
+
+class Histogram:
+    """A cumulative bucket histogram."""
+    #pylint: disable=too-few-public-methods
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Add a value to the histogram."""
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum += value
+
+class Aggregator:
+    """Sums the updates from all launcher processes."""
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__counters = {}
+        self.__gauges = {}
+        self.__histograms = {}
+
+    def handle(self, data):
+        """Apply a datagram to the aggregate."""
+        try:
+            kind, name, labels, value, pid = data.decode('utf-8').split(' ')
+            value = float(value)
+            pid = int(pid)
+        except ValueError:
+            return
+
+        key = (name, labels)
+        with self.__lock:
+            if kind == 'c':
+                self.__counters[key] = self.__counters.get(key, 0) + value
+            elif kind == 'g':
+                per_pid = self.__gauges.setdefault(key, {})
+                per_pid[pid] = per_pid.get(pid, 0) + value
+            elif kind == 'h':
+                if key not in self.__histograms:
+                    self.__histograms[key] = Histogram()
+                self.__histograms[key].observe(value)
+
+    def __reap(self):
+        """Drop gauge contributions from processes that have gone away."""
+        for per_pid in self.__gauges.values():
+            for pid in list(per_pid):
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    del per_pid[pid]
+                except PermissionError:
+                    pass
+
+    def exposition(self):
+        """Render the metrics in the Prometheus text format."""
+        lines = []
+        with self.__lock:
+            self.__reap()
+            self.__expose(lines, 'counter', self.__counters,
+                          lambda name, labels, value: [
+                              _sample(name, labels, value)])
+            self.__expose(lines, 'gauge', self.__gauges,
+                          lambda name, labels, value: [
+                              _sample(name, labels, sum(value.values()))])
+            self.__expose(lines, 'histogram', self.__histograms,
+                          _histogram_samples)
+        return "".join(line + "\n" for line in lines)
+
+    @staticmethod
+    def __expose(lines, kind, values, render):
+        """Render one family of metrics."""
+        typed = set()
+        for (name, labels), value in sorted(values.items()):
+            if name not in typed:
+                lines.append("# TYPE {}{} {}".format(PREFIX, name, kind))
+                typed.add(name)
+            lines.extend(render(name, labels, value))
+
+def _format_labels(labels, extra=None):
+    """Format wire labels for exposition."""
+    pairs = []
+    if labels != "-":
+        pairs = [pair.split("=", 1) for pair in labels.split(",")]
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, value)
+                          for key, value in pairs) + "}"
+
+def _sample(name, labels, value, suffix="", extra=None):
+    """Format a single sample line."""
+    return "{}{}{}{} {}".format(PREFIX, name, suffix,
+                                _format_labels(labels, extra), value)
+
+def _histogram_samples(name, labels, histogram):
+    """Format the samples of a histogram."""
+    samples = []
+    cumulative = 0
+    for bound, count in zip(BUCKETS, histogram.counts):
+        cumulative += count
+        samples.append(_sample(name, labels, cumulative, "_bucket",
+                               ["le", bound]))
+    samples.append(_sample(name, labels, histogram.total, "_bucket",
+                           ["le", "+Inf"]))
+    samples.append(_sample(name, labels, histogram.sum, "_sum"))
+    samples.append(_sample(name, labels, histogram.total, "_count"))
+    return samples
+
+def serve(socket_path, host="127.0.0.1", port=9163):
+    """Run the aggregator until killed."""
+    aggregator = Aggregator()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        """Serves the exposition text."""
+        def do_GET(self):
+            #pylint: disable=invalid-name
+            """Serve the metrics."""
+            body = aggregator.exposition().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_):
+            #pylint: disable=arguments-differ
+            pass
+
+    httpd = http.server.HTTPServer((host, port), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(socket_path)
+    os.chmod(socket_path, 0o666)
+
+    while True:
+        aggregator.handle(sock.recv(4096))
+
+def from_config(config):
+    """Create the metrics client from the metrics section of the config."""
+    if 'metrics' not in config:
+        return Metrics()
+    return Metrics(config['metrics']['socket'])
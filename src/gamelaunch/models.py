@@ -0,0 +1,195 @@
+"""The database schema, as SQLAlchemy models.
+
+The models are the reference for Alembic's autogenerated migrations and
+are used by the admin tools, backfills and the log ingester. The launcher
+itself doesn't load them, see gamelaunch.db.
+"""
+import time
+import sqlalchemy
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Boolean, DateTime, Column, Float, Integer, String, \
+    ForeignKey, Index
+
+Base = declarative_base()
+
+def retry_busy(function, attempts=6, delay=0.02):
+    """Call function, retrying with backoff while SQLite is busy."""
+    for attempt in range(attempts):
+        try:
+            return function()
+        except OperationalError as error:
+            busy = "locked" in str(error) or "busy" in str(error)
+            if not busy or attempt == attempts - 1:
+                raise
+            time.sleep(delay * 2 ** attempt)
+
+class User(Base):
+    """A user row in the users database."""
+    # pylint: disable=too-few-public-methods, no-init
+
+    __tablename__ = 'users'
+
+    id = Column(Integer, primary_key=True)
+    username = Column(String, unique=True, index=True)
+    password = Column(String)
+    salt = Column(String)
+    email = Column(String)
+    created = Column(DateTime, default=sqlalchemy.func.now())
+
+    def __repr__(self):
+        return "<User(id='{}', name='{}', pass='{}', salt='{}')>".format(
+            self.id, self.username, self.password, self.salt)
+
+class Playing(Base):
+    """A row representing a currently playing user."""
+    # pylint: disable=too-few-public-methods, no-init
+    __tablename__ = 'playing'
+
+    id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    since = Column(Integer)
+    node = Column(String, index=True)
+    # The game's container, and the host and pid of the launcher attached
+    # to it. pid is NULL while the game runs detached.
+    container = Column(String)
+    host = Column(String)
+    pid = Column(Integer)
+
+class Node(Base):
+    """A row with the load last reported by a game node."""
+    # pylint: disable=too-few-public-methods, no-init
+    __tablename__ = 'nodes'
+
+    name = Column(String, primary_key=True)
+    games = Column(Integer)
+    cpu = Column(Float)
+    updated = Column(Integer)
+
+class Logins(Base):
+    """A row representing a login attempt."""
+    # pylint: disable=too-few-public-methods, no-init
+    __tablename__ = 'logins'
+
+    id = Column(Integer, primary_key=True)
+    username = Column(String, index=True)
+    success = Column(Boolean, index=True)
+    date = Column(DateTime, default=sqlalchemy.func.now(), index=True)
+    client = Column(String)
+
+class BackfillProgress(Base):
+    """A row recording how far an online backfill has got."""
+    # pylint: disable=too-few-public-methods, no-init
+    __tablename__ = 'backfill_progress'
+
+    name = Column(String, primary_key=True)
+    position = Column(Integer)
+    rows = Column(Integer)
+    done = Column(Boolean)
+    updated = Column(Integer)
+
+class GameRecord(Base):
+    """A row for a finished game, from a game's xlogfile."""
+    # pylint: disable=too-few-public-methods, no-init
+    __tablename__ = 'game_records'
+    __table_args__ = (
+        Index('ix_game_records_game_name', 'game', 'name'),
+        Index('ix_game_records_game_points', 'game', 'points'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    game = Column(String)
+    name = Column(String)
+    points = Column(Integer)
+    turns = Column(Integer)
+    maxlvl = Column(Integer)
+    role = Column(String)
+    race = Column(String)
+    gender = Column(String)
+    align = Column(String)
+    death = Column(String)
+    realtime = Column(Integer)
+    starttime = Column(Integer)
+    endtime = Column(Integer, index=True)
+    version = Column(String)
+
+class LiveEvent(Base):
+    """A row for an event during a game, from a game's livelog."""
+    # pylint: disable=too-few-public-methods, no-init
+    __tablename__ = 'live_events'
+    __table_args__ = (
+        Index('ix_live_events_game_time', 'game', 'time'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    game = Column(String)
+    name = Column(String, index=True)
+    type = Column(Integer)
+    turns = Column(Integer)
+    time = Column(Integer)
+    message = Column(String)
+
+class UserStats(Base):
+    """A row of running totals for one player of one game."""
+    # pylint: disable=too-few-public-methods, no-init
+    __tablename__ = 'user_stats'
+    __table_args__ = (
+        Index('ix_user_stats_game_best', 'game', 'best'),
+        Index('ix_user_stats_game_wins', 'game', 'wins'),
+        Index('ix_user_stats_game_games', 'game', 'games'),
+    )
+
+    game = Column(String, primary_key=True)
+    name = Column(String, primary_key=True)
+    games = Column(Integer)
+    points = Column(Integer)
+    best = Column(Integer)
+    wins = Column(Integer)
+    turns = Column(Integer)
+    last = Column(Integer)
+
+class GameStats(Base):
+    """A row of running totals for one game."""
+    # pylint: disable=too-few-public-methods, no-init
+    __tablename__ = 'game_stats'
+
+    game = Column(String, primary_key=True)
+    players = Column(Integer)
+    games = Column(Integer)
+    points = Column(Integer)
+    best = Column(Integer)
+    best_name = Column(String)
+    wins = Column(Integer)
+
+class LogOffset(Base):
+    """A row recording how much of a game log has been read."""
+    # pylint: disable=too-few-public-methods, no-init
+    __tablename__ = 'log_offsets'
+
+    path = Column(String, primary_key=True)
+    inode = Column(Integer)
+    offset = Column(Integer)
+
+class SshKey(Base):
+    """A row mapping an SSH public key to the user it logs in."""
+    # pylint: disable=too-few-public-methods, no-init
+    __tablename__ = 'ssh_keys'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
+    fingerprint = Column(String, unique=True, index=True)
+    key = Column(String)
+    comment = Column(String)
+    added = Column(DateTime, default=sqlalchemy.func.now())
+
+def insert_or_ignore(database, model):
+    """An insert that skips rows that conflict with existing ones.
+
+    Returns None if the database doesn't support one.
+    """
+    dialect = database.dialect()
+    if dialect == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing()
+    if dialect == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing()
+    return None
@@ -0,0 +1,113 @@
+"""Placement of games over several docker hosts.
+
+Each game node runs nodeagent.py, which reports the node's CPU load and
+game count to the nodes table of the shared database. When a player starts
+a game, the launcher picks the least loaded node. That is the node with the
+fewest live games in the playing table, with the reported CPU load breaking
+ties. Nodes that have stopped reporting, or that are full, are skipped.
+The chosen node is recorded in the player's playing row so that anything
+that later needs the game, such as stopping it, reaches the right host.
+
+With no nodes configured, games run on the local node, the engine named
+by the config's engine setting. Its name is None.
+"""
+
+import collections
+import time
+from gamelaunch.engine import Engine, DEFAULT_URL
+
+GameNode = collections.namedtuple('GameNode', ['name', 'engine', 'max_games'])
+GameNode.__doc__ = """A docker host that games can run on."""
+
+# The node used when no nodes or engine are configured.
+LOCAL = GameNode(None, DEFAULT_URL, 0)
+
+class NoNodeAvailable(Exception):
+    """Thrown when every node is full or has stopped reporting."""
+    pass
+
+class UnknownNode(KeyError):
+    """Thrown for a node that isn't in the config, such as one a game was
+    placed on before it was removed."""
+    pass
+
+def report(database, name, games, cpu):
+    """Record the current load of a node."""
+    database.run(
+        "INSERT INTO nodes (name, games, cpu, updated) "
+        "VALUES (:name, :games, :cpu, :updated) "
+        "ON CONFLICT (name) DO UPDATE SET games = excluded.games, "
+        "cpu = excluded.cpu, updated = excluded.updated",
+        name=name, games=games, cpu=cpu, updated=int(time.time()))
+
+class Placement:
+    """Chooses the node for each new game."""
+    def __init__(self, database, nodes, max_age=30, cpu_weight=4.0,
+                 local=LOCAL):
+        #pylint: disable=too-many-arguments
+        self.__database = database
+        self.__nodes = nodes
+        self.__local = local
+        self.__max_age = max_age
+        self.__cpu_weight = cpu_weight
+
+    def nodes(self):
+        """The configured nodes."""
+        return self.__nodes
+
+    def node(self, name):
+        """Look up a node by name, the local node if name is None."""
+        if name is None:
+            return self.__local
+        for node in self.__nodes:
+            if node.name == name:
+                return node
+        raise UnknownNode(name)
+
+    def engine(self, name):
+        """An engine client for the node called name."""
+        return Engine(self.node(name).engine)
+
+    def load(self):
+        """Get the live game count and reported cpu of each fresh node."""
+        fresh = time.time() - self.__max_age
+        cpu = dict(self.__database.query(
+            "SELECT name, cpu FROM nodes WHERE updated >= :fresh",
+            fresh=fresh))
+        games = dict(self.__database.query(
+            "SELECT node, COUNT(id) FROM playing GROUP BY node"))
+        return {name: (games.get(name, 0), load)
+                for name, load in cpu.items()}
+
+    def choose(self):
+        """Pick the least loaded node for a new game."""
+        if not self.__nodes:
+            return self.__local
+
+        load = self.load()
+        best = None
+        best_score = None
+        for node in self.__nodes:
+            if node.name not in load:
+                continue
+            games, cpu = load[node.name]
+            if node.max_games > 0 and games >= node.max_games:
+                continue
+            score = games + self.__cpu_weight * (cpu or 0.0)
+            if best is None or score < best_score:
+                best = node
+                best_score = score
+
+        if best is None:
+            raise NoNodeAvailable()
+        return best
+
+def from_config(config, database):
+    """Create the placement from the nodes section of the config."""
+    options = config.get('placement', {})
+    nodes = [GameNode(node['name'], node['engine'], node.get('max_games', 0))
+             for node in config.get('nodes', [])]
+    return Placement(database, nodes,
+                     options.get('max_age', 30),
+                     options.get('cpu_weight', 4.0),
+                     GameNode(None, config.get('engine', DEFAULT_URL), 0))
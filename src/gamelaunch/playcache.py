@@ -0,0 +1,98 @@
+"""A short lived cache of the playing list, shared by all launchers.
+
+Every open watch menu wants the list of players, and without a cache each
+one queries the database that players are writing to. The list is kept in
+a JSON file instead. Each cached list records the version it was built
+from. Starting or stopping a game bumps the version, which makes the cache
+stale straight away. Otherwise a list is used for ttl seconds. Refreshes
+are serialised with an flock, so at most one launcher queries the database
+each time the list goes stale, and the rest read its result.
+"""
+
+import fcntl
+import json
+import os
+import struct
+import time
+
+class PlayingCache:
+    """The shared playing list cache."""
+    def __init__(self, directory, ttl=2.0):
+        self.__ttl = ttl
+        self.__cache = os.path.join(directory, "playing.json")
+        self.__version = os.path.join(directory, "playing.version")
+        self.__lock = os.path.join(directory, "playing.lock")
+        os.makedirs(directory, exist_ok=True)
+
+    def version(self):
+        """The current version of the playing list."""
+        try:
+            with open(self.__version, "rb") as file:
+                data = file.read(8)
+        except FileNotFoundError:
+            return 0
+        return struct.unpack("<Q", data)[0] if len(data) == 8 else 0
+
+    def invalidate(self):
+        """Mark the cached list as stale after a game starts or stops."""
+        fd = os.open(self.__version, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.pread(fd, 8, 0)
+            version = struct.unpack("<Q", data)[0] if len(data) == 8 else 0
+            os.pwrite(fd, struct.pack("<Q", version + 1), 0)
+        finally:
+            os.close(fd)
+
+    def __read(self, version):
+        """Read the cached list if it is still fresh."""
+        try:
+            with open(self.__cache) as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        if cached['version'] != version or \
+                time.time() - cached['time'] > self.__ttl:
+            return None
+        return cached['players']
+
+    def get(self, load):
+        """Get the playing list, calling load to refresh it if it's stale."""
+        players = self.__read(self.version())
+        if players is not None:
+            return players
+
+        with open(self.__lock, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Someone else may have refreshed it while we waited.
+            version = self.version()
+            players = self.__read(version)
+            if players is not None:
+                return players
+
+            players = load()
+            temp = "{}.{}".format(self.__cache, os.getpid())
+            with open(temp, "w") as file:
+                json.dump({'version': version, 'time': time.time(),
+                           'players': players}, file)
+            os.replace(temp, self.__cache)
+        return players
+
+class NoCache:
+    """Used when no cache is configured, always loads the list."""
+    @staticmethod
+    def get(load):
+        """Load the playing list."""
+        return load()
+
+    def invalidate(self):
+        """Nothing to invalidate."""
+        pass
+
+def from_config(config):
+    """Create the playing cache from the config."""
+    if 'playing_cache' not in config:
+        return NoCache()
+    options = config['playing_cache']
+    return PlayingCache(options['directory'], options.get('ttl', 2.0))
@@ -0,0 +1,190 @@
+"""Child process supervision.
+
+Children are started with posix_spawn, which glibc implements with vfork
+semantics, so starting a program doesn't have to copy the page tables of a
+large Python parent. Every child is reaped with wait4, so callers get the
+exit status along with the CPU time and peak memory the child used.
+"""
+
+import collections
+import os
+import resource
+import select
+import signal
+import time
+
+Result = collections.namedtuple(
+    'Result', ['pid', 'returncode', 'elapsed', 'user', 'system', 'maxrss',
+               'timed_out'])
+Result.__doc__ = """The outcome of a child process.
+
+returncode is negative if the child was killed by a signal, user and system
+are CPU seconds and maxrss is the peak resident size in kB.
+"""
+
+# Python ignores SIGPIPE and the launcher catches several others, children
+# should start with the default actions.
+DEFAULT_SIGNALS = (signal.SIGPIPE, signal.SIGXFSZ, signal.SIGINT,
+                   signal.SIGHUP, signal.SIGTERM, signal.SIGALRM)
+
+# How often to poll for an exit where pidfds aren't available.
+POLL = 0.05
+
+def _pidfd_open(pid):
+    """Get a descriptor that becomes readable when pid exits, if we can."""
+    try:
+        return os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return None
+
+class Process:
+    """A running child process."""
+    def __init__(self, argv, env=None, quiet=False, capture=False):
+        self.__output = None
+        self.__start = time.monotonic()
+        actions = []
+
+        if quiet:
+            actions.extend([
+                (os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0),
+                (os.POSIX_SPAWN_OPEN, 1, os.devnull, os.O_WRONLY, 0),
+                (os.POSIX_SPAWN_OPEN, 2, os.devnull, os.O_WRONLY, 0),
+            ])
+
+        write = None
+        if capture:
+            self.__output, write = os.pipe()
+            actions.extend([
+                (os.POSIX_SPAWN_DUP2, write, 1),
+                (os.POSIX_SPAWN_DUP2, write, 2),
+            ])
+
+        try:
+            self.pid = os.posix_spawnp(
+                argv[0], argv, os.environ if env is None else env,
+                file_actions=actions, setsigdef=DEFAULT_SIGNALS)
+        except OSError:
+            if capture:
+                os.close(self.__output)
+            raise
+        finally:
+            if write is not None:
+                os.close(write)
+
+    def __reap(self, options=0):
+        """wait4 for the child, returning a Result or None."""
+        pid, status, usage = os.wait4(self.pid, options)
+        if pid == 0:
+            return None
+        return Result(pid, os.waitstatus_to_exitcode(status),
+                      time.monotonic() - self.__start, usage.ru_utime,
+                      usage.ru_stime, usage.ru_maxrss, False)
+
+    def wait(self, timeout=None, output=None):
+        """Wait for the child to exit.
+
+        If output is given, it is called with each chunk the child writes.
+        If the child is still running after timeout seconds it is killed.
+        """
+        if self.__output is None and timeout is None:
+            return self.__reap()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pidfd = _pidfd_open(self.pid)
+        try:
+            while True:
+                wait = None
+                if deadline is not None:
+                    wait = deadline - time.monotonic()
+                    if wait <= 0:
+                        return self.__kill()
+                if pidfd is None:
+                    wait = POLL if wait is None else min(wait, POLL)
+
+                watch = [fd for fd in (self.__output, pidfd) if fd is not None]
+                readable, _, _ = select.select(watch, [], [], wait)
+
+                if self.__output in readable:
+                    self.__read(output)
+
+                if pidfd is None or pidfd in readable:
+                    result = self.__reap(os.WNOHANG)
+                    if result is not None:
+                        self.__drain(output)
+                        return result
+        finally:
+            if pidfd is not None:
+                os.close(pidfd)
+
+    def __read(self, output):
+        """Read a chunk of output. Returns False at end of file."""
+        data = os.read(self.__output, 65536)
+        if not data:
+            os.close(self.__output)
+            self.__output = None
+            return False
+        if output is not None:
+            output(data)
+        return True
+
+    def __drain(self, output):
+        """Read whatever output is left once the child has exited."""
+        while self.__output is not None:
+            readable, _, _ = select.select([self.__output], [], [], 0)
+            if not readable or not self.__read(output):
+                break
+        if self.__output is not None:
+            os.close(self.__output)
+            self.__output = None
+
+    def __kill(self):
+        """Kill a child that has run for too long."""
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        if self.__output is not None:
+            os.close(self.__output)
+            self.__output = None
+        return self.__reap()._replace(timed_out=True)
+
+def run(argv, timeout=None, output=None, quiet=False, env=None):
+    """Run a program to completion and return its Result.
+
+    Output is passed to output as it arrives if it is given. quiet sends
+    the program's input and output to /dev/null.
+    """
+    child = Process(argv, env=env, quiet=quiet and output is None,
+                    capture=output is not None)
+    return child.wait(timeout, output)
+
+def execwait(prog, *args):
+    """Run a program quietly and wait for it. args includes argv[0]."""
+    return run([prog] + list(args[1:]), quiet=True)
+
+class ChildUsage:
+    """Measures the resources used by children reaped during a with block.
+
+    This covers children that other code spawns and reaps, such as the
+    programs that pyterm runs. The kernel only keeps the peak memory of the
+    largest child ever reaped, so maxrss is only known if these children
+    went above every earlier one. Otherwise it is None.
+    """
+    #pylint: disable=too-few-public-methods
+    def __init__(self):
+        self.user = 0.0
+        self.system = 0.0
+        self.maxrss = None
+        self.__before = None
+
+    def __enter__(self):
+        self.__before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return self
+
+    def __exit__(self, *_):
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.user = after.ru_utime - self.__before.ru_utime
+        self.system = after.ru_stime - self.__before.ru_stime
+        if after.ru_maxrss > self.__before.ru_maxrss:
+            self.maxrss = after.ru_maxrss
+        return False
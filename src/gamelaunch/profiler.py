@@ -0,0 +1,116 @@
+"""A low overhead sampling profiler for live launcher sessions.
+
+The profiler uses the CPU time interval timer (ITIMER_PROF), so it only
+takes samples while the process is actually burning CPU and costs nothing
+while the launcher waits for keys or for a game. Its SIGPROF handler doesn't
+touch the terminal and doesn't interfere with the handlers the launcher sets
+for HUP, TERM, INT and ALRM. Interval timers aren't inherited by forked
+children, so games and helpers are never sampled.
+
+Samples are written in the collapsed stack format understood by
+flamegraph.pl and speedscope, one file per process.
+"""
+
+import os
+import random
+import signal
+
+class Profiler:
+    """Samples the main thread's stack on a CPU time timer."""
+    def __init__(self, directory, interval=0.005):
+        self.__directory = directory
+        self.__interval = interval
+        self.__stacks = {}
+        self.__running = False
+        self.__paused = False
+
+    def running(self):
+        """Is the profiler taking samples."""
+        return self.__running
+
+    def start(self):
+        """Start taking samples."""
+        if self.__running:
+            return
+        self.__running = True
+        signal.signal(signal.SIGPROF, self.__sample)
+        if not self.__paused:
+            self.__arm()
+
+    def stop(self):
+        """Stop taking samples and write out what we have."""
+        if not self.__running:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_IGN)
+        self.__running = False
+        self.dump()
+
+    def pause(self):
+        """Stop sampling while control is handed to another program."""
+        self.__paused = True
+        if self.__running:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+
+    def resume(self):
+        """Carry on sampling after a pause."""
+        self.__paused = False
+        if self.__running:
+            self.__arm()
+
+    def __arm(self):
+        """Start the sampling timer."""
+        signal.setitimer(signal.ITIMER_PROF, self.__interval, self.__interval)
+
+    def toggle(self, *_):
+        """Signal handler that starts or stops profiling."""
+        if self.__running:
+            self.stop()
+        else:
+            self.start()
+
+    def __sample(self, _, frame):
+        """Record the stack that was interrupted."""
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append("{}:{}".format(
+                os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        stack = ";".join(reversed(names))
+        self.__stacks[stack] = self.__stacks.get(stack, 0) + 1
+
+    def path(self):
+        """The file this process writes its samples to."""
+        return os.path.join(self.__directory,
+                            "profile.{}.folded".format(os.getpid()))
+
+    def dump(self):
+        """Write the collapsed stacks collected so far."""
+        if not self.__stacks:
+            return
+        os.makedirs(self.__directory, exist_ok=True)
+        temp = self.path() + ".tmp"
+        with open(temp, "w") as out:
+            for stack, count in sorted(self.__stacks.items()):
+                out.write("{} {}\n".format(stack, count))
+        os.replace(temp, self.path())
+
+def from_config(config):
+    """Create a profiler from the profile section of the config.
+
+    Returns None if profiling isn't configured. If this session has been
+    picked by the sample fraction the profiler is already running.
+    """
+    if 'profile' not in config:
+        return None
+
+    options = config['profile']
+    profiler = Profiler(options['directory'],
+                        options.get('interval', 0.005))
+    signal.signal(signal.SIGUSR1, profiler.toggle)
+
+    if random.random() < options.get('fraction', 0):
+        profiler.start()
+
+    return profiler
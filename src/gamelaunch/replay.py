@@ -0,0 +1,378 @@
+"""Replaying recorded games.
+
+Recordings are ttyrec files: each frame is a 12 byte header of seconds,
+microseconds and length, followed by that many bytes of terminal output.
+They may be compressed with gzip, bzip2 or xz.
+
+Each recordings directory has an index file so that opening the replay
+menu doesn't scan the directory. The index is only refreshed from the
+directory when the directory itself has changed. Otherwise only the newest
+recording, the one that may still be growing, is looked at again. Scanning
+a recording is incremental. A recording that has grown is scanned from
+where the last scan stopped.
+
+The scan also records seek points: frames that clear the screen, at least
+SEEK_INTERVAL seconds apart. Seeking starts from the last seek point before
+the target and fast forwards from there, so the screen is drawn correctly.
+
+Uncompressed recordings are memory mapped and played straight from the
+map. Played pages are dropped as the replay goes, so even a recording of
+several gigabytes starts at once and plays in constant memory. Compressed
+recordings are streamed through their decompressor.
+"""
+
+import bisect
+import bz2
+import gzip
+import json
+import lzma
+import mmap
+import os
+import select
+import struct
+import termios
+import time
+import tty
+
+HEADER = struct.Struct("<III")
+
+# The index lives in its own directory, so that writing it doesn't change
+# the recordings directory.
+INDEX_DIRECTORY = ".index"
+INDEX_NAME = "recordings.json"
+
+COMPRESSED = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+# Gaps in a recording are played back as at most this many seconds.
+MAX_DELAY = 5.0
+
+SEEK_INTERVAL = 30.0
+
+# A frame longer than this means the file isn't a ttyrec.
+MAX_FRAME = 1 << 24
+
+# Escape sequences that clear the whole screen.
+CLEARS = (b"\x1b[2J", b"\x1b[H\x1b[J")
+
+# Drop played pages of a mapped recording every this many bytes.
+RELEASE_BYTES = 1 << 26
+
+def open_recording(path):
+    """Open a recording for reading, mapping it if it isn't compressed."""
+    opener = COMPRESSED.get(os.path.splitext(path)[1])
+    if opener is not None:
+        return opener(path, "rb")
+
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return open(path, "rb")
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mapped, 'madvise'):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    return mapped
+
+def release(reader, start, end):
+    """Drop the pages of a mapped recording between start and end."""
+    if not isinstance(reader, mmap.mmap) or not hasattr(reader, 'madvise'):
+        return
+    start -= start % mmap.PAGESIZE
+    end -= end % mmap.PAGESIZE
+    if end > start:
+        reader.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+def read_frame(reader):
+    """Read the next frame, returning its time and data, or None at the end
+    or at a partly written frame."""
+    header = reader.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    sec, usec, length = HEADER.unpack(header)
+    if length > MAX_FRAME:
+        return None
+    data = reader.read(length)
+    if len(data) < length:
+        return None
+    return sec + usec / 1000000, data
+
+def new_entry(name, stat):
+    """An index entry for a recording that hasn't been scanned."""
+    return {'name': name, 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'offset': 0, 'frames': 0, 'start': None, 'stamp': None,
+            'time': 0.0, 'seek': []}
+
+def scan(path, entry):
+    """Scan the frames of a recording from where the last scan stopped."""
+    with open_recording(path) as reader:
+        reader.seek(entry['offset'])
+        released = entry['offset']
+        while True:
+            offset = reader.tell()
+            frame = read_frame(reader)
+            if frame is None:
+                break
+            stamp, data = frame
+
+            if entry['stamp'] is None:
+                entry['start'] = stamp
+            else:
+                entry['time'] += min(max(stamp - entry['stamp'], 0),
+                                     MAX_DELAY)
+            entry['stamp'] = stamp
+            entry['frames'] += 1
+
+            seek = entry['seek']
+            if not seek or (entry['time'] - seek[-1][0] >= SEEK_INTERVAL and
+                            any(clear in data for clear in CLEARS)):
+                seek.append([entry['time'], offset, stamp])
+            entry['offset'] = reader.tell()
+            if offset - released >= RELEASE_BYTES:
+                release(reader, released, offset)
+                released = offset
+
+class RecordingIndex:
+    """The index of a recordings directory."""
+    def __init__(self, directory):
+        self.__directory = directory
+        self.__index_directory = os.path.join(directory, INDEX_DIRECTORY)
+        self.__path = os.path.join(self.__index_directory, INDEX_NAME)
+
+    def path(self, entry):
+        """The full path of a recording."""
+        return os.path.join(self.__directory, entry['name'])
+
+    def __load(self):
+        """Read the index file."""
+        try:
+            with open(self.__path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {'mtime': None, 'recordings': {}}
+
+    def __save(self, index):
+        """Write the index file, if we can."""
+        temp = "{}.{}".format(self.__path, os.getpid())
+        try:
+            with open(temp, "w") as file:
+                json.dump(index, file)
+            os.replace(temp, self.__path)
+        except OSError:
+            pass
+
+    def __update(self, recordings, name, stat):
+        """Bring one recording's entry up to date. Returns True if it
+        changed."""
+        entry = recordings.get(name)
+        if entry is not None and entry['size'] == stat.st_size and \
+                entry['mtime'] == stat.st_mtime:
+            return False
+
+        compressed = os.path.splitext(name)[1] in COMPRESSED
+        if entry is None or compressed or stat.st_size < entry['size']:
+            entry = new_entry(name, stat)
+        entry['size'] = stat.st_size
+        entry['mtime'] = stat.st_mtime
+        try:
+            scan(os.path.join(self.__directory, name), entry)
+        except (OSError, EOFError, ValueError, lzma.LZMAError):
+            pass
+        recordings[name] = entry
+        return True
+
+    def renamed(self, names):
+        """Carry the entries of recordings that were recompressed over to
+        their new names, so they aren't scanned again. names maps old names
+        to new ones. Seek offsets are into the decompressed frames, so they
+        still hold."""
+        index = self.__load()
+        recordings = index['recordings']
+        changed = False
+        for old, new in names.items():
+            entry = recordings.pop(old, None)
+            if entry is None:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.__directory, new))
+            except OSError:
+                continue
+            entry['name'] = new
+            entry['size'] = stat.st_size
+            entry['mtime'] = stat.st_mtime
+            recordings[new] = entry
+            changed = True
+        if changed:
+            self.__save(index)
+
+    def entries(self):
+        """The playable recordings, newest first."""
+        try:
+            os.makedirs(self.__index_directory, exist_ok=True)
+        except OSError:
+            pass
+        try:
+            mtime = os.stat(self.__directory).st_mtime
+        except OSError:
+            return []
+
+        index = self.__load()
+        recordings = index['recordings']
+        changed = False
+
+        if index['mtime'] != mtime:
+            seen = set()
+            with os.scandir(self.__directory) as entries:
+                for dirent in entries:
+                    if dirent.name.startswith(".") or \
+                            not dirent.is_file(follow_symlinks=False):
+                        continue
+                    seen.add(dirent.name)
+                    self.__update(recordings, dirent.name, dirent.stat())
+            for name in set(recordings) - seen:
+                del recordings[name]
+            index['mtime'] = mtime
+            changed = True
+        elif recordings:
+            # Only the newest recording can still be growing.
+            newest = max(recordings.values(), key=lambda e: e['mtime'])
+            try:
+                stat = os.stat(self.path(newest))
+                changed = self.__update(recordings, newest['name'], stat)
+            except FileNotFoundError:
+                index['mtime'] = None
+
+        if changed:
+            self.__save(index)
+
+        return sorted((entry for entry in recordings.values()
+                       if entry['frames'] > 0),
+                      key=lambda e: e['mtime'], reverse=True)
+
+def write_all(fd, data):
+    """Write all of data to fd."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+class _Seek(Exception):
+    """Raised by a key press to move the replay."""
+    def __init__(self, target):
+        super().__init__()
+        self.target = target
+
+class Player:
+    """Plays a recording to a terminal at its recorded pace."""
+    #pylint: disable=too-many-instance-attributes
+    keys = {
+        b"f": 60, b"\x1b[C": 60, b"b": -60, b"\x1b[D": -60,
+        b"F": 600, b"\x1b[A": 600, b"B": -600, b"\x1b[B": -600,
+    }
+
+    def __init__(self, path, entry, speed=1.0):
+        self.__path = path
+        self.__seek_points = entry.get('seek', [])
+        self.__speed = speed
+        self.__paused = False
+        self.__quit = False
+        self.__time = 0.0
+        self.__stamp = None
+        self.__released = 0
+
+    def __key(self, key):
+        """Handle a key press during the replay."""
+        if key in (b"q", b"Q"):
+            self.__quit = True
+        elif key == b" ":
+            self.__paused = not self.__paused
+        elif key == b"+":
+            self.__speed = min(self.__speed * 2, 64.0)
+        elif key == b"-":
+            self.__speed = max(self.__speed / 2, 1 / 16)
+        elif key == b"1":
+            self.__speed = 1.0
+        elif key in (b"g", b"0"):
+            raise _Seek(0.0)
+        elif key in self.keys:
+            raise _Seek(max(self.__time + self.keys[key], 0.0))
+
+    def __wait(self, keys, delay):
+        """Wait delay seconds of recording time, handling keys."""
+        left = delay / self.__speed
+        while not self.__quit:
+            if not self.__paused and left <= 0:
+                return
+            started = time.monotonic()
+            ready, _, _ = select.select(
+                [keys], [], [], None if self.__paused else left)
+            if not self.__paused:
+                left -= time.monotonic() - started
+            if ready:
+                speed = self.__speed
+                self.__key(os.read(keys, 16))
+                left = left * speed / self.__speed
+
+    def __seek(self, reader, out, target):
+        """Move to target seconds into the recording."""
+        times = [point[0] for point in self.__seek_points]
+        which = bisect.bisect_right(times, target) - 1
+        if which < 0:
+            self.__time, offset, self.__stamp = 0.0, 0, None
+        else:
+            self.__time, offset, self.__stamp = self.__seek_points[which]
+        reader.seek(offset)
+        write_all(out, b"\x1b[H\x1b[2J")
+
+        # Fast forward from the seek point, drawing without waiting.
+        while self.__time < target:
+            position = reader.tell()
+            frame = read_frame(reader)
+            if frame is None:
+                return
+            stamp, data = frame
+            gap = self.__gap(stamp)
+            if self.__time + gap > target:
+                reader.seek(position)
+                return
+            self.__time += gap
+            self.__stamp = stamp
+            write_all(out, data)
+
+    def __gap(self, stamp):
+        """The playback delay before a frame."""
+        if self.__stamp is None:
+            return 0.0
+        return min(max(stamp - self.__stamp, 0.0), MAX_DELAY)
+
+    def play(self, keys, out):
+        """Play the recording, reading keys from the keys descriptor and
+        writing to the out descriptor."""
+        saved = termios.tcgetattr(keys)
+        tty.setcbreak(keys)
+        try:
+            with open_recording(self.__path) as reader:
+                self.__play(reader, keys, out)
+        finally:
+            termios.tcsetattr(keys, termios.TCSADRAIN, saved)
+
+    def __play(self, reader, keys, out):
+        """The replay loop."""
+        while not self.__quit:
+            position = reader.tell()
+            frame = read_frame(reader)
+            if frame is None:
+                return
+            stamp, data = frame
+            gap = self.__gap(stamp)
+            try:
+                self.__wait(keys, gap)
+            except _Seek as seek:
+                self.__seek(reader, out, seek.target)
+                continue
+            if self.__quit:
+                return
+
+            self.__time += gap
+            self.__stamp = stamp
+            write_all(out, data)
+
+            if position - self.__released >= RELEASE_BYTES:
+                release(reader, self.__released, position)
+                self.__released = position
@@ -0,0 +1,298 @@
+"""Retention and compaction of recordings.
+
+Each game can have a retention policy for the recordings in each user's
+directory:
+
+    keep            the newest keep recordings are never touched
+    compress_after  recordings older than this many days are recompressed
+                    with xz at the given level
+    max_age         recordings older than this many days are deleted,
+                    whether or not they are old enough to compress
+    max_bytes       the oldest recordings are deleted while a user's
+                    recordings take more than this, before any are
+                    compressed
+
+Recordings modified in the last ACTIVE seconds are never touched, because
+they may still be being written.
+
+The users' directories are walked with os.scandir across a thread pool.
+What was found is kept in a manifest, with each directory's mtime. A
+directory whose mtime hasn't changed is planned from the manifest alone,
+without listing it or statting more than its newest recording again, so
+repeated runs only look at what has changed.
+"""
+
+import collections
+import concurrent.futures
+import json
+import lzma
+import os
+import threading
+import time
+from gamelaunch import replay
+
+ACTIVE = 3600
+
+DAY = 86400
+
+Policy = collections.namedtuple(
+    'Policy', ['keep', 'compress_after', 'max_age', 'max_bytes', 'level'])
+Policy.__doc__ = """How long a game's recordings are kept."""
+
+DEFAULT_POLICY = Policy(keep=20, compress_after=7, max_age=0, max_bytes=0,
+                        level=9)
+
+def policy_from_config(defaults, options):
+    """A game's policy, from its retention section over the defaults."""
+    values = DEFAULT_POLICY._asdict()
+    values.update((key, value) for key, value in defaults.items()
+                  if key in values)
+    values.update((key, value) for key, value in options.items()
+                  if key in values)
+    return Policy(**values)
+
+def compressed(name):
+    """Is a recording already compressed with xz."""
+    return name.endswith(".xz")
+
+def _older(files, policy, now):
+    """The recordings that policy doesn't protect, newest first: all but
+    the newest keep, and any still being written."""
+    newest = sorted(files, key=lambda name: files[name][1], reverse=True)
+    return [name for name in newest[policy.keep:]
+            if now - files[name][1] >= ACTIVE]
+
+def plan(files, policy, now):
+    """Work out what to do with a directory's recordings by their age.
+
+    files maps names to (size, mtime). Returns a list of (action, name)
+    pairs, where action is 'compress' or 'delete'.
+    """
+    actions = []
+    for name in _older(files, policy, now):
+        age = now - files[name][1]
+        if policy.max_age and age > policy.max_age * DAY:
+            actions.append(('delete', name))
+        elif not compressed(name) and age >= policy.compress_after * DAY:
+            actions.append(('compress', name))
+    return actions
+
+def trim(files, policy, now):
+    """The oldest recordings to delete to bring a directory under its size
+    limit. This is worked out from the sizes before compression."""
+    if not policy.max_bytes:
+        return []
+    total = sum(size for size, _ in files.values())
+    older = _older(files, policy, now)
+    deleted = []
+    while total > policy.max_bytes and older:
+        name = older.pop()
+        total -= files[name][0]
+        deleted.append(name)
+    return deleted
+
+def recompress(path, level):
+    """Recompress a recording with xz. Returns the new name and size."""
+    base, extension = os.path.splitext(path)
+    if extension not in replay.COMPRESSED:
+        base = path
+    target = base + ".xz"
+    directory, name = os.path.split(target)
+    temp = os.path.join(directory, ".{}.tmp".format(name))
+
+    stat = os.stat(path)
+    opener = replay.COMPRESSED.get(extension, open)
+    try:
+        with opener(path, "rb") as source, \
+                lzma.open(temp, "wb", preset=level) as output:
+            while True:
+                data = source.read(1 << 20)
+                if not data:
+                    break
+                output.write(data)
+        # Keep the time so the recording stays in order.
+        os.utime(temp, (stat.st_atime, stat.st_mtime))
+        os.replace(temp, target)
+    except BaseException:
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
+    if target != path:
+        os.unlink(path)
+    return os.path.basename(target), os.path.getsize(target)
+
+class Report:
+    """What a run did, or would do in a dry run."""
+    #pylint: disable=too-few-public-methods
+    def __init__(self):
+        self.directories = 0
+        self.scanned = 0
+        self.files = 0
+        self.compressed = 0
+        self.compressed_bytes = 0
+        self.deleted = 0
+        self.reclaimed = 0
+        self.errors = []
+        self.__lock = threading.Lock()
+
+    def add(self, **counts):
+        """Add to the counts from a worker thread."""
+        with self.__lock:
+            for key, value in counts.items():
+                if key == 'errors':
+                    self.errors.extend(value)
+                else:
+                    setattr(self, key, getattr(self, key) + value)
+
+class Retention:
+    """Applies retention policies to users' recording directories."""
+    def __init__(self, manifest, workers=8, dry_run=False):
+        self.__manifest_path = manifest
+        self.__workers = workers
+        self.__dry_run = dry_run
+        self.__manifest = {}
+
+    def __load(self):
+        """Read the manifest."""
+        try:
+            with open(self.__manifest_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def __save(self):
+        """Write the manifest atomically."""
+        temp = "{}.{}".format(self.__manifest_path, os.getpid())
+        with open(temp, "w") as file:
+            json.dump(self.__manifest, file)
+        os.replace(temp, self.__manifest_path)
+
+    def __list(self, directory, report):
+        """The recordings in a directory, from the manifest if it hasn't
+        changed."""
+        mtime = os.stat(directory).st_mtime
+        known = self.__manifest.get(directory)
+        if known is not None and known['mtime'] == mtime:
+            files = known['files']
+            # The newest recording may still be growing.
+            if files:
+                newest = max(files, key=lambda name: files[name][1])
+                try:
+                    stat = os.stat(os.path.join(directory, newest))
+                    files[newest] = (stat.st_size, stat.st_mtime)
+                except FileNotFoundError:
+                    pass
+            return files
+
+        files = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or \
+                        not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                files[entry.name] = (stat.st_size, stat.st_mtime)
+        report.add(scanned=1)
+        self.__manifest[directory] = {'mtime': mtime, 'files': files}
+        return files
+
+    def __apply(self, directory, policy, now, report):
+        """Plan and carry out the policy for one directory."""
+        try:
+            files = self.__list(directory, report)
+        except OSError:
+            return
+        actions = plan(files, policy, now)
+        report.add(directories=1, files=len(files))
+        # The size limit is checked before compressing, so that nothing is
+        # compressed only to be deleted.
+        remaining = dict(files)
+        for action, name in actions:
+            if action == 'delete':
+                del remaining[name]
+        trimmed = trim(remaining, policy, now)
+        actions = [(action, name) for action, name in actions
+                   if name not in trimmed]
+        actions.extend(('delete', name) for name in trimmed)
+        if self.__dry_run:
+            for action, name in actions:
+                if action == 'delete':
+                    report.add(deleted=1, reclaimed=files[name][0])
+                else:
+                    report.add(compressed=1, compressed_bytes=files[name][0])
+            return
+
+        files = dict(files)
+        renamed = self.__carry_out(directory, files, actions, policy, report)
+        if renamed:
+            replay.RecordingIndex(directory).renamed(renamed)
+
+        if actions:
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                mtime = None
+            self.__manifest[directory] = {'mtime': mtime, 'files': files}
+
+    @staticmethod
+    def __carry_out(directory, files, actions, policy, report):
+        """Compress and delete recordings, updating files to match.
+        Returns the new names of the recordings that were compressed."""
+        renamed = {}
+        for action, name in actions:
+            path = os.path.join(directory, name)
+            size, mtime = files.pop(name)
+            try:
+                if action == 'delete':
+                    os.unlink(path)
+                    report.add(deleted=1, reclaimed=size)
+                else:
+                    new_name, new_size = recompress(path, policy.level)
+                    files[new_name] = (new_size, mtime)
+                    renamed[name] = new_name
+                    report.add(compressed=1, compressed_bytes=size,
+                               reclaimed=size - new_size)
+            except (OSError, EOFError, lzma.LZMAError) as error:
+                files[name] = (size, mtime)
+                report.add(errors=["{}: {}".format(path, error)])
+        return renamed
+
+    def run(self, policies):
+        """Apply policies to (directory, policy) pairs."""
+        self.__manifest = self.__load()
+        report = Report()
+        now = time.time()
+        with concurrent.futures.ThreadPoolExecutor(self.__workers) as pool:
+            for future in [pool.submit(self.__apply, directory, policy, now,
+                                       report)
+                           for directory, policy in policies]:
+                future.result()
+        if not self.__dry_run:
+            self.__save()
+        return report
+
+def directories(config):
+    """Every user directory with a retention policy, and its policy.
+
+    The users are found by listing the part of each game's recordings
+    template before {{user}}.
+    """
+    defaults = config.get('retention', {})
+    found = []
+    for game in config['games']:
+        if 'retention' not in game or 'recordings' not in game:
+            continue
+        policy = policy_from_config(defaults, game['retention'])
+        template = game['recordings'].replace("{{ user }}", "{{user}}")
+        if "{{user}}" not in template:
+            found.append((template, policy))
+            continue
+        prefix, suffix = template.split("{{user}}", 1)
+        try:
+            with os.scandir(prefix) as users:
+                for user in users:
+                    if user.is_dir(follow_symlinks=False):
+                        found.append((prefix + user.name + suffix, policy))
+        except OSError:
+            pass
+    return found
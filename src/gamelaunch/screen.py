@@ -0,0 +1,410 @@
+"""A model of a terminal screen, for coalescing what spectators are sent.
+
+Screen takes the bytes a game writes and keeps the cells of the screen
+they draw, with enough of a VT100/xterm emulation for curses games:
+cursor movement, erasing, inserting and deleting lines and characters,
+scroll regions, colours and attributes, and the DEC line drawing set.
+Anything else is ignored.
+
+Renderer turns the difference between the screen a viewer last saw and
+the screen now into the bytes that bring the viewer up to date. However
+much the game wrote in between, a frame is never more than one full
+redraw.
+"""
+
+import codecs
+import re
+
+# A run of printable text, one control character, or an escape sequence.
+TOKEN = re.compile(
+    r'([^\x00-\x1f\x7f\x1b]+)'
+    r'|\x1b\[([?>=!]?)([0-9;:]*)[ -/]*([@-~])'
+    r'|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)'
+    r'|\x1b([()*+#])(.)'
+    r'|\x1b([^\[\]()*+#])'
+    r'|([\x00-\x1a\x1c-\x1f\x7f])',
+    re.DOTALL)
+
+# An escape sequence that hasn't all arrived yet.
+PARTIAL = re.compile(
+    r'\x1b(\[[?>=!]?[0-9;:]*[ -/]*|\][^\x07\x1b]*|[()*+#])?\Z')
+
+# The DEC special graphics set, which curses uses for lines and boxes.
+DEC_GRAPHICS = dict(zip(
+    "`abcdefghijklmnopqrstuvwxyz{|}~",
+    "◆▒␉␌␍␊°±␤␋┘"
+    "┐┌└┼⎺⎻─⎼⎽├┤"
+    "┴┬│≤≥π≠£·"))
+
+BLANK_ATTR = ""
+
+class Screen:
+    """The cells of a terminal screen, updated from its output."""
+    #pylint: disable=too-many-instance-attributes
+    def __init__(self, rows=24, columns=80):
+        self.rows = rows
+        self.columns = columns
+        self.__decoder = codecs.getincrementaldecoder('utf-8')(
+            'surrogateescape')
+        self.__pending = ""
+        self.reset()
+
+    def reset(self):
+        """Go back to a blank screen."""
+        self.lines = [self.__blank_line() for _ in range(self.rows)]
+        self.x = 0
+        self.y = 0
+        self.__wrap = False
+        self.__top = 0
+        self.__bottom = self.rows - 1
+        self.__sgr = {}
+        self.__saved = (0, 0, self.__sgr)
+        self.attr = BLANK_ATTR
+        self.__charsets = ['B', 'B']
+        self.__shift = 0
+        self.cursor_visible = True
+
+    def __blank_line(self, attr=BLANK_ATTR):
+        """A line of spaces."""
+        return [(" ", attr)] * self.columns
+
+    def feed(self, data):
+        """Update the screen from bytes of output."""
+        text = self.__pending + self.__decoder.decode(data)
+        self.__pending = ""
+        position = 0
+        while position < len(text):
+            match = TOKEN.match(text, position)
+            if match is not None:
+                self.__token(match)
+                position = match.end()
+            elif PARTIAL.match(text, position):
+                # Keep an escape sequence that is cut off for the next feed.
+                self.__pending = text[position:]
+                break
+            else:
+                # Skip what isn't understood.
+                position += 1
+
+    def __token(self, match):
+        """Act on one token of output."""
+        text, private, params, final, designate, charset, escape, \
+            control = match.groups()
+        if text is not None:
+            self.__text(text)
+        elif final is not None:
+            self.__csi(private, params, final)
+        elif designate is not None:
+            if designate in "()":
+                self.__charsets["()".index(designate)] = charset
+        elif escape is not None:
+            self.__escape(escape)
+        elif control is not None:
+            self.__control(control)
+
+    def __text(self, text):
+        """Draw printable text at the cursor."""
+        if self.__charsets[self.__shift] == '0':
+            text = "".join(DEC_GRAPHICS.get(char, char) for char in text)
+        attr = self.attr
+        columns = self.columns
+        for char in text:
+            if self.__wrap:
+                self.__wrap = False
+                self.x = 0
+                self.__index()
+            self.lines[self.y][self.x] = (char, attr)
+            if self.x == columns - 1:
+                self.__wrap = True
+            else:
+                self.x += 1
+
+    def __control(self, control):
+        """Act on a control character."""
+        if control == "\r":
+            self.x = 0
+        elif control in "\n\x0b\x0c":
+            self.__index()
+        elif control == "\b":
+            self.x = max(self.x - 1, 0)
+        elif control == "\t":
+            self.x = min((self.x // 8 + 1) * 8, self.columns - 1)
+        elif control == "\x0e":
+            self.__shift = 1
+        elif control == "\x0f":
+            self.__shift = 0
+        self.__wrap = False
+
+    def __escape(self, escape):
+        """Act on a two character escape sequence."""
+        if escape == "D":
+            self.__index()
+        elif escape == "E":
+            self.x = 0
+            self.__index()
+        elif escape == "M":
+            self.__reverse_index()
+        elif escape == "7":
+            self.__save()
+        elif escape == "8":
+            self.__restore()
+        elif escape == "c":
+            self.reset()
+        self.__wrap = False
+
+    def __save(self):
+        """Save the cursor and attributes."""
+        self.__saved = (self.x, self.y, dict(self.__sgr))
+
+    def __restore(self):
+        """Go back to the saved cursor and attributes."""
+        self.x, self.y, sgr = self.__saved
+        self.__sgr = dict(sgr)
+        self.attr = ";".join(sgr[key] for key in sorted(sgr))
+
+    def __index(self):
+        """Move down a line, scrolling at the bottom of the region."""
+        if self.y == self.__bottom:
+            self.__scroll_up(1)
+        elif self.y < self.rows - 1:
+            self.y += 1
+
+    def __reverse_index(self):
+        """Move up a line, scrolling at the top of the region."""
+        if self.y == self.__top:
+            self.__scroll_down(1)
+        elif self.y > 0:
+            self.y -= 1
+
+    def __scroll_up(self, count, top=None):
+        """Scroll lines from top to the bottom of the region up."""
+        top = self.__top if top is None else top
+        bottom = self.__bottom + 1
+        count = min(count, bottom - top)
+        del self.lines[top:top + count]
+        for _ in range(count):
+            self.lines.insert(bottom - 1, self.__blank_line())
+
+    def __scroll_down(self, count, top=None):
+        """Scroll lines from top to the bottom of the region down."""
+        top = self.__top if top is None else top
+        bottom = self.__bottom + 1
+        count = min(count, bottom - top)
+        del self.lines[bottom - count:bottom]
+        for _ in range(count):
+            self.lines.insert(top, self.__blank_line())
+
+    def __csi(self, private, params, final):
+        """Act on a control sequence."""
+        #pylint: disable=too-many-branches, too-many-statements
+        values = [int(value) if value.isdigit() else 0
+                  for value in params.replace(":", ";").split(";")]
+        first = values[0] or 1
+        self.__wrap = False
+
+        if private:
+            if final in "hl":
+                self.__mode(values, final == "h")
+            return
+
+        if final == "m":
+            self.__set_attr(values)
+        elif final == "H" or final == "f":
+            self.y = min(first, self.rows) - 1
+            column = values[1] if len(values) > 1 else 0
+            self.x = min(column or 1, self.columns) - 1
+        elif final == "A":
+            self.y = max(self.y - first, 0)
+        elif final in "Be":
+            self.y = min(self.y + first, self.rows - 1)
+        elif final in "Ca":
+            self.x = min(self.x + first, self.columns - 1)
+        elif final == "D":
+            self.x = max(self.x - first, 0)
+        elif final == "E":
+            self.x = 0
+            self.y = min(self.y + first, self.rows - 1)
+        elif final == "F":
+            self.x = 0
+            self.y = max(self.y - first, 0)
+        elif final in "G`":
+            self.x = min(first, self.columns) - 1
+        elif final == "d":
+            self.y = min(first, self.rows) - 1
+        elif final == "J":
+            self.__erase_display(values[0])
+        elif final == "K":
+            self.__erase_line(values[0])
+        elif final == "X":
+            line = self.lines[self.y]
+            end = min(self.x + first, self.columns)
+            line[self.x:end] = [(" ", self.attr)] * (end - self.x)
+        elif final == "@":
+            line = self.lines[self.y]
+            count = min(first, self.columns - self.x)
+            line[self.x:self.x] = [(" ", self.attr)] * count
+            del line[self.columns:]
+        elif final == "P":
+            line = self.lines[self.y]
+            count = min(first, self.columns - self.x)
+            del line[self.x:self.x + count]
+            line.extend([(" ", self.attr)] * count)
+        elif final == "L":
+            if self.__top <= self.y <= self.__bottom:
+                self.__scroll_down(first, self.y)
+        elif final == "M":
+            if self.__top <= self.y <= self.__bottom:
+                self.__scroll_up(first, self.y)
+        elif final == "S":
+            self.__scroll_up(first)
+        elif final == "T":
+            self.__scroll_down(first)
+        elif final == "r":
+            top = (values[0] or 1) - 1
+            bottom = (values[1] if len(values) > 1 and values[1]
+                      else self.rows) - 1
+            if top < bottom < self.rows:
+                self.__top, self.__bottom = top, bottom
+                self.x, self.y = 0, 0
+        elif final == "s":
+            self.__save()
+        elif final == "u":
+            self.__restore()
+
+    def __mode(self, values, enable):
+        """Set private modes that change what is on the screen."""
+        for value in values:
+            if value == 25:
+                self.cursor_visible = enable
+            elif value in (47, 1047, 1049):
+                # Switching screens; either way starts out blank here.
+                self.lines = [self.__blank_line() for _ in range(self.rows)]
+
+    def __erase_display(self, how):
+        """Erase some or all of the screen."""
+        if how == 0:
+            self.__erase_line(0)
+            for row in range(self.y + 1, self.rows):
+                self.lines[row] = self.__blank_line(self.attr)
+        elif how == 1:
+            self.__erase_line(1)
+            for row in range(self.y):
+                self.lines[row] = self.__blank_line(self.attr)
+        elif how == 2:
+            self.lines = [self.__blank_line(self.attr)
+                          for _ in range(self.rows)]
+
+    def __erase_line(self, how):
+        """Erase some or all of the cursor's line."""
+        line = self.lines[self.y]
+        blank = (" ", self.attr)
+        if how == 0:
+            line[self.x:] = [blank] * (self.columns - self.x)
+        elif how == 1:
+            line[:self.x + 1] = [blank] * (self.x + 1)
+        else:
+            self.lines[self.y] = self.__blank_line(self.attr)
+
+    def __set_attr(self, values):
+        """Change the attributes of what is drawn next."""
+        sgr = self.__sgr
+        i = 0
+        while i < len(values):
+            value = values[i]
+            if value == 0:
+                sgr = {}
+            elif value in (38, 48) and i + 1 < len(values):
+                # 256 colour and true colour take more parameters.
+                length = 3 if values[i + 1] == 5 else 5
+                sgr[value // 10] = ";".join(
+                    str(part) for part in values[i:i + length])
+                i += length - 1
+            elif 30 <= value <= 37 or 90 <= value <= 97:
+                sgr[3] = str(value)
+            elif 40 <= value <= 47 or 100 <= value <= 107:
+                sgr[4] = str(value)
+            elif value == 39:
+                sgr.pop(3, None)
+            elif value == 49:
+                sgr.pop(4, None)
+            elif 1 <= value <= 9:
+                sgr[value * 10] = str(value)
+            elif value == 22:
+                sgr.pop(10, None)
+                sgr.pop(20, None)
+            elif 23 <= value <= 29:
+                sgr.pop((value - 20) * 10, None)
+            i += 1
+        self.__sgr = dict(sgr)
+        self.attr = ";".join(sgr[key] for key in sorted(sgr))
+
+class Renderer:
+    """Brings a viewer's terminal up to date with a screen."""
+    def __init__(self, rows, columns):
+        # what the viewer has, None for a line that must be drawn
+        self.__shown = [None] * rows
+        self.__rows = rows
+        self.__columns = columns
+        self.__attr = None
+        self.__full = True
+
+    def redraw(self):
+        """Draw everything in the next frame."""
+        self.__full = True
+
+    def frame(self, screen):
+        """The bytes that bring the viewer to what screen shows now, or b""
+        if they are already up to date."""
+        out = []
+        if self.__full:
+            out.append("\x1b[0m\x1b[H\x1b[2J")
+            self.__attr = BLANK_ATTR
+            self.__shown = [None] * self.__rows
+            self.__full = False
+
+        rows = min(self.__rows, screen.rows)
+        columns = min(self.__columns, screen.columns)
+        for row in range(rows):
+            line = screen.lines[row]
+            shown = self.__shown[row]
+            if shown == line:
+                continue
+            first, last = self.__changed(shown, line, columns)
+            if first is not None:
+                self.__draw(out, row, line, first, last)
+            self.__shown[row] = list(line)
+
+        if not out:
+            return b""
+        out.append("\x1b[{};{}H".format(min(screen.y, rows - 1) + 1,
+                                        min(screen.x, columns - 1) + 1))
+        out.append("\x1b[?25h" if screen.cursor_visible else "\x1b[?25l")
+        return "".join(out).encode('utf-8', 'surrogateescape')
+
+    @staticmethod
+    def __changed(shown, line, columns):
+        """The first and last columns that differ, or None if they don't."""
+        if shown is None:
+            # Skip the blank end of a line being drawn from scratch.
+            last = columns - 1
+            while last >= 0 and line[last] == (" ", BLANK_ATTR):
+                last -= 1
+            return (0, last) if last >= 0 else (None, None)
+        first = 0
+        while first < columns and shown[first] == line[first]:
+            first += 1
+        if first == columns:
+            return None, None
+        last = columns - 1
+        while shown[last] == line[last]:
+            last -= 1
+        return first, last
+
+    def __draw(self, out, row, line, first, last):
+        """Draw the cells of a line from first to last."""
+        out.append("\x1b[{};{}H".format(row + 1, first + 1))
+        for char, attr in line[first:last + 1]:
+            if attr != self.__attr:
+                out.append("\x1b[0;{}m".format(attr) if attr else "\x1b[0m")
+                self.__attr = attr
+            out.append(char)
@@ -0,0 +1,113 @@
+"""Anonymised session traces, for replaying real traffic in load tests.
+
+A trace records what a session did and when, but not who did it. It keeps
+the menus that were shown, the actions chosen from them, the keys pressed
+in menus and the time between them, login results, and how long games and
+watching lasted. It doesn't keep user names, the client's address, or
+anything typed. For a prompt (user name, password, email, SSH key) or the
+options editor, only which one it was and whether anything was typed is
+kept, when it is finished with.
+
+Menus whose keys are typed text say so with a field attribute, naming what
+is being typed. The keys of every other menu are recorded as they are.
+
+Each session's trace is written as one JSON line, with a single write on
+an O_APPEND descriptor when the session ends. Events are
+[milliseconds since the session started, kind, values...].
+bench/tracereplay.py replays them.
+"""
+
+import json
+import os
+import random
+import time
+
+# Stop recording a session after this many events.
+MAX_EVENTS = 10000
+
+def menu_name(menu):
+    """What to call a menu in a trace."""
+    if menu is None:
+        return None
+    source = getattr(menu, 'source', None)
+    if source is not None:
+        return "{}:{}".format(*source)
+    return type(menu).__name__
+
+class SessionTrace:
+    """Collects the events of one session and writes them out at the end."""
+    def __init__(self, path, started=None):
+        self.__path = path
+        self.__started = time.monotonic() if started is None else started
+        self.__start = int(time.time() - (time.monotonic() - self.__started))
+        self.__events = []
+        self.__truncated = False
+        # The field being typed into, and whether anything has been typed.
+        self.__field = None
+        self.__typed = False
+
+    def add(self, kind, *values):
+        """Record an event now."""
+        if len(self.__events) >= MAX_EVENTS:
+            self.__truncated = True
+            return
+        elapsed = int((time.monotonic() - self.__started) * 1000)
+        self.__events.append([elapsed, kind] + list(values))
+
+    def __finish_field(self):
+        """Record the field that was being typed into, if any."""
+        if self.__field is not None:
+            self.add('input', self.__field, self.__typed)
+            self.__field = None
+
+    def menu(self, menu):
+        """The menu on top of the stack has changed."""
+        self.__finish_field()
+        self.add('menu', menu_name(menu))
+
+    def key(self, menu, key):
+        """A key was pressed in menu."""
+        field = getattr(menu, 'field', None)
+        if field is None:
+            self.__finish_field()
+            self.add('key', key)
+            return
+        if field != self.__field:
+            self.__finish_field()
+            self.__field = field
+            self.__typed = False
+        if key != ord('\n'):
+            self.__typed = True
+
+    def close(self, reason):
+        """Write the trace out."""
+        self.__finish_field()
+        record = {
+            'start': self.__start,
+            'duration': round(time.monotonic() - self.__started, 3),
+            'reason': reason,
+            'events': self.__events,
+        }
+        if self.__truncated:
+            record['truncated'] = True
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        try:
+            fd = os.open(self.__path,
+                         os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, line.encode('utf-8'))
+            finally:
+                os.close(fd)
+        except OSError:
+            # Tracing must never take the launcher down.
+            pass
+
+def from_config(config, started=None):
+    """Create a trace for this session from the trace section of the config.
+
+    Returns None unless the session has been picked by the sample fraction.
+    """
+    options = config.get('trace')
+    if options is None or random.random() >= options.get('fraction', 0):
+        return None
+    return SessionTrace(options['path'], started)
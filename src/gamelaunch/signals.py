@@ -0,0 +1,90 @@
+"""Forwarding of hangups and terminations to running games.
+
+Docker doesn't pass signals through to the container of an attached client
+(https://github.com/docker/docker/issues/28872), so the launcher has to
+deliver them itself. Doing that from a signal handler means forking the
+docker CLI in the middle of teardown, and when a network blip drops many
+SSH connections at once every launcher does it at the same moment.
+
+Instead, the C level signal handler writes the signal number to a self-pipe
+(signal.set_wakeup_fd), and a supervisor thread reads it and delivers the
+signal to the container with a single engine API request. If the game
+hasn't stopped after a timeout the signal is escalated.
+"""
+
+import os
+import select
+import signal
+import threading
+from gamelaunch import process
+from gamelaunch.engine import EngineError
+
+FORWARDED = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGALRM)
+
+ESCALATION = ("SIGHUP", "SIGTERM", "SIGKILL")
+
+class SignalForwarder:
+    """Delivers signals received by the launcher to the running game."""
+    def __init__(self, engine, timeout=10.0, docker="docker"):
+        self.__engine = engine
+        self.__timeout = timeout
+        self.__docker = docker
+        self.__container = None
+        self.__container_engine = engine
+        self.__finished = threading.Event()
+        self.__lock = threading.Lock()
+
+        self.__read, write = os.pipe()
+        os.set_blocking(write, False)
+        signal.set_wakeup_fd(write, warn_on_full_buffer=False)
+
+        thread = threading.Thread(target=self.__supervise, daemon=True)
+        thread.start()
+
+    def watch(self, container, engine=None):
+        """Forward signals to container until release is called.
+
+        engine is the engine running the container if it isn't the default.
+        """
+        with self.__lock:
+            self.__container = container
+            self.__container_engine = engine or self.__engine
+            self.__finished.clear()
+
+    def release(self):
+        """The game has finished, stop forwarding to it."""
+        with self.__lock:
+            self.__container = None
+            self.__finished.set()
+
+    def __supervise(self):
+        """Wait for signals and forward them."""
+        while True:
+            select.select([self.__read], [], [])
+            received = os.read(self.__read, 512)
+            if any(sig in FORWARDED for sig in received):
+                with self.__lock:
+                    container = self.__container
+                    engine = self.__container_engine
+                if container is not None:
+                    self.__stop(engine, container)
+
+    def __stop(self, engine, container):
+        """Stop a container, escalating if it doesn't stop in time."""
+        for sig in ESCALATION:
+            if not self.__kill(engine, container, sig):
+                return
+            if self.__finished.wait(self.__timeout):
+                return
+
+    def __kill(self, engine, container, sig):
+        """Send a signal to the container. Returns False if it has gone."""
+        try:
+            return engine.kill(container, sig)
+        except EngineError:
+            # No engine socket we can use, so fall back to the CLI. This
+            # is in the supervisor thread, never in a signal handler.
+            process.run([self.__docker, "-H", engine.url(), "kill", "-s",
+                         sig, container],
+                        timeout=self.__timeout, quiet=True)
+            return True
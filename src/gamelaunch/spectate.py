@@ -0,0 +1,151 @@
+"""Watching a game with frames coalesced to fit the viewer's link.
+
+Relaying a game's output byte for byte floods a slow viewer when the game
+scrolls fast, and the viewer falls further and further behind. Instead,
+the output from the recorder is fed into a screen model, and the viewer is
+sent frames: the difference between what it was last sent and the screen
+now. A new frame is only made once the last one has been written, so
+updates that arrive in between are merged into the next frame rather than
+queued, and what the viewer sees is never more than about one frame old.
+
+The frame rate is chosen from how long frames take to drain to the viewer,
+so that frames use at most BUSY of the link, between min_fps and max_fps.
+"""
+
+import fcntl
+import os
+import select
+import subprocess
+import termios
+import time
+import tty
+from gamelaunch import screen
+
+# The fraction of the viewer's link that frames may use.
+BUSY = 0.5
+
+# Keys that redraw the whole screen, rather than stopping watching.
+REDRAW_KEYS = (b"\x0c", b"\x12")
+
+class Pacer:
+    """Chooses the time between frames from how fast they drain."""
+    #pylint: disable=too-few-public-methods
+    def __init__(self, min_fps=2.0, max_fps=20.0):
+        self.__shortest = 1.0 / max_fps
+        self.__longest = 1.0 / min_fps
+        self.__drain = 0.0
+
+    def drained(self, seconds):
+        """Record that a frame took seconds to write. Returns the time to
+        wait before the next frame."""
+        self.__drain = 0.7 * self.__drain + 0.3 * seconds
+        return max(self.__shortest, min(self.__drain / BUSY, self.__longest))
+
+class Spectator:
+    """Sends a viewer coalesced frames of a game's output."""
+    #pylint: disable=too-many-instance-attributes
+    def __init__(self, upstream, keys, out, options):
+        self.__upstream = upstream
+        self.__keys = keys
+        self.__out = out
+        self.__screen = screen.Screen(options.get('rows', 24),
+                                      options.get('columns', 80))
+        rows, columns = self.__screen.rows, self.__screen.columns
+        try:
+            size = os.get_terminal_size(out)
+            rows = size.lines or rows
+            columns = size.columns or columns
+        except OSError:
+            pass
+        self.__renderer = screen.Renderer(rows, columns)
+        self.__pacer = Pacer(options.get('min_fps', 2),
+                             options.get('max_fps', 20))
+        self.stats = {'frames': 0, 'skipped': 0, 'bytes_in': 0,
+                      'bytes_out': 0}
+
+    def __frame(self):
+        """Make a frame of what has changed."""
+        data = self.__renderer.frame(self.__screen)
+        if data:
+            self.stats['frames'] += 1
+            self.stats['bytes_out'] += len(data)
+        return memoryview(data)
+
+    def run(self):
+        """Watch until the game ends or a key is pressed."""
+        #pylint: disable=too-many-branches
+        pending = memoryview(b"")
+        updates = 0
+        started = 0.0
+        next_frame = 0.0
+        running = True
+
+        while running or pending or updates:
+            now = time.monotonic()
+            # The end of the game is shown straight away.
+            if not pending and updates and (now >= next_frame or
+                                            not running):
+                pending = self.__frame()
+                started = now
+                self.stats['skipped'] += updates - 1
+                updates = 0
+
+            timeout = None
+            if not pending and updates:
+                timeout = max(next_frame - now, 0)
+            readers = [self.__keys]
+            if running:
+                readers.append(self.__upstream)
+            ready, writable, _ = select.select(
+                readers, [self.__out] if pending else [], [], timeout)
+
+            if self.__keys in ready:
+                key = os.read(self.__keys, 16)
+                if key not in REDRAW_KEYS:
+                    return
+                self.__renderer.redraw()
+                updates += 1
+
+            if self.__upstream in ready:
+                data = os.read(self.__upstream, 65536)
+                if data:
+                    self.stats['bytes_in'] += len(data)
+                    self.__screen.feed(data)
+                    updates += 1
+                else:
+                    running = False
+
+            if writable and pending:
+                try:
+                    pending = pending[os.write(self.__out, pending):]
+                except BlockingIOError:
+                    continue
+                if not pending:
+                    drained = time.monotonic()
+                    next_frame = drained + self.__pacer.drained(
+                        drained - started)
+
+def watch(server, port, watch_user, options):
+    """Watch a running game, coalescing its output. Returns the counts of
+    what was sent."""
+    client = subprocess.Popen(
+        ["termrecord_client", "-host", server, "-port", port,
+         "-user", watch_user, "-watch"],
+        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+
+    keys = 0
+    out = 1
+    saved = termios.tcgetattr(keys)
+    flags = fcntl.fcntl(out, fcntl.F_GETFL)
+    tty.setcbreak(keys)
+    fcntl.fcntl(out, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    try:
+        spectator = Spectator(client.stdout.fileno(), keys, out, options)
+        spectator.run()
+    finally:
+        fcntl.fcntl(out, fcntl.F_SETFL, flags)
+        termios.tcsetattr(keys, termios.TCSADRAIN, saved)
+        client.terminate()
+        client.wait()
+        client.stdout.close()
+    return spectator.stats
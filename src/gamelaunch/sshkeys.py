@@ -0,0 +1,114 @@
+"""Logging in with SSH keys.
+
+Players can register their SSH public keys from the logged in menu. Each
+key is stored with its SHA256 fingerprint, in the form OpenSSH prints it,
+and the fingerprints are indexed. Only the key a player is connected with
+can be registered, the one sshd names in SSH_USER_AUTH, because anyone
+can paste someone else's public key.
+
+For sshd to accept the keys on the shared launcher account it needs
+authkeys.py as its AuthorizedKeysCommand, which looks the offered key up
+by fingerprint. With ExposeAuthInfo, sshd then tells the launcher which
+key was used, in the file named by SSH_USER_AUTH, and the launcher logs
+the key's owner in without asking for a password:
+
+    Match User nethack
+        AuthorizedKeysCommand /path/to/authkeys.py --config /path/to/gamelaunch.yml %f
+        AuthorizedKeysCommandUser pygame
+        ExposeAuthInfo yes
+
+sshd only lets a key in that AuthorizedKeysCommand prints, so a new key
+can't be used to connect and be registered. Where the launcher account is
+open to anyone anyway, set register in the ssh_keys section and pass the
+key to authkeys.py as well, and it accepts any key:
+
+    AuthorizedKeysCommand /path/to/authkeys.py --config /path/to/gamelaunch.yml %f %t %k
+
+A key that isn't registered logs no one in, the player logs in with their
+password and can then register it.
+
+Don't let clients set SSH_USER_AUTH with AcceptEnv, or anyone could name
+someone else's auth file.
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+import stat
+import struct
+
+# The key types OpenSSH accepts.
+KEY_TYPES = {
+    'ssh-ed25519', 'ssh-rsa', 'ssh-dss', 'ecdsa-sha2-nistp256',
+    'ecdsa-sha2-nistp384', 'ecdsa-sha2-nistp521',
+    'sk-ssh-ed25519@openssh.com', 'sk-ecdsa-sha2-nistp256@openssh.com',
+}
+
+class InvalidKey(ValueError):
+    """Thrown for a line that isn't a public key."""
+    pass
+
+def _blob_type(blob):
+    """The key type written at the start of a key blob."""
+    if len(blob) < 4:
+        return None
+    length, = struct.unpack(">I", blob[:4])
+    return blob[4:4 + length].decode('ascii', 'replace')
+
+def parse_key(line):
+    """Parse a public key, as it is in a .pub file.
+
+    Returns (type, blob, comment).
+    """
+    parts = line.strip().split(None, 2)
+    if len(parts) < 2 or parts[0] not in KEY_TYPES:
+        raise InvalidKey("not an SSH public key")
+    try:
+        blob = base64.b64decode(parts[1], validate=True)
+    except (binascii.Error, ValueError):
+        raise InvalidKey("the key isn't valid base64")
+    if _blob_type(blob) != parts[0]:
+        raise InvalidKey("the key doesn't match its type")
+    return parts[0], blob, parts[2] if len(parts) > 2 else ""
+
+def fingerprint(blob):
+    """The SHA256 fingerprint of a key blob, as OpenSSH shows it."""
+    digest = base64.b64encode(hashlib.sha256(blob).digest())
+    return "SHA256:" + digest.decode('ascii').rstrip("=")
+
+def format_key(key_type, blob):
+    """A key without its comment, as an authorized_keys line has it."""
+    return "{} {}".format(key_type, base64.b64encode(blob).decode('ascii'))
+
+def authenticated_keys(environ=None):
+    """The public keys the client authenticated with, from the file that
+    sshd names in SSH_USER_AUTH. Returns (type, blob, comment) tuples.
+
+    The file is only trusted if it is ours and no one else can write it.
+    """
+    environ = os.environ if environ is None else environ
+    path = environ.get('SSH_USER_AUTH')
+    if not path:
+        return []
+    try:
+        with open(path) as file:
+            info = os.fstat(file.fileno())
+            if not stat.S_ISREG(info.st_mode) or \
+                    info.st_uid != os.getuid() or \
+                    info.st_mode & 0o022:
+                return []
+            lines = file.read().splitlines()
+    except OSError:
+        return []
+
+    keys = []
+    for line in lines:
+        method, _, key = line.partition(" ")
+        if method != "publickey":
+            continue
+        try:
+            keys.append(parse_key(key))
+        except InvalidKey:
+            continue
+    return keys
@@ -0,0 +1,34 @@
+"""Reading game statistics.
+
+The running totals in user_stats and game_stats are kept by the ingester
+in gamelaunch.gamelogs. These are the queries that the launcher's stats
+menu makes, in plain SQL, so that the launcher doesn't load SQLAlchemy.
+"""
+
+ORDERS = ['best', 'wins', 'games']
+
+_GAME_COLUMNS = ('game', 'players', 'games', 'points', 'best', 'best_name',
+                 'wins')
+
+def leaderboard(database, game, order='best', limit=20):
+    """The top players of a game, as plain dicts."""
+    if order not in ORDERS:
+        raise KeyError(order)
+    # order is one of ORDERS, so it is safe to put in the SQL.
+    rows = database.query(
+        "SELECT name, best, games, wins FROM user_stats WHERE game = :game "
+        "ORDER BY " + order + " DESC, name LIMIT :limit",
+        game=game, limit=limit)
+    return [{'name': row[0], 'best': row[1], 'games': row[2],
+             'wins': row[3]} for row in rows]
+
+def summary(database, game):
+    """The totals for a game, as a dict, or None if it has no games."""
+    rows = database.query(
+        "SELECT " + ", ".join(_GAME_COLUMNS) + " FROM game_stats "
+        "WHERE game = :game", game=game)
+    return dict(zip(_GAME_COLUMNS, rows[0])) if rows else None
+
+def game_key(game):
+    """The name that a game's statistics are stored under."""
+    return game.get('stats', {}).get('name', game['name'])
@@ -0,0 +1,23 @@
+#!/usr/bin/python3
+
+"""
+Serves the games being played, and streams them to browsers over
+WebSockets, so people can watch without logging in to the launcher.
+"""
+
+import argparse
+from gamelaunch import configfile
+from gamelaunch import gateway
+
+def main():
+    """Read gamelaunch.yml and serve."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--config", default="gamelaunch.yml",
+                        help="launcher config with the gateway settings")
+    options = parser.parse_args()
+
+    config = configfile.parse(options.config)
+    gateway.serve(config)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,15 @@
 ALREADY_PLAYING = ["""
-It looks like you are already playing a game. If your session was disconnected,
-then due to a bug in docker your game is probably still running.
+It looks like you are already playing a game, and we couldn't reconnect you
+to it. It may be running in another session.
 """,
 """Please contact {{contact}} with your username and we can terminate your
 session without losing your game.""",
 "Press any key to continue..."
 ]
+
+SERVER_FULL = ["""
+The server is running as many games as it can right now, so your game can't
+be started. Please try again in a few minutes.
+""",
+"Press any key to continue..."
+]
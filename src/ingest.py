@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+
+"""
+Loads new games and events from each game's xlogfile and livelog into the
+database, for the leaderboards. Runs until killed, or once with --once.
+"""
+
+import argparse
+import sys
+import time
+from gamelaunch import configfile
+from gamelaunch import db
+from gamelaunch import gamelogs
+
+def main():
+    """Ingest the game logs every interval seconds."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--config", default="gamelaunch.yml",
+                        help="launcher config with the games")
+    parser.add_argument("--once", action="store_true",
+                        help="ingest what there is and exit")
+    parser.add_argument("--interval", type=float, default=5,
+                        help="seconds between reads")
+    options = parser.parse_args()
+
+    config = configfile.parse(options.config)
+
+    ingester = gamelogs.Ingester(
+        db.Database(config.get('database', "users.db")),
+        gamelogs.logs_from_config(config))
+    while True:
+        loaded = ingester.ingest()
+        if loaded or ingester.skipped:
+            print("loaded {} lines, skipped {}".format(loaded,
+                                                        ingester.skipped),
+                  file=sys.stderr)
+            ingester.skipped = 0
+        if options.once:
+            break
+        time.sleep(options.interval)
+
+if __name__ == "__main__":
+    main()
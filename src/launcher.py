@@ -9,31 +9,49 @@ gamelaunch.yml.
 
 import bcrypt
 import curses
-import curses.ascii
-import datetime
+from gamelaunch import admission
+from gamelaunch import configfile
+from gamelaunch import containers
 from gamelaunch import db
+from gamelaunch import editor
+from gamelaunch import engine
+from gamelaunch import eventlog
+from gamelaunch import latency
+from gamelaunch import menus
+from gamelaunch import metrics
+from gamelaunch import placement
+from gamelaunch import playcache
+from gamelaunch import process
+from gamelaunch import profiler
+from gamelaunch import replay
+from gamelaunch import sessiontrace
+from gamelaunch import signals
+from gamelaunch import sshkeys
+from gamelaunch import stats as game_stats
+from gamelaunch.engine import EngineError
 import gamelaunch
 import info
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm.exc import NoResultFound
 import os
 import re
 import signal
+import socket
 import sys
 from jinja2 import Template
-import textwrap
 import time
 import traceback
 import tty
-import yaml
 
 VERSION = "0.1.0"
 
-logfile = open("/home/pygame/gamelaunch.log", "a")
+CONFIG = "gamelaunch.yml"
+
+# The session log for this launcher process, set up in run().
+session_log = None
 
 def log(string, game="Launcher"):
-    thetime = datetime.datetime.now()
-    logfile.write("{}:{}:{}\n".format(thetime, game, string))
+    """Log a free form message for the current session."""
+    if session_log is not None:
+        session_log.event('message', game=game, message=string)
 
 def sanitize(word):
     """ Sanitize a string to only have alphanumeric characters."""
@@ -55,28 +73,42 @@ class GameLauncher:
 
     LoginLine = 3
     WinStart = 4
+    # How often to look for a new config while waiting for a key, in ms.
+    KeyTimeout = 1000
 
-    def __init__(self, scr, config):
-        menus = config['menus']
-
-        if 'actions' in config:
-            self.__actions = config['actions']
-        else:
-            self.__actions = {}
+    def __init__(self, scr, config, slog, stats, prof=None, watcher=None,
+                 trace=None):
+        #pylint: disable=too-many-arguments
+        self.__template_args = {}
+        self.__games = []
+        self.__configure(config)
 
-        if 'idle_time' in config:
-            self.__idle_time = config['idle_time']
-        else:
-            self.__idle_time = 60
+        self.__docker_binary = config.get('docker', "/usr/bin/docker")
+        self.__options_editor = config.get('options_editor', 'builtin')
+        self.__action_timeout = config.get('action_timeout', 60)
+        self.__admission = admission.from_config(config)
+        self.__key_login = config.get('ssh_keys', {}).get('login', False)
+        self.__queue_time = config.get('admission', {}).get('queue_time', 0)
 
         self.__scr = scr
         self.__menustack = []
         self.__exiting = False
+        self.__signals = []
+        # Who is attached to a game, in the playing table.
+        self.__owner = (socket.gethostname(), os.getpid())
         self.__user = ""
-        self.__menus = menus
-
-        self.__database = db.Database()
-        self.__session = None
+        self.__user_id = None
+        self.__user_record = None
+        self.__log = slog
+        self.__stats = stats
+        self.__profiler = prof
+        self.__watcher = watcher
+        self.__trace = trace
+        self.__key_timeout = -1 if watcher is None else self.KeyTimeout
+
+        self.__database = db.Database(config.get('database', "users.db"))
+        self.__placement = placement.from_config(config, self.__database)
+        self.__playing = playcache.from_config(config)
 
         if 'recorder' in config:
             recorder = config['recorder']
@@ -86,34 +118,61 @@ class GameLauncher:
             self.__record_host = 'localhost'
             self.__record_port = 34234
 
-        self.__template_args = {}
-
-        if 'contact' in config:
-            self.__template_args['contact'] = config['contact']
-
-        self.__init_games(config['games'])
+        watch = config.get('watch', {})
+        self.__coalesce = watch if watch.get('coalesce', False) else None
 
         self.__init_curses()
 
         self.push_menu("main")
+        self.__log.phase_done('menu', self.__log.elapsed())
+
+        self.__connection_keys = []
+        if self.__key_login:
+            self.__connection_keys = sshkeys.authenticated_keys()
+            self.__login_with_key()
 
         self.__container = None
 
         # Register handlers to send SIGHUP to games.
         # This would not be necessary if docker passed signals.
         # See https://github.com/docker/docker/issues/28872
+        # The forwarder does the sending, outside of the signal handler.
+        self.__forwarder = signals.SignalForwarder(
+            engine.from_config(config),
+            config.get('kill_timeout', 10),
+            self.__docker_binary)
         signal.signal(signal.SIGHUP, self.__killed)
         signal.signal(signal.SIGTERM, self.__killed)
         signal.signal(signal.SIGINT, self.__killed)
         signal.signal(signal.SIGALRM, self.__killed)
 
     def __killed(self, sig, _):
+        # The handler only notes the signal. Logging from here could break
+        # into the event log in the middle of a flush, so the signal is
+        # logged by __handle_signals from the main loop.
+        self.__signals.append((sig, self.__container))
         if self.__container is not None:
-            gamelaunch.execwait("docker", "docker", "kill", "-s", "SIGHUP",
-                                self.__container)
+            # The forwarder has already been woken up through the wakeup fd
+            # and is stopping the game.
             self.__exiting = True
-        else:
-            # kill with the default action if we are not running a game
+
+    def __handle_signals(self):
+        """Log the signals that have arrived. A signal that came when no
+        game was running kills the launcher with its default action."""
+        while self.__signals:
+            sig, container = self.__signals.pop(0)
+            self.__log.event('signal', signal=sig, container=container)
+            self.__stats.inc('signals_total',
+                             signal=signal.Signals(sig).name)
+            if container is not None:
+                continue
+
+            self.__log.flush()
+            self.__stats.inc('exits_total', reason='signal')
+            if self.__profiler is not None:
+                self.__profiler.stop()
+            if self.__trace is not None:
+                self.__trace.close('signal')
             signal.signal(sig, signal.SIG_DFL)
             os.kill(os.getpid(), sig)
 
@@ -127,9 +186,76 @@ class GameLauncher:
         self.__menustack[-1].draw(self)
         self.__window.refresh()
 
+    def __configure(self, config):
+        """Take the settings that can change while the launcher runs."""
+        self.__menus = config['menus']
+        self.__actions = config.get('actions', {})
+        self.__idle_time = config.get('idle_time', 60)
+        self.__resources = config.get('resources', {})
+        self.__latency = config.get('latency')
+        if 'contact' in config:
+            self.__template_args['contact'] = config['contact']
+        self.__init_games(config['games'])
+
+    def __check_config(self):
+        """Swap in a new config if the file has changed."""
+        if self.__watcher is None:
+            return
+        config, error = self.__watcher.take()
+        if error is not None:
+            self.__log.event('config_rejected', error=str(error))
+            self.__stats.inc('config_reloads_total', result='rejected')
+        if config is None:
+            return
+
+        self.__configure(config)
+        self.__rebuild_menus()
+        self.__log.event('config_reloaded')
+        self.__stats.inc('config_reloads_total', result='ok')
+        if len(self.__menustack) > 0:
+            self.redraw()
+
+    def __game(self, name):
+        """Find a game by name. Raises KeyError if there is none."""
+        for game in self.__games:
+            if game['name'] == name:
+                return game
+        raise KeyError(name)
+
+    def __make_menu(self, source):
+        """Build a menu from the config. source is ('menu', name), or a kind
+        of game menu and the game's name. Games are found by name, because
+        their numbers change when the config is reordered."""
+        kind, which = source
+        if kind == 'menu':
+            menu = menus.Menu(self.__menus[which], self)
+        elif kind == 'game':
+            game = self.__game(which)
+            menu = menus.Menu(game['menu'], self, game=game)
+        else:
+            menu = menus.GAME_MENUS[kind](self.__game(which)['name'])
+        menu.source = source
+        return menu
+
+    def __rebuild_menus(self):
+        """Rebuild the open menus from the current config.
+
+        Menus that no longer exist are closed, with everything above them.
+        """
+        for i, menu in enumerate(self.__menustack):
+            source = getattr(menu, 'source', None)
+            if source is None:
+                continue
+            try:
+                self.__menustack[i] = self.__make_menu(source)
+            except (KeyError, IndexError):
+                del self.__menustack[i:]
+                break
+
     def __init_curses(self):
         """Initialise the screen."""
         scr = self.__scr
+        scr.timeout(self.__key_timeout)
         height, width = scr.getmaxyx()
         rowy = self.WinStart
 
@@ -143,6 +269,18 @@ class GameLauncher:
             self.__logged_in("Not logged in")
         scr.refresh()
 
+    def __leave_curses(self):
+        """Hand the terminal over to another program."""
+        if self.__profiler is not None:
+            self.__profiler.pause()
+        curses.endwin()
+
+    def __enter_curses(self):
+        """Take the terminal back after another program has finished."""
+        self.__scr = curses.initscr()
+        self.__init_curses()
+        if self.__profiler is not None:
+            self.__profiler.resume()
 
     def __init_games(self, games):
         """Initialise the game numbers."""
@@ -157,12 +295,13 @@ class GameLauncher:
         """Push a menu onto the menu stack, creating a menu from a string
         if necessary."""
         if isinstance(menu, str):
-            menu = Menu(self.__menus[menu], self)
+            menu = self.__make_menu(('menu', menu))
         self.__push_menu(menu)
 
     def __push_menu(self, menu):
         """The real menu push that redraws the window."""
         self.__menustack.append(menu)
+        self.__traced_menu()
         self.__window.clear()
         menu.draw(self)
         self.__window.refresh()
@@ -170,6 +309,18 @@ class GameLauncher:
     def __pop_menu(self):
         """Do the actual menu pop."""
         self.__menustack.pop()
+        self.__traced_menu()
+
+    def __traced_menu(self):
+        """Trace the menu that is now on top."""
+        if self.__trace is not None:
+            self.__trace.menu(self.__menustack[-1] if self.__menustack
+                              else None)
+
+    def trace(self, kind, *values):
+        """Add an event to the session trace, if this session is traced."""
+        if self.__trace is not None:
+            self.__trace.add(kind, *values)
 
     def pop_menu(self, redraw=True):
         """Remove a menu from the stack."""
@@ -180,16 +331,27 @@ class GameLauncher:
             self.__top().draw(self)
             self.__window.refresh()
 
-    def game_menu(self, which):
-        """Go to a game menu identified by which."""
-        menu = self.__games[which]
-        self.__push_menu(Menu(menu['menu'], self, game=menu))
+    def game_menu(self, which, kind='game'):
+        """Go to a menu of kind for the game numbered which."""
+        self.__push_menu(self.__make_menu(
+            (kind, self.__games[which]['name'])))
 
     def run(self):
         """Run the game launcher."""
         while not self.__exiting and len(self.__menustack) > 0:
             key = self.__scr.getch()
-            self.__top().key(key, self)
+            # getch gives -1 if it was interrupted by a signal, or timed out
+            self.__handle_signals()
+            if key != -1:
+                if self.__trace is not None:
+                    self.__trace.key(self.__top(), key)
+                self.__top().key(key, self)
+            self.__check_config()
+        self.__handle_signals()
+
+    def exit_reason(self):
+        """Why the launcher stopped running."""
+        return 'hangup' if self.__exiting else 'quit'
 
     def quit(self):
         """Quit from a menu."""
@@ -207,46 +369,66 @@ class GameLauncher:
 
     def __log_login_attempt(self, user, success):
         """Logs a login attempt."""
-        sess = self.__database.begin()
-
         client = ""
         if 'SSH_CLIENT' in os.environ:
             client = os.environ['SSH_CLIENT']
 
-        attempt = db.Logins(username=user, success=success, client=client)
-        sess.add(attempt)
-        sess.commit()
-        sess.close()
+        db.log_login(self.__database, user, success, client)
 
     def login(self, user, password):
         """Try to login."""
-        sess = self.__database.begin()
-        user_record = sess.query(db.User).filter(
-            db.User.username == user).first()
-
-        if user_record is not None:
-            existing = user_record.password
-            hashed = bcrypt.hashpw(password.encode('utf-8'), existing)
-
-            if hashed == existing:
-                self.__pop_menu()
-                self.__do_login(user)
-                sess.close()
-                self.__log_login_attempt(user, True)
-                return
-        else:
-            # Hash something anyway to not give away the non-existence
-            # of a user
-            bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        user_record = db.get_user(self.__database, user)
+
+        with self.__log.phase('login', login=user) as phase, \
+                self.__stats.time('bcrypt_seconds'):
+            phase['success'] = False
+            if user_record is not None:
+                existing = user_record.password
+                hashed = bcrypt.hashpw(password.encode('utf-8'), existing)
+                phase['success'] = hashed == existing
+            else:
+                # Hash something anyway to not give away the non-existence
+                # of a user
+                bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+
+        self.__stats.inc('logins_total', method='password',
+                         result='ok' if phase['success'] else 'failed')
+        self.trace('login', phase['success'])
+        if phase['success']:
+            self.__pop_menu()
+            self.__user_record = user_record
+            self.__do_login(user, user_record.id)
+            self.__log_login_attempt(user, True)
+            return
 
         # we get here if not logged in
-        sess.close()
         self.__log_login_attempt(user, False)
         self.redraw()
 
-    def __do_login(self, user):
+    def __login_with_key(self):
+        """Log in the owner of the key the client authenticated with, if
+        it is registered."""
+        for key_type, blob, _ in self.__connection_keys:
+            fingerprint = sshkeys.fingerprint(blob)
+            with self.__log.phase('login', method='key',
+                                  fingerprint=fingerprint) as phase:
+                user_record = db.ssh_key_user(self.__database, fingerprint)
+                phase['success'] = user_record is not None
+            if user_record is None:
+                continue
+            self.__stats.inc('logins_total', method='key', result='ok')
+            self.trace('key_login')
+            self.__user_record = user_record
+            self.__do_login(user_record.username, user_record.id)
+            self.__log_login_attempt(user_record.username, True)
+            self.__log.event('key_login', key_type=key_type)
+            return
+
+    def __do_login(self, user, user_id):
         """Log a user in."""
         self.__user = user
+        self.__user_id = user_id
+        self.__log.set_user(user)
         self.__template_args['user'] = user
         self.__logged_in("Logged in as: {}".format(user))
         self.push_menu("loggedin")
@@ -305,88 +487,147 @@ class GameLauncher:
             values['email'])
 
         try:
-            db.add_user(self.__database, user_record)
+            user_id = db.add_user(self.__database, user_record)
 
             self.status("Created new user")
             self.__pop_menu()
-            self.__do_login(user)
+            self.__user_record = user_record
+            self.__do_login(user, user_id)
             if 'register' in self.__actions:
-                action = self.render_template(self.__actions['register'])
-                pipe = os.popen("bash -c '" + action + "'", "r")
-                pipe.read()
-                pipe.close()
-        except IntegrityError:
+                self.__run_action(self.__actions['register'])
+        except db.IntegrityError:
             self.status("Username already in use")
             self.__pop_menu()
             self.push_menu('main')
 
+    def __run_action(self, action, game="Launcher"):
+        """Run a shell action from the config, logging its output."""
+        command = self.render_template(action)
+        log("Running " + command, game)
+        output = []
+        try:
+            result = process.run(["bash", "-c", command],
+                                 timeout=self.__action_timeout,
+                                 output=output.append)
+        except OSError as error:
+            log("Error running {}: {}".format(command, error), game)
+            return
+
+        self.__log.event('action', game=game, command=command,
+                         returncode=result.returncode,
+                         timed_out=result.timed_out,
+                         duration=round(result.elapsed, 6),
+                         cpu=round(result.user + result.system, 6),
+                         output=b"".join(output).decode('utf-8', 'replace'))
+
     def __execute(self, binary, args, message=None, custom=None):
         """Execute a program."""
-        curses.endwin()
+        self.__leave_curses()
 
         if custom is not None:
             custom(binary, args)
         else:
-            pid = os.fork()
-            if pid == 0:
-                if message is not None:
-                    print(message)
-                try:
-                    os.execvp(binary, args)
-                except OSError as error:
-                    print("Error executing {}:{}".format(binary, error))
-                sys.exit(1)
-            else:
-                os.waitpid(pid, 0)
-
-        self.__scr = curses.initscr()
-        self.__init_curses()
-
-    def __docker(self, docker, image, args):
-        """Run something in docker."""
-
-        docker = [
-            "run",
-            "--rm",
-            "-it",
-            "--detach-keys",
-            "ctrl-@,ctrl-^",
-        ] + docker
-
-        docker.append(image)
-        docker.extend(args)
-
-        binary = "/usr/bin/docker"
-
-        curses.endwin()
-        gamelaunch.rungame(
+            if message is not None:
+                print(message)
+            try:
+                process.run([binary] + args[1:])
+            except OSError as error:
+                print("Error executing {}:{}".format(binary, error))
+
+        self.__enter_curses()
+
+    def __attach(self, container, node):
+        """Reattach to a game that is still running."""
+        return self.__run_docker(
+            ["attach", "--detach-keys", containers.DETACH_KEYS, container],
+            node)
+
+    def __run_docker(self, docker, node):
+        """Run the docker CLI on node, recording the session."""
+        if node.name is not None:
+            docker = ["-H", node.engine] + docker
+
+        binary = self.__docker_binary
+        monitor = latency.sample(self.__latency, self.__stats)
+
+        self.__leave_curses()
+        usage = gamelaunch.rungame(
             binary,
             docker,
             self.__record_host,
             "{}".format(self.__record_port),
             self.__user,
-            self.__idle_time)
-        self.__scr = curses.initscr()
-        self.__init_curses()
+            self.__idle_time,
+            monitor)
+        self.__enter_curses()
+        if monitor is not None:
+            self.__log.event('echo_latency', node=node.name,
+                             **monitor.summary())
+        return usage
 
         #self.__execute(binary, [binary] + run_args, message)
 
+    def __admit(self, game):
+        """Get a slot to run a game in, waiting for one if the host is full.
+
+        Returns None if no slot became free."""
+        reserved = 0
+        if self.__admission.limited:
+            reserved = containers.count_detached(
+                self.__database, self.__owner[0], self.__placement,
+                self.__playing)
+        slot = self.__admission.try_acquire(reserved)
+        if slot is not None or self.__queue_time <= 0:
+            return slot
+
+        self.status("The server is full, waiting for a free slot. "
+                    "Press q to give up.")
+        self.__log.event('queued', game=game['name'])
+        deadline = time.monotonic() + self.__queue_time
+        self.__scr.timeout(500)
+        try:
+            while slot is None and time.monotonic() < deadline:
+                key = self.__scr.getch()
+                self.__handle_signals()
+                if key == ord('q'):
+                    break
+                slot = self.__admission.try_acquire(reserved)
+        finally:
+            self.__scr.timeout(self.__key_timeout)
+            self.status("")
+        return slot
+
     def play(self, which):
-        """Launch a game."""
+        """Launch a game, or go back to the one the user left running."""
         game = self.__games[which]
 
-        docker = []
-        args = []
+        # A game that is still running is rejoined before anything else,
+        # it already has its place on the host.
+        playing = db.get_playing(self.__database, self.__user_id)
+        if playing is not None and not self.__resume(game, playing):
+            return
 
-        if 'volumes' in game:
-            for volumes in game['volumes']:
-                docker.append("-v")
-                volume = "{}:{}".format(
-                    self.render_template(volumes[0]),
-                    self.render_template(volumes[1])
-                )
-                docker.append(volume)
+        slot = self.__admit(game)
+        if slot is None:
+            self.__log.event('rejected', game=game['name'])
+            self.__stats.inc('admission_rejected_total', game=game['name'])
+            self.push_menu(menus.InformationMenu(self, info.SERVER_FULL))
+            return
 
+        try:
+            self.__play(game)
+        finally:
+            slot.release()
+
+    def __container_name(self, game):
+        """The name of the user's container for a game."""
+        return self.render_template("{{game}}-{{user}}",
+                                    game=sanitize(game['name']),
+                                    user=sanitize(self.__user))
+
+    def __play(self, game):
+        """Launch a game once it has been admitted."""
+        args = []
         if 'arguments' in game:
             game_args = game['arguments']
             if isinstance(game_args, list):
@@ -394,57 +635,196 @@ class GameLauncher:
             else:
                 args.append(self.render_template(game_args))
 
-        container_name = self.render_template("{{game}}-{{user}}",
-                                              game=sanitize(game['name']),
-                                              user=sanitize(self.__user))
-
-        docker.extend(["--name", container_name])
+        container_name = self.__container_name(game)
+        docker = containers.run_command(
+            game, self.__resources, self.render_template, container_name,
+            args)
 
         try:
-            self.__start_playing()
-            self.__container = container_name
-
-            if 'precmd' in game:
-                for action in game['precmd']:
-                    command = "bash -c '" + self.render_template(action) + "'"
-                    log("Running " + command, game['name'])
-                    pipe = os.popen(command, "r")
-                    pipe.read()
-                    pipe.close()
-            self.__docker(docker, game['image'], args)
+            node = self.__placement.choose()
+        except placement.NoNodeAvailable:
+            self.__log.event('rejected', game=game['name'], reason='nodes')
+            self.__stats.inc('admission_rejected_total', game=game['name'])
+            self.push_menu(menus.InformationMenu(self, info.SERVER_FULL))
+            return
+
+        if not self.__start_playing(node.name, container_name):
+            self.__already_playing(game)
+            return
+
+        with self.__log.phase('precmd', game=game['name']), \
+                self.__stats.time('precmd_seconds', game=game['name']):
+            for action in game.get('precmd', []):
+                self.__run_action(action, game['name'])
+
+        self.__run_game(game['name'], container_name, node,
+                        lambda: self.__run_docker(docker, node))
+
+    def __run_game(self, name, container, node, start=None):
+        """Run a game and tidy up after it. start starts the game, or if it
+        is None the running game in container is rejoined."""
+        resume = start is None
+        self.__container = container
+        engine_client = self.__placement.engine(node.name)
+        self.__forwarder.watch(container, engine_client)
+        self.__stats.inc('play_starts_total', game=name, resumed=resume)
+        self.__stats.gauge('games_live', 1, game=name)
+
+        # The docker CLI gives us no hook between the container starting
+        # and the game running, so both are timed as the game phase.
+        started = time.monotonic()
+        with self.__log.phase('game', game=name, container=container,
+                              node=node.name, resumed=resume) as phase, \
+                self.__stats.time('game_seconds', game=name):
+            usage = self.__attach(container, node) if resume else start()
+            phase['cpu'] = round(usage.user + usage.system, 6)
+            if usage.maxrss is not None:
+                phase['maxrss'] = usage.maxrss
+        self.__stats.gauge('games_live', -1, game=name)
+        self.trace('play', round(time.monotonic() - started, 3))
+
+        with self.__log.phase('teardown', game=name):
+            self.__forwarder.release()
             self.__container = None
+            # If the player detached the game is still running, and they
+            # can come back to it later, from this launcher or another.
+            if containers.still_running(engine_client, container):
+                db.detach_playing(self.__database, self.__user_id)
+            else:
+                self.__stop_playing()
+
+    def __already_playing(self, game):
+        """Tell the user that they can't start a game."""
+        self.__log.event('already_playing', game=game['name'])
+        self.__stats.inc('already_playing_total', game=game['name'])
+        self.push_menu(menus.InformationMenu(self, info.ALREADY_PLAYING))
+
+    def __game_label(self, container):
+        """The name of the game running in one of the user's containers."""
+        for game in self.__games:
+            if self.__container_name(game) == container:
+                return game['name']
+        return container
+
+    def __resume(self, game, playing):
+        """Deal with the user already playing when they start game.
+
+        If no launcher is attached to their game, whichever game it is,
+        they are put back into it. Returns True if the playing row was
+        left behind by a game that has finished, after removing it, so
+        that game can be started.
+        """
+        if containers.owner_alive(playing, self.__owner):
+            self.__already_playing(game)
+            return False
+
+        try:
+            node = self.__placement.node(playing.node)
+        except placement.UnknownNode:
+            # The game may still be running on a node that was taken out of
+            # the config, so its row is left alone.
+            self.__log.event('unknown_node', node=playing.node)
+            self.__already_playing(game)
+            return False
+        running = False
+        if playing.container is not None:
+            try:
+                running = self.__placement.engine(playing.node).running(
+                    playing.container)
+            except EngineError:
+                self.__already_playing(game)
+                return False
+
+        if not running:
+            self.__log.event('stale_playing', node=node.name)
             self.__stop_playing()
-        except IntegrityError:
-            self.push_menu(InformationMenu(self, info.ALREADY_PLAYING))
-
-    def __start_playing(self):
-        """The current user has started playing."""
-        session = self.__database.begin()
-        user = session.\
-            query(db.User).filter(db.User.username == self.__user).one()
-        playing = db.Playing(id=user.id, since=time.time())
-        session.add(playing)
-        session.commit()
+            return True
+
+        if not db.claim_playing(self.__database, playing, self.__owner):
+            self.__already_playing(game)
+            return False
+
+        self.__log.event('resume', container=playing.container,
+                         node=node.name)
+        # The game was counted as detached while nobody was attached, so
+        # there is room for it to take its slot back.
+        slot = self.__admission.try_acquire()
+        try:
+            self.__run_game(self.__game_label(playing.container),
+                            playing.container, node)
+        finally:
+            if slot is not None:
+                slot.release()
+        return False
+
+    def __start_playing(self, node, container):
+        """The current user has started playing container on node.
+
+        Returns False if they were already playing."""
+        started = db.start_playing(self.__database, self.__user_id, node,
+                                   container, self.__owner)
+        if started:
+            self.__playing.invalidate()
+        return started
 
     def __stop_playing(self):
         """The current user has stopped playing."""
-        session = self.__database.begin()
-        user = session.query(db.User).\
-            filter(db.User.username == self.__user).one()
-
-        playing = session.query(db.Playing).filter(db.Playing.id == user.id).one()
-        session.delete(playing)
-        session.commit()
+        db.stop_playing(self.__database, self.__user_id)
+        self.__playing.invalidate()
 
     def playing(self):
         """Get the playing users."""
-        session = self.__database.begin()
-        playing = session.query(db.Playing, db.User).join(db.User).all()
-        session.commit()
-        return playing
+        return self.__playing.get(lambda: db.playing_list(self.__database))
+
+    def scores(self, name, order):
+        """Get the totals and leaderboard for a game."""
+        key = game_stats.game_key(self.__game(name))
+        return (game_stats.summary(self.__database, key),
+                game_stats.leaderboard(self.__database, key, order,
+                                       menus.LeaderboardMenu.rows))
+
+    def recordings(self, name):
+        """Get the current user's recordings of a game, newest first."""
+        game = self.__game(name)
+        if 'recordings' not in game:
+            return []
+        index = replay.RecordingIndex(self.render_template(game['recordings']))
+        return [(index.path(entry), entry) for entry in index.entries()]
+
+    def replay(self, path, entry):
+        """Replay a recording."""
+        self.__stats.inc('replays_total')
+        self.__log.event('replay', recording=os.path.basename(path),
+                         size=entry['size'])
+        self.__leave_curses()
+        print("\033[2J\033[H", end='', flush=True)
+        try:
+            replay.Player(path, entry).play(sys.stdin.fileno(),
+                                            sys.stdout.fileno())
+        except OSError as error:
+            print("Error replaying {}: {}".format(path, error))
+
+        # clear the screen
+        print("\033[2J", end='')
+
+        self.__enter_curses()
 
-    def edit_options(self, path):
+    def edit_options(self, path, game=None):
         """Edit the options for a game."""
+        game = game or {}
+        if game.get('options_editor', self.__options_editor) == 'docker':
+            self.__edit_in_docker(path)
+            return
+
+        self.__log.event('edit_options', game=game.get('name', ""))
+        validator = editor.VALIDATORS.get(game.get('options_syntax'))
+        try:
+            self.push_menu(menus.EditorMenu(path, validator))
+        except OSError as error:
+            self.status("Can't open your options: {}".format(error.strerror))
+
+    def __edit_in_docker(self, path):
+        """Edit an options file with vim in a container."""
         args = [
             "docker",
             "run",
@@ -456,457 +836,148 @@ class GameLauncher:
             "/.nethackrc"
         ]
 
-        curses.endwin()
-        pid = os.fork()
-        if pid == 0:
-            print("Loading editor...")
-            print("Mounting: " + path + " as /.nethackrc")
-
-            os.execv("/usr/bin/docker", args)
-        else:
-            os.waitpid(pid, 0)
-
-        self.__scr = curses.initscr()
-        self.__init_curses()
-
-    def __get_user(self, username):
-        """Get the userid for the username."""
-        session = self.__begin_session()
-        users = session.query(db.User).\
-            filter(db.User.username == username).all()
-
-        if len(users) != 0:
-            return users[0]
-        else:
+        self.__leave_curses()
+        print("Loading editor...")
+        print("Mounting: " + path + " as /.nethackrc")
+        try:
+            process.run([self.__docker_binary] + args[1:])
+        except OSError as error:
+            print("Error executing {}:{}".format(self.__docker_binary, error))
+        self.__enter_curses()
+
+    def __check_user(self):
+        """Make sure someone is logged in."""
+        if self.__user_id is None:
             raise InvalidUser()
 
-    def __begin_session(self):
-        """Begin a database session."""
-        self.__session = self.__database.begin()
-        return self.__session
-
-    def __commit_session(self):
-        """Commit the database session."""
-        self.__session.commit()
-        self.__session = None
-
     def change_password(self, password):
         """Change the user's password."""
-        user = self.__get_user(self.__user)
-        db.update_password(user, password)
+        self.__check_user()
+        db.set_password(self.__database, self.__user_id, password)
         self.status("Password changed")
-        self.__commit_session()
 
     def change_email(self, email):
         """Change the user's email."""
-        user = self.__get_user(self.__user)
-        user.email = email
+        self.__check_user()
+        db.set_email(self.__database, self.__user_id, email)
+        self.__user_record.email = email
         self.status("Email changed")
-        self.__commit_session()
+
+    def ssh_keys(self):
+        """Get the user's SSH keys."""
+        self.__check_user()
+        return db.ssh_keys(self.__database, self.__user_id)
+
+    def unregistered_key(self):
+        """The key the client connected with, if it isn't registered."""
+        if self.__user_id is None:
+            return None
+        for key_type, blob, comment in self.__connection_keys:
+            if db.ssh_key_user(self.__database,
+                               sshkeys.fingerprint(blob)) is None:
+                return "{} {}".format(sshkeys.format_key(key_type, blob),
+                                      comment).strip()
+        return None
+
+    def add_ssh_key(self):
+        """Register the key the client connected with for the user. Only a
+        key that sshd has seen the client use is taken, so no one can
+        register someone else's public key."""
+        self.__check_user()
+        line = self.unregistered_key()
+        if line is None:
+            self.status("You aren't connected with a new key.")
+            return
+        key_type, blob, comment = sshkeys.parse_key(line)
+        if len(self.ssh_keys()) >= menus.SshKeysMenu.rows:
+            self.status("You can have at most {} keys.".format(
+                menus.SshKeysMenu.rows))
+            return
+
+        fingerprint = sshkeys.fingerprint(blob)
+        if db.add_ssh_key(self.__database, self.__user_id, fingerprint,
+                          sshkeys.format_key(key_type, blob), comment[:80]):
+            self.__log.event('ssh_key_added', fingerprint=fingerprint)
+            self.status("Key added")
+        else:
+            self.status("That key is already in use.")
+
+    def delete_ssh_key(self, key):
+        """Remove one of the user's SSH keys."""
+        self.__check_user()
+        db.delete_ssh_key(self.__database, self.__user_id, key['id'])
+        self.__log.event('ssh_key_deleted', fingerprint=key['fingerprint'])
+        self.status("Key removed")
 
     def __termplay(self, user):
         """Watch a game."""
-        curses.endwin()
+        self.__leave_curses()
 
-        gamelaunch.watch(
+        started = time.monotonic()
+        sent = gamelaunch.watch(
             self.__record_host,
             "{}".format(self.__record_port),
-            user)
+            user,
+            self.__coalesce)
+        if sent is not None:
+            self.__log.event('watch_done', watched=user, **sent)
+        self.trace('watch', round(time.monotonic() - started, 3))
 
         # clear the screen
         print("\033[2J", end='')
 
-        self.__scr = curses.initscr()
-        self.__init_curses()
+        self.__enter_curses()
 
     def watch(self, userid):
         """Watch the game being played by userid."""
-        session = self.__database.begin()
-        query = session.query(db.User).filter(db.User.id == userid)
-
-        try:
-            playing = query.one()
-            self.__termplay(playing.username)
-        except NoResultFound:
-            # that player is not actually playing
-            # maybe they quit since the menu was shown
-            pass
-
-class WatchMenu:
-    """The menu to watch other games."""
-    offset = 2
-    help_message = [
-        "Select a game to play with the alphabetic keys.",
-        "Press any key to stop watching."
-    ]
-
-    def __init__(self):
-        self.__playing = []
-
-    def draw_row(self, app, player, row):
-        """Draw a single row in the watch menu."""
-        user = player[1]
-        screen = app.screen()
-        screen.addstr(
-            self.offset + row, 1,
-            "{})  {}".format(chr(row + ord('a')), user.username))
-
-    def update_playing(self, app):
-        """Update the playing users."""
-        playing = app.playing()
-        self.__playing = playing
-
-        row = 0
-        if len(playing) == 0:
-            message = "It looks like no-one is playing right now."
-            app.screen().addstr(self.offset + row, 1, message)
-            row += 1
-        else:
-            for player in playing:
-                self.draw_row(app, player, row)
-                row += 1
-
-        row += 1
-        app.screen().addstr(
-            self.offset + row,
-            1,
-            "Press q to quit this menu.")
-        row += 1
-
-        # Draw the help
-        if len(playing) > 0:
-            row += 1
-            for line in self.help_message:
-                app.screen().addstr(self.offset + row, 1, line)
-                row += 1
-
-    def draw(self, app):
-        """Draw the watch menu."""
-        self.update_playing(app)
-
-    def key(self, key, app):
-        """Handle a key press."""
-        if key == ord('q'):
-            app.pop_menu()
-        elif key >= ord('a') and key <= ord('z'):
-            which = key - ord('a')
-            if which < len(self.__playing):
-                app.watch(self.__playing[which][0].id)
-
-class KeyInput:
-    """Base class for handling key input."""
-    #pylint: disable=too-many-arguments
-    def __init__(self, echo, key, message, nextmenu, hint=None):
-        self.__text = ""
-        self.__echo = echo
-        self.__next = nextmenu
-        self.__values = {}
-        self.__key = key
-        self.__message = message + " Empty input cancels."
-
-        if hint is None:
-            hint = []
-
-        self.__help = hint
-
-    def key(self, key, app):
-        """Handle a key press."""
-        scr = app.screen()
-        chcode = chr(key)
-        if key == ord('\n'):
-            if self.__text == "":
-                app.pop_menu()
-            else:
-                self.__do_next(app)
-        elif key == curses.KEY_BACKSPACE or key == 127:
-            if len(self.__text) > 0:
-                self.__text = self.__text[0: -1]
-
-                if self.__echo:
-                    ypos, xpos = scr.getyx()
-                    scr.move(ypos, xpos-1)
-                    scr.delch()
-                    scr.refresh()
-
-        elif curses.ascii.isgraph(chcode):
-            self.__text += chcode
-
-            if self.__echo:
-                scr.addstr(chcode)
-                scr.refresh()
-
-    def __do_next(self, app):
-        """Do the next menu after taking input."""
-        app.pop_menu(False)
-        values = self.__values.copy()
-        values[self.__key] = self.__text
-        self.__next.start(app, values)
-
-    def start(self, app, values):
-        """Set up the menu."""
-        self.__values = values
-        app.push_menu(self)
-
-    def draw(self, app):
-        """Draw the actual key input menu."""
-
-        # Draw the hint message
-        app.screen().addstr(1, 1, self.__message)
-
-        # Draw the help under the cursor
-        row = 5
-        for paragraph in self.__help:
-            wrapped = textwrap.wrap(paragraph)
-            for line in wrapped:
-                app.screen().addstr(row, 1, line)
-                row += 1
-
-            row += 1
-
-        # Put the cursor in place for input
-        app.screen().move(3, 1)
-
-class UserNameMenu(KeyInput):
-    """A menu that takes a username as input."""
-    def __init__(self, nextmenu):
-        super().__init__(True, "user", "Enter your username.", nextmenu)
-
-class PasswordMenu(KeyInput):
-    """A menu that takes a password as input."""
-    def __init__(self, nextmenu, hint=None):
-        super().__init__(
-            False,
-            "password",
-            "Enter your password.",
-            nextmenu,
-            hint=hint)
-
-class DoLoginMenu:
-    #pylint: disable=too-few-public-methods
-    """A fake menu that does the actual login."""
-    @staticmethod
-    def start(app, values):
-        """Do the actual login."""
-        app.login(values['user'], values['password'])
-
-class DoRegisterMenu:
-    #pylint: disable=too-few-public-methods
-    """A fake menu that does the user registration."""
-    @staticmethod
-    def start(app, values):
-        """Do the user register."""
-        app.register(values)
-
-class EmailMenu(KeyInput):
-    """A menu that takes an email address."""
-    def __init__(self, nextmenu):
-        super().__init__(
-            True,
-            "email",
-            "Enter your email address.",
-            nextmenu,
-            hint=[
-                '''We will never send you email, except if you ask us to
-                reset your password.'''
-            ])
-
-class ChangePasswordMenu:
-    #pylint: disable=too-few-public-methods
-    """Fake menu to do the actual change password."""
-    @staticmethod
-    def start(app, values):
-        """Run the change password."""
-        app.change_password(values['password'])
-        app.redraw()
-
-class ChangeEmailMenu:
-    #pylint: disable=too-few-public-methods
-    """Fake menu to do the actual change email."""
-    @staticmethod
-    def start(app, values):
-        """Run the change email."""
-        app.change_email(values['email'])
-        app.redraw()
-
-class ChoiceRunner:
-    """The choice runner runs actions that are specified in the config."""
-    def __init__(self, app, **kwargs):
-        self.__app = app
-        self.__args = kwargs
-
-    def run(self, command):
-        """Run an action."""
-        parts = self.__app.render_template(command, **self.__args).split(' ')
-        self.__commands[parts[0]](self, parts[1:])
-
-    def login(self, _):
-        """Login."""
-        menu = UserNameMenu(PasswordMenu(DoLoginMenu()))
-        self.__app.push_menu(menu)
-
-    def game(self, args):
-        """Go to a game menu."""
-        self.__app.game_menu(int(args[0]))
-
-    def quit(self, _):
-        """Quit the current menu."""
-        self.__app.quit()
-
-    def play(self, args):
-        """Play a game."""
-        self.__app.play(int(args[0]))
-
-    def register(self, _):
-        """Register a user."""
-
-        password_hint = [
-            'Your password should be a unique memorable phrase.',
-            '''If you forget your password, send us an email from your
-            registered email address and we will reset it.''',
-            '''We store your password using 12 rounds of bcrypt, and it
-            is transmitted securely with SSH, but you should probably
-            not reuse passwords anyway.''',
-        ]
-        menu = UserNameMenu(PasswordMenu(
-            EmailMenu(DoRegisterMenu()),
-            password_hint))
-        self.__app.push_menu(menu)
-
-    def edit(self, args):
-        """Run the edit command."""
-        self.__app.edit_options(self.__render(args[0]))
-
-    def __render(self, text):
-        """Render the menu."""
-        return self.__app.render_template(text, **self.__args)
-
-    def changepass(self, _):
-        """Go to the change password menu."""
-        if self.__app.user() == "":
-            pass
-            #self.status("You are not logged in")
-        else:
-            self.__app.push_menu(PasswordMenu(ChangePasswordMenu()))
-
-    def changeemail(self, _):
-        """Go to the change email menu."""
-        if self.__app.user() == "":
-            pass
-            #self.status("You are not logged in")
-        else:
-            self.__app.push_menu(EmailMenu(ChangeEmailMenu()))
-
-    def watch(self, _):
-        """Change to the watch menu."""
-        self.__app.push_menu(WatchMenu())
-
-    __commands = {
-        "login" : login,
-        "game" : game,
-        "play" : play,
-        "quit" : quit,
-        "register" : register,
-        "edit" : edit,
-        "changepass" : changepass,
-        "changeemail" : changeemail,
-        "watch" : watch
-    }
-
-class InformationMenu:
-    """ A generic menu for showing information to the user."""
-
-    def __init__(self, app, text: list):
-        rendered = []
-
-        for paragraph in text:
-            rendered.append(textwrap.wrap(app.render_template(paragraph)))
-
-        self.__text = rendered
-
-    @staticmethod
-    def key(_, app):
-        """ Called on key press, just pops the menu."""
-        app.pop_menu()
-
-    def draw(self, app):
-        """ Draw the menu."""
-        row = 1
-        screen = app.screen()
-
-        for paragraph in self.__text:
-            for line in paragraph:
-                screen.addstr(row, 1, line)
-                row += 1
-            row += 1
-
-class Menu:
-    """The main game menu class."""
-    def __init__(self, definition, app, **kwargs):
-        self.__runner = ChoiceRunner(app, **kwargs)
-        self.__lines = []
-        self.__keys = {}
-        self.__args = kwargs
-        self.__news = definition['news'] if 'news' in definition else None
-        # menus can either be an array describing the menu,
-        # or a string that the engine expands to some menu items
-        for line in definition['items']:
-            if line is not "blank" and isinstance(line, str):
-                menus = app.generate_menus(line)
-                for i in menus:
-                    self.__add_item(i, app)
-            else:
-                self.__add_item(line, app)
-
-    def __add_item(self, line, app):
-        """Add a menu item to the menu."""
-        if line == "blank":
-            self.__lines.append("")
-        else:
-            text = app.render_template(line['title'], **self.__args)
-            self.__keys[ord(line['key'])] = line
-            self.__lines.append("{}) {}".format(line['key'], text))
-
-    def draw(self, app):
-        """Draw all the lines in a menu."""
-        i = 1
-        scr = app.screen()
-        for line in self.__lines:
-            scr.addstr(i, 1, line)
-            i += 1
-
-        # Draw the news
-        if self.__news is not None:
-            i += 1
-            #pylint: disable=no-member
-            scr.hline(i, 1, curses.ACS_HLINE, 77)
-            i += 1
+        for player in self.playing():
+            if player['id'] == userid:
+                self.__stats.inc('watch_joins_total')
+                self.__termplay(player['username'])
+                return
+        # that player is not actually playing
+        # maybe they quit since the menu was shown
 
-            for paragraph in self.__news:
-                news = textwrap.wrap(paragraph)
-                i += 1
-                for line in news:
-                    scr.addstr(i, 1, line)
-                    i += 1
+def run(scr):
+    """The main game runner. Intended to be run inside a curses wrapper."""
+    #pylint: disable=global-statement
+    global session_log
 
-    def key(self, pressed, _):
-        """Called on a key press."""
-        if pressed in self.__keys:
-            keydata = self.__keys[pressed]
-            self.__runner.run(keydata['action'])
+    started = time.monotonic()
+    cache = configfile.ConfigCache(CONFIG)
+    config = cache.load()
+    watcher = configfile.ConfigWatcher(
+        CONFIG, cache, config.get('reload', {}).get('interval', 2.0))
+    watcher.start()
 
-    def action(self, key):
-        """Return the action for the specified key."""
-        return self.__keys[key]['action']
+    events = eventlog.from_config(config)
+    session_log = eventlog.SessionLog(events, started)
+    session_log.event('connect', client=os.environ.get('SSH_CLIENT', ''),
+                      version=VERSION)
 
+    stats = metrics.from_config(config)
+    stats.inc('connections_total')
+    stats.gauge('sessions_live', 1)
 
-def run(scr):
-    """The main game runner. Intended to be run inside a curses wrapper."""
-    file = open("gamelaunch.yml")
-    config = yaml.load(file)
-
-    game = GameLauncher(scr, config)
+    prof = profiler.from_config(config)
+    trace = sessiontrace.from_config(config, started)
 
-    game.run()
+    reason = 'error'
+    try:
+        game = GameLauncher(scr, config, session_log, stats, prof, watcher,
+                            trace)
+        game.run()
+        reason = game.exit_reason()
+    finally:
+        stats.inc('exits_total', reason=reason)
+        stats.gauge('sessions_live', -1)
+        session_log.event('disconnect', reason=reason,
+                          duration=round(session_log.elapsed(), 6))
+        events.close()
+        if prof is not None:
+            prof.stop()
+        if trace is not None:
+            trace.close(reason)
 
 def handle_interrupt(*_):
     """We don't want keyboard interrupts to do anything."""
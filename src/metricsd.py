@@ -0,0 +1,23 @@
+#!/usr/bin/python3
+
+"""
+Aggregates the metrics sent by all launcher processes and serves them to
+Prometheus on localhost.
+"""
+
+import sys
+from gamelaunch import configfile
+from gamelaunch import metrics
+
+def main():
+    """Read the metrics settings from gamelaunch.yml and serve."""
+    path = sys.argv[1] if len(sys.argv) > 1 else "gamelaunch.yml"
+    config = configfile.parse(path)
+
+    options = config['metrics']
+    metrics.serve(options['socket'],
+                  options.get('host', "127.0.0.1"),
+                  options.get('port', 9163))
+
+if __name__ == "__main__":
+    main()
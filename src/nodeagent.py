@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+
+"""
+Reports the load of a game node to the shared database so that launchers
+can place new games on the least loaded node.
+
+Usage: nodeagent.py NAME [ENGINE_URL]
+"""
+
+import os
+import sys
+import time
+from gamelaunch import configfile
+from gamelaunch import db
+from gamelaunch import engine
+from gamelaunch import placement
+from gamelaunch.engine import EngineError
+
+def main():
+    """Report this node's load until killed."""
+    if len(sys.argv) < 2:
+        print(__doc__.strip())
+        sys.exit(1)
+
+    name = sys.argv[1]
+    url = sys.argv[2] if len(sys.argv) > 2 else engine.DEFAULT_URL
+
+    config = configfile.parse("gamelaunch.yml")
+
+    database = db.Database(config.get('database', "users.db"))
+    client = engine.Engine(url)
+    interval = config.get('placement', {}).get('interval', 10)
+    cpus = os.cpu_count() or 1
+
+    while True:
+        try:
+            games = len(client.containers())
+            placement.report(database, name, games, os.getloadavg()[0] / cpus)
+        except EngineError as error:
+            print("Can't reach the engine at {}: {}".format(url, error),
+                  file=sys.stderr)
+        time.sleep(interval)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+
+"""
+Applies the games' retention policies to users' recordings: recompresses
+old recordings with xz and deletes those past their age or size limits.
+Run it from cron.
+"""
+
+import argparse
+import sys
+from gamelaunch import configfile
+from gamelaunch import retention
+
+def megabytes(count):
+    """Format a byte count."""
+    return "{:.1f} MB".format(count / 1e6)
+
+def main():
+    """Parse the command line and apply the policies."""
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--config", default="gamelaunch.yml",
+                        help="launcher config with the policies")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="report what would be done without doing it")
+    parser.add_argument("--workers", type=int,
+                        help="directories to work on at once")
+    options = parser.parse_args()
+
+    config = configfile.parse(options.config)
+    settings = config.get('retention', {})
+
+    job = retention.Retention(
+        settings.get('manifest', "retention.json"),
+        options.workers or settings.get('workers', 8), options.dry_run)
+    report = job.run(retention.directories(config))
+
+    for error in report.errors:
+        print(error, file=sys.stderr)
+    prefix = "would have " if options.dry_run else ""
+    print("{} directories ({} rescanned), {} recordings".format(
+        report.directories, report.scanned, report.files))
+    print("{}compressed {} recordings of {}".format(
+        prefix, report.compressed, megabytes(report.compressed_bytes)))
+    print("{}deleted {} recordings".format(prefix, report.deleted))
+    print("{}reclaimed {}{}".format(
+        prefix, megabytes(report.reclaimed),
+        ", plus what compression saves" if options.dry_run and
+        report.compressed else ""))
+
+if __name__ == "__main__":
+    main()
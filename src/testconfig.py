@@ -1,12 +1,11 @@
 #!/usr/bin/python
 
-import yaml
+from gamelaunch import configfile
 from pprint import pprint
 from sys import argv
 
 def load(config):
-    f = open(config)
-    return yaml.load(f)
+    return configfile.parse(config)
 
 def pretty(y):
     pprint(y, indent=4)
@@ -0,0 +1,22 @@
+"""Shared fixtures for the tests, which import from src."""
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+#pylint: disable=wrong-import-position
+from gamelaunch import db
+
+@pytest.fixture
+def database(tmp_path):
+    """A new, empty database."""
+    database = db.Database(str(tmp_path / "users.db"))
+    database.create()
+    return database
+
+def add_user(database, name):
+    """Add a user without a password. Returns the user's id."""
+    return db.add_user(database, db.UserRow(
+        username=name, password="", salt="", email=""))
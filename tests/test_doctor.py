@@ -0,0 +1,113 @@
+"""Tests for the launcher health checks."""
+
+import socket
+import threading
+import pytest
+from gamelaunch import doctor
+from gamelaunch.doctor import Probe
+
+@pytest.fixture
+def recorder():
+    """A listening socket standing in for the recorder. Returns its port."""
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    yield listener.getsockname()[1]
+    listener.close()
+
+def closed_port():
+    """A port with nothing listening on it."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@pytest.mark.parametrize("value, limits, status", [
+    (0.05, (0.1, 1.0), doctor.PASS),
+    (0.1, (0.1, 1.0), doctor.WARN),
+    (1.5, (0.1, 1.0), doctor.FAIL),
+    (0.5, (0.1, 0.02), doctor.PASS),
+    (0.05, (0.1, 0.02), doctor.WARN),
+    (0.01, (0.1, 0.02), doctor.FAIL),
+])
+def test_grade(value, limits, status):
+    assert doctor.grade(value, *limits) == status
+
+def test_probes_from_config():
+    config = {
+        'database': "/tmp/users.db",
+        'nodes': [{'name': 'n1', 'engine': "unix:///n1.sock"},
+                  {'name': 'n2', 'engine': "unix:///n2.sock"}],
+        'recorder': {'host': "localhost", 'port': 34234},
+        'doctor': {'docker': [1, 3]},
+        'games': [{'image': "nethack", 'recordings': "/srv/{{user}}/ttyrec",
+                   'root': "/srv/nethack"},
+                  {'image': "nethack", 'recordings': "/srv/{{user}}/ttyrec"}],
+    }
+    probes = doctor.probes_from_config(config)
+    assert [probe.name for probe in probes] == [
+        'database', 'bcrypt', 'docker n1', 'images n1', 'docker n2',
+        'images n2', 'recorder', 'disk /srv/{{user}}/ttyrec',
+        'disk /srv/nethack']
+    docker = probes[2].arguments
+    assert docker[0].url() == "unix:///n1.sock" and docker[1] == (1, 3)
+    assert probes[3].arguments[1] == ["nethack"]
+
+def test_probes_local_engine():
+    probes = doctor.probes_from_config({'engine': "tcp://docker:2375",
+                                        'games': []})
+    names = {probe.name: probe for probe in probes}
+    assert names['docker local'].arguments[0].url() == "tcp://docker:2375"
+    assert 'recorder' not in names
+
+def test_recorder(recorder):
+    status, took, message = doctor.probe_recorder(
+        "127.0.0.1", recorder, (5.0, 10.0))
+    assert status == doctor.PASS and took is not None
+    assert "connected" in message
+
+    status, took, _ = doctor.probe_recorder(
+        "127.0.0.1", closed_port(), (5.0, 10.0))
+    assert status == doctor.FAIL and took is None
+
+def test_database(database, tmp_path):
+    status, _, message = doctor.probe_database(
+        str(tmp_path / "users.db"), (5.0, 10.0))
+    assert status == doctor.PASS and "write lock" in message
+    status, _, _ = doctor.probe_database(str(tmp_path / "none.db"),
+                                         (5.0, 10.0))
+    assert status == doctor.FAIL
+
+def test_run(recorder):
+    release = threading.Event()
+    def slow():
+        release.wait()
+        return doctor.PASS, None, "finished late"
+    def broken():
+        raise ValueError("broken")
+    probes = [
+        Probe('recorder', doctor.probe_recorder,
+              ("127.0.0.1", recorder, (5.0, 10.0))),
+        Probe('slow', slow, ()),
+        Probe('broken', broken, ()),
+    ]
+    try:
+        report = doctor.run(probes, timeout=0.5)
+    finally:
+        release.set()
+
+    assert report['status'] == doctor.FAIL
+    results = report['probes']
+    assert [result['name'] for result in results] == \
+        ['recorder', 'slow', 'broken']
+    assert results[0]['status'] == doctor.PASS
+    assert results[1]['status'] == doctor.FAIL
+    assert results[1]['message'] == "didn't finish in 0.5 s"
+    assert results[2]['message'] == "ValueError: broken"
+    assert doctor.format_report(report)[-1].startswith(
+        "1 passed, 0 warned, 2 failed")
+
+def test_run_passes(recorder):
+    report = doctor.run([Probe('recorder', doctor.probe_recorder,
+                               ("127.0.0.1", recorder, (5.0, 10.0)))])
+    assert report['status'] == doctor.PASS
+    assert doctor.run([])['status'] == doctor.PASS
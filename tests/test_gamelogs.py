@@ -0,0 +1,140 @@
+"""Tests for loading game logs into the database."""
+
+import os
+import pytest
+from gamelaunch import gamelogs
+from gamelaunch import stats
+from gamelaunch.gamelogs import LogFile
+
+def xlog_line(name, points, death="killed by a jackal"):
+    """An xlogfile line for a finished game."""
+    return ("version=3.6.6\tpoints={}\tdeath={}\tname={}\tturns=100\t"
+            "endtime=1600000000\n".format(points, death, name))
+
+@pytest.fixture
+def xlog(tmp_path):
+    """An empty xlogfile for the game nethack."""
+    path = tmp_path / "xlogfile"
+    path.write_text("")
+    return LogFile('nethack', str(path), 'xlog')
+
+def append(log, text):
+    """Append text to a log."""
+    with open(log.path, "a") as file:
+        file.write(text)
+
+def records(database):
+    """The names and points in game_records."""
+    return database.query(
+        "SELECT name, points FROM game_records ORDER BY id")
+
+def test_parse_line():
+    assert gamelogs.parse_line("a=1:b=x=y:junk") == \
+        {'a': "1", 'b': "x=y"}
+    assert gamelogs.parse_line("a=1:2\tb=3") == {'a': "1:2", 'b': "3"}
+
+def test_to_row():
+    row = gamelogs.to_row('nethack', {'name': "alice", 'points': "0x10",
+                                      'turns': "junk"},
+                          gamelogs.XLOG_FIELDS)
+    assert row['game'] == 'nethack' and row['points'] == 16
+    assert row['turns'] is None and row['death'] is None
+    assert gamelogs.to_row('nethack', {'points': "1"},
+                           gamelogs.XLOG_FIELDS) is None
+
+def test_read_chunk(tmp_path):
+    path = tmp_path / "log"
+    path.write_bytes(b"one\ntwo\nthr")
+    inode = os.stat(str(path)).st_ino
+
+    # Reads run on to the end of a line, and stop before a partial one.
+    assert gamelogs.read_chunk(str(path), 0, inode, 2) == \
+        (b"one\n", 0, 4, inode)
+    assert gamelogs.read_chunk(str(path), 4, inode, 100) == \
+        (b"two\n", 4, 8, inode)
+    assert gamelogs.read_chunk(str(path), 8, inode, 100) == \
+        (b"", 8, 8, inode)
+
+    # A truncated file is read from the start.
+    path.write_bytes(b"new\n")
+    assert gamelogs.read_chunk(str(path), 8, inode, 100) == \
+        (b"new\n", 0, 4, inode)
+
+    # So is one that was replaced, even if it has grown past the offset.
+    replacement = tmp_path / "log.new"
+    replacement.write_bytes(b"first\nsecond\n")
+    os.replace(str(replacement), str(path))
+    new_inode = os.stat(str(path)).st_ino
+    assert gamelogs.read_chunk(str(path), 4, inode, 100) == \
+        (b"first\nsecond\n", 0, 13, new_inode)
+
+def test_ingest(database, xlog):
+    ingester = gamelogs.Ingester(database, [xlog], chunk_size=16)
+    append(xlog, xlog_line("alice", 10) + xlog_line("bob", 30) + "junk\n")
+    assert ingester.ingest() == 2
+    assert ingester.skipped == 1
+    assert ingester.ingest() == 0
+
+    # A partly written line waits for the rest of it.
+    append(xlog, xlog_line("alice", 50, "ascended") + "points=1\tname=")
+    assert ingester.ingest() == 1
+    append(xlog, "carol\n")
+    assert ingester.ingest() == 1
+
+    assert records(database) == [("alice", 10), ("bob", 30), ("alice", 50),
+                                 ("carol", 1)]
+    totals = stats.summary(database, 'nethack')
+    assert (totals['players'], totals['games'], totals['points'],
+            totals['wins'], totals['best'], totals['best_name']) == \
+        (3, 4, 91, 1, 50, "alice")
+    assert stats.leaderboard(database, 'nethack', 'games')[0] == \
+        {'name': "alice", 'best': 50, 'games': 2, 'wins': 1}
+
+def test_rotation(database, xlog):
+    ingester = gamelogs.Ingester(database, [xlog])
+    append(xlog, xlog_line("alice", 10))
+    assert ingester.ingest() == 1
+
+    rotated = xlog.path + ".new"
+    with open(rotated, "w") as file:
+        file.write(xlog_line("bob", 20) + xlog_line("carol", 30))
+    os.replace(rotated, xlog.path)
+    assert ingester.ingest() == 2
+    assert records(database) == [("alice", 10), ("bob", 20), ("carol", 30)]
+
+def test_missing_log(database, tmp_path):
+    log = LogFile('nethack', str(tmp_path / "none"), 'xlog')
+    assert gamelogs.Ingester(database, [log]).ingest() == 0
+
+def test_raced_chunk_rolls_back(database, xlog, monkeypatch):
+    append(xlog, xlog_line("alice", 10) + xlog_line("bob", 20))
+    read_chunk = gamelogs.read_chunk
+    other = gamelogs.Ingester(database, [xlog])
+    raced = []
+
+    def racing_read(*args):
+        # Another ingester loads the chunk between our reading the offset
+        # and moving it on.
+        if not raced:
+            raced.append(True)
+            assert other.ingest() == 2
+        return read_chunk(*args)
+    monkeypatch.setattr(gamelogs, 'read_chunk', racing_read)
+
+    assert gamelogs.Ingester(database, [xlog]).ingest() == 0
+    assert records(database) == [("alice", 10), ("bob", 20)]
+    assert stats.summary(database, 'nethack')['games'] == 2
+
+def test_logs_from_config():
+    config = {'games': [
+        {'name': "NetHack", 'root': "/srv/nh"},
+        {'name': "Other", 'root': "/srv/other",
+         'stats': {'name': "other", 'xlogfile': "var/xlog"}},
+        {'name': "No root"},
+    ]}
+    assert gamelogs.logs_from_config(config) == [
+        LogFile("NetHack", "/srv/nh/game/xlogfile", 'xlog'),
+        LogFile("NetHack", "/srv/nh/game/livelog", 'livelog'),
+        LogFile("other", "/srv/other/var/xlog", 'xlog'),
+        LogFile("other", "/srv/other/game/livelog", 'livelog'),
+    ]
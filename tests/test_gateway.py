@@ -0,0 +1,139 @@
+"""Tests for the WebSocket gateway, with a stub recorder client."""
+
+import asyncio
+import json
+import os
+import struct
+import sys
+import pytest
+from conftest import add_user
+from gamelaunch import db
+from gamelaunch import gateway
+
+RECORDER = """#!{python}
+import sys
+import time
+with open({args!r}, "w") as file:
+    file.write(" ".join(sys.argv[1:]))
+sys.stdout.buffer.write(b"hello from the game")
+sys.stdout.flush()
+time.sleep(60)
+"""
+
+@pytest.fixture
+def recorder(tmp_path, monkeypatch):
+    """A termrecord_client on the PATH that prints a greeting and waits
+    to be stopped. Returns the file it writes its arguments to."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    args = tmp_path / "args"
+    client = bin_dir / "termrecord_client"
+    client.write_text(RECORDER.format(python=sys.executable, args=str(args)))
+    client.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}{}{}".format(bin_dir, os.pathsep,
+                                               os.environ["PATH"]))
+    return args
+
+async def request(port, path, headers=""):
+    """Send a GET request. Returns the connection and the response head."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write("GET {} HTTP/1.1\r\nHost: localhost\r\n{}\r\n"
+                 .format(path, headers).encode('latin-1'))
+    head = await reader.readuntil(b"\r\n\r\n")
+    return reader, writer, head.decode('latin-1')
+
+async def games(port):
+    """Get the list of games."""
+    reader, writer, head = await request(port, "/games")
+    assert head.startswith("HTTP/1.1 200 ")
+    body = await reader.read()
+    writer.close()
+    return json.loads(body.decode('utf-8'))
+
+async def server_frame(reader):
+    """Read an unmasked frame from the server."""
+    first, length = await reader.readexactly(2)
+    assert not length & 0x80
+    if length == 126:
+        length, = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack("!Q", await reader.readexactly(8))
+    return first & 0x0F, await reader.readexactly(length)
+
+def client_frame(opcode, payload):
+    """A short masked frame, as clients send them."""
+    mask = b"\x01\x02\x03\x04"
+    return bytes([0x80 | opcode, 0x80 | len(payload)]) + mask + \
+        bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+
+def run_gateway(database, scenario):
+    """Run scenario(gateway, port) against a gateway on a free port."""
+    async def main():
+        server_gateway = gateway.Gateway(database, {'refresh': 0},
+                                         "localhost", 34234)
+        server = await asyncio.start_server(server_gateway.handle,
+                                            "127.0.0.1", 0)
+        running = asyncio.all_tasks()
+        try:
+            await scenario(server_gateway,
+                           server.sockets[0].getsockname()[1])
+            # Let the handlers and the relays finish.
+            while asyncio.all_tasks() - running:
+                await asyncio.sleep(0.05)
+        finally:
+            server.close()
+            await server.wait_closed()
+    asyncio.run(asyncio.wait_for(main(), 20))
+
+def test_games(database):
+    user_id = add_user(database, "alice")
+    db.start_playing(database, user_id, "n1", "Bench-alice")
+
+    async def scenario(_, port):
+        listed = await games(port)
+        assert [(game['user'], game['node'], game['viewers'])
+                for game in listed] == [("alice", "n1", 0)]
+    run_gateway(database, scenario)
+
+def test_watch(database, recorder):
+    db.start_playing(database, add_user(database, "alice"))
+
+    async def scenario(server_gateway, port):
+        reader, writer, head = await request(
+            port, "/watch/alice", "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\nSec-WebSocket-Version: 13\r\n"
+            "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n")
+        assert head.startswith("HTTP/1.1 101 ")
+        assert "Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=" in head
+
+        seen = b""
+        while b"hello from the game" not in seen:
+            opcode, payload = await server_frame(reader)
+            assert opcode == gateway.OP_BINARY
+            seen += payload
+        assert server_gateway.viewers == 1
+        assert (await games(port))[0]['viewers'] == 1
+
+        writer.write(client_frame(gateway.OP_PING, b"ping"))
+        assert await server_frame(reader) == (gateway.OP_PONG, b"ping")
+        writer.write(client_frame(gateway.OP_CLOSE, b"\x03\xe8"))
+        assert await server_frame(reader) == (gateway.OP_CLOSE, b"\x03\xe8")
+        writer.close()
+    run_gateway(database, scenario)
+
+    assert recorder.read_text() == \
+        "-host localhost -port 34234 -user alice -watch"
+
+@pytest.mark.parametrize("path, headers, status", [
+    ("/watch/bob", "Upgrade: websocket\r\nSec-WebSocket-Key: a2V5\r\n", 404),
+    ("/watch/alice", "", 400),
+    ("/nowhere", "", 404),
+])
+def test_refused(database, path, headers, status):
+    db.start_playing(database, add_user(database, "alice"))
+
+    async def scenario(_, port):
+        _, writer, head = await request(port, path, headers)
+        assert head.startswith("HTTP/1.1 {} ".format(status))
+        writer.close()
+    run_gateway(database, scenario)
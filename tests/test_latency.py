@@ -0,0 +1,55 @@
+"""Tests for the latency histogram."""
+
+import pytest
+from gamelaunch.latency import LatencyHistogram, SUB_BUCKETS
+
+def lower(index):
+    """The smallest number of microseconds in a bucket."""
+    return LatencyHistogram.upper(index - 1) + 1 if index else 0
+
+def test_small_values_are_exact():
+    for micros in range(2 * SUB_BUCKETS):
+        index = LatencyHistogram.index(micros)
+        assert index == micros
+        assert lower(index) == LatencyHistogram.upper(index) == micros
+
+def test_buckets_cover_every_value():
+    """Each value is within the bounds of its bucket, and the buckets
+    follow one another with no gaps."""
+    previous = -1
+    for micros in range(1 << 16):
+        index = LatencyHistogram.index(micros)
+        assert lower(index) <= micros <= LatencyHistogram.upper(index)
+        assert index in (previous, previous + 1)
+        previous = index
+
+@pytest.mark.parametrize("power", range(5, 40))
+def test_bucket_bounds(power):
+    """Powers of two start a bucket, and buckets are within 1/SUB_BUCKETS
+    of their values."""
+    micros = 1 << power
+    index = LatencyHistogram.index(micros)
+    assert lower(index) == micros
+    assert LatencyHistogram.upper(index - 1) == micros - 1
+    for value in (micros, micros + micros // 3, 2 * micros - 1):
+        index = LatencyHistogram.index(value)
+        assert lower(index) <= value <= LatencyHistogram.upper(index)
+        width = LatencyHistogram.upper(index) - lower(index) + 1
+        assert width <= max(value // SUB_BUCKETS, 1)
+
+def test_percentile():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(99) == 0.0
+    for millis in range(1, 101):
+        histogram.record(millis / 1000)
+    assert histogram.total == 100 and histogram.max == 100000
+    for percent in (50, 90, 99):
+        value = histogram.percentile(percent)
+        assert percent / 1000 <= value <= percent / 1000 * (
+            1 + 1 / SUB_BUCKETS)
+    assert histogram.percentile(100) == 0.1
+
+def test_percentile_capped_by_max():
+    histogram = LatencyHistogram()
+    histogram.record(0.001)
+    assert histogram.percentile(50) == 0.001
@@ -0,0 +1,72 @@
+"""Tests for choosing the node a game runs on."""
+
+import time
+import pytest
+from conftest import add_user
+from gamelaunch import db
+from gamelaunch import placement
+from gamelaunch.placement import GameNode
+
+NODES = [GameNode('n1', "unix:///n1.sock", 0),
+         GameNode('n2', "unix:///n2.sock", 2)]
+
+def play(database, name, node):
+    """Start a game for a new user on node."""
+    db.start_playing(database, add_user(database, name), node, name)
+
+def test_no_nodes_uses_local(database):
+    local = GameNode(None, "unix:///local.sock", 0)
+    nodes = placement.Placement(database, [], local=local)
+    assert nodes.choose() is local
+    assert nodes.node(None) is local
+
+def test_from_config_local_engine(database):
+    nodes = placement.from_config({'engine': "tcp://docker:2375"}, database)
+    assert nodes.choose() == GameNode(None, "tcp://docker:2375", 0)
+    assert placement.from_config({}, database).choose() == placement.LOCAL
+
+def test_chooses_fewest_games(database):
+    placement.report(database, 'n1', 0, 0.0)
+    placement.report(database, 'n2', 0, 0.0)
+    play(database, 'alice', 'n1')
+    assert placement.Placement(database, NODES).choose().name == 'n2'
+
+def test_cpu_breaks_ties(database):
+    placement.report(database, 'n1', 0, 0.5)
+    placement.report(database, 'n2', 0, 0.1)
+    assert placement.Placement(database, NODES).choose().name == 'n2'
+    assert placement.Placement(database, NODES,
+                               cpu_weight=0).choose().name == 'n1'
+
+def test_skips_full_nodes(database):
+    placement.report(database, 'n1', 0, 0.9)
+    placement.report(database, 'n2', 0, 0.0)
+    play(database, 'alice', 'n2')
+    play(database, 'bob', 'n2')
+    assert placement.Placement(database, NODES).choose().name == 'n1'
+
+def test_skips_stale_nodes(database):
+    placement.report(database, 'n1', 0, 0.0)
+    database.run("UPDATE nodes SET updated = :old WHERE name = 'n1'",
+                 old=int(time.time()) - 60)
+    placement.report(database, 'n2', 0, 0.9)
+    assert placement.Placement(database, NODES).choose().name == 'n2'
+
+def test_no_node_available(database):
+    placement.report(database, 'n2', 0, 0.0)
+    play(database, 'alice', 'n2')
+    play(database, 'bob', 'n2')
+    with pytest.raises(placement.NoNodeAvailable):
+        placement.Placement(database, NODES).choose()
+
+def test_engine_of_node(database):
+    nodes = placement.Placement(database, NODES)
+    assert nodes.node('n2') is NODES[1]
+    assert nodes.engine('n1').url() == "unix:///n1.sock"
+
+def test_unknown_node(database):
+    nodes = placement.Placement(database, NODES)
+    with pytest.raises(placement.UnknownNode):
+        nodes.node('gone')
+    with pytest.raises(KeyError):
+        nodes.engine('gone')
@@ -0,0 +1,129 @@
+"""Tests for scanning and indexing recordings."""
+
+import gzip
+import json
+import os
+from gamelaunch import replay
+
+def frame(stamp, data):
+    """A ttyrec frame at stamp seconds."""
+    sec = int(stamp)
+    return replay.HEADER.pack(sec, int((stamp - sec) * 1000000),
+                              len(data)) + data
+
+def write(path, frames, mtime=None):
+    """Write a recording of (stamp, data) frames."""
+    with open(path, "ab") as file:
+        for stamp, data in frames:
+            file.write(frame(stamp, data))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+def scanned(path):
+    """A new entry for path, scanned."""
+    entry = replay.new_entry(os.path.basename(path), os.stat(path))
+    replay.scan(path, entry)
+    return entry
+
+def test_scan(tmp_path):
+    path = str(tmp_path / "game.ttyrec")
+    frames = [(100.0 + 5 * i, b"output") for i in range(9)]
+    frames[0] = (100.0, b"\x1b[2Jstart")
+    frames[7] = (135.0, b"\x1b[H\x1b[Jclear")
+    frames[8] = (140.0, b"\x1b[2Jtoo soon")
+    write(path, frames + [(1000.0, b"long gap")])
+    entry = scanned(path)
+    assert entry['frames'] == 10
+    assert entry['start'] == 100.0 and entry['stamp'] == 1000.0
+    # Gaps are played as at most MAX_DELAY.
+    assert entry['time'] == 40.0 + replay.MAX_DELAY
+    assert entry['offset'] == os.path.getsize(path)
+    # The first frame, and clears at least SEEK_INTERVAL after the last
+    # seek point.
+    assert [point[0] for point in entry['seek']] == [0.0, 35.0]
+    assert entry['seek'][1][2] == 135.0
+
+def test_scan_incremental(tmp_path):
+    path = str(tmp_path / "game.ttyrec")
+    write(path, [(0.0, b"one"), (1.0, b"two")])
+    entry = scanned(path)
+    offset = entry['offset']
+
+    # A partly written frame is left for the next scan.
+    with open(path, "ab") as file:
+        file.write(frame(2.0, b"three")[:-2])
+    replay.scan(path, entry)
+    assert entry['frames'] == 2 and entry['offset'] == offset
+
+    with open(path, "ab") as file:
+        file.write(b"ee")
+    replay.scan(path, entry)
+    assert entry['frames'] == 3 and entry['time'] == 2.0
+
+def test_scan_compressed(tmp_path):
+    path = str(tmp_path / "game.ttyrec.gz")
+    with gzip.open(path, "wb") as file:
+        file.write(frame(0.0, b"one") + frame(3.0, b"two"))
+    entry = scanned(path)
+    assert entry['frames'] == 2 and entry['time'] == 3.0
+
+def test_entries(tmp_path):
+    directory = str(tmp_path)
+    write(os.path.join(directory, "old.ttyrec"), [(0.0, b"a")], 1000)
+    write(os.path.join(directory, "new.ttyrec"), [(0.0, b"a")], 2000)
+    write(os.path.join(directory, "empty.ttyrec"), [], 3000)
+    index = replay.RecordingIndex(directory)
+    assert [entry['name'] for entry in index.entries()] == \
+        ["new.ttyrec", "old.ttyrec"]
+    assert index.path({'name': "new.ttyrec"}) == \
+        os.path.join(directory, "new.ttyrec")
+
+    saved = os.path.join(directory, replay.INDEX_DIRECTORY,
+                         replay.INDEX_NAME)
+    with open(saved) as file:
+        assert set(json.load(file)['recordings']) == \
+            {"old.ttyrec", "new.ttyrec", "empty.ttyrec"}
+
+def test_entries_growing(tmp_path):
+    directory = str(tmp_path)
+    path = os.path.join(directory, "game.ttyrec")
+    write(path, [(0.0, b"a")], 1000)
+    index = replay.RecordingIndex(directory)
+    assert index.entries()[0]['frames'] == 1
+
+    # Only the newest recording is looked at when the directory hasn't
+    # changed, and it is scanned from where the last scan stopped.
+    write(path, [(2.0, b"b")], 2000)
+    entry = index.entries()[0]
+    assert entry['frames'] == 2 and entry['time'] == 2.0
+    assert entry['size'] == os.path.getsize(path)
+
+def test_entries_removed(tmp_path):
+    directory = str(tmp_path)
+    write(os.path.join(directory, "one.ttyrec"), [(0.0, b"a")], 1000)
+    write(os.path.join(directory, "two.ttyrec"), [(0.0, b"a")], 2000)
+    index = replay.RecordingIndex(directory)
+    assert len(index.entries()) == 2
+    os.unlink(os.path.join(directory, "one.ttyrec"))
+    assert [entry['name'] for entry in index.entries()] == ["two.ttyrec"]
+
+def test_renamed(tmp_path):
+    directory = str(tmp_path)
+    path = os.path.join(directory, "game.ttyrec")
+    write(path, [(0.0, b"\x1b[2Ja"), (4.0, b"b")], 1000)
+    index = replay.RecordingIndex(directory)
+    before = index.entries()[0]
+
+    with open(path, "rb") as source, gzip.open(path + ".gz", "wb") as output:
+        output.write(source.read())
+    os.utime(path + ".gz", (1000, 1000))
+    os.unlink(path)
+    index.renamed({"game.ttyrec": "game.ttyrec.gz",
+                   "gone.ttyrec": "gone.ttyrec.gz"})
+
+    saved = os.path.join(directory, replay.INDEX_DIRECTORY,
+                         replay.INDEX_NAME)
+    with open(saved) as file:
+        entry = json.load(file)['recordings']["game.ttyrec.gz"]
+    assert entry['seek'] == before['seek'] and entry['frames'] == 2
+    assert entry['size'] == os.path.getsize(path + ".gz")
@@ -0,0 +1,143 @@
+"""Tests for recording retention."""
+
+import gzip
+import lzma
+import os
+import time
+import pytest
+from gamelaunch import replay
+from gamelaunch import retention
+from gamelaunch.retention import DAY, Policy
+
+NOW = 1000 * DAY
+
+def policy(**options):
+    """A policy that only does what options ask."""
+    values = dict(keep=0, compress_after=10 ** 6, max_age=0, max_bytes=0,
+                  level=1)
+    values.update(options)
+    return Policy(**values)
+
+def test_policy_from_config():
+    assert retention.policy_from_config(
+        {'keep': 5, 'max_age': 30, 'unknown': 1},
+        {'max_age': 60}) == retention.DEFAULT_POLICY._replace(
+            keep=5, max_age=60)
+
+def test_plan():
+    files = {
+        'newest': (10, NOW - 30),
+        'writing': (10, NOW - 120),
+        'old': (10, NOW - 8 * DAY),
+        'older.xz': (10, NOW - 9 * DAY),
+        'oldest': (10, NOW - 40 * DAY),
+    }
+    actions = retention.plan(files, policy(keep=1, compress_after=7,
+                                           max_age=30), NOW)
+    # The newest is kept, and one still being written is never touched.
+    assert actions == [('compress', 'old'), ('delete', 'oldest')]
+    assert retention.plan(files, policy(keep=3, compress_after=7), NOW) == \
+        [('compress', 'oldest')]
+
+def test_trim():
+    files = {name: (100, NOW - age * DAY)
+             for name, age in [('a', 1), ('b', 2), ('c', 3), ('d', 4)]}
+    assert retention.trim(files, policy(), NOW) == []
+    assert retention.trim(files, policy(max_bytes=250), NOW) == ['d', 'c']
+    assert retention.trim(files, policy(keep=3, max_bytes=50), NOW) == ['d']
+
+def make_recordings(directory, count, size=4096):
+    """Write count recordings, a day apart, the oldest first. The newest
+    is a day and a half old."""
+    now = time.time()
+    for i in range(count):
+        path = os.path.join(directory, "game{}.ttyrec".format(i))
+        with open(path, "wb") as file:
+            file.write(replay.HEADER.pack(0, 0, size - replay.HEADER.size))
+            file.write(b"x" * (size - replay.HEADER.size))
+        mtime = now - (count - i + 0.5) * DAY
+        os.utime(path, (mtime, mtime))
+
+def run(tmp_path, directory, job_policy, dry_run):
+    """Run retention over one directory."""
+    job = retention.Retention(str(tmp_path / "manifest.json"), 2, dry_run)
+    return job.run([(directory, job_policy)])
+
+def test_run(tmp_path):
+    directory = str(tmp_path / "alice")
+    os.mkdir(directory)
+    make_recordings(directory, 5)
+    report = run(tmp_path, directory, policy(keep=1, compress_after=3,
+                                             max_age=5), False)
+    assert (report.directories, report.scanned, report.files) == (1, 1, 5)
+    assert (report.compressed, report.deleted, report.errors) == (2, 1, [])
+    assert sorted(os.listdir(directory)) == [
+        "game1.ttyrec.xz", "game2.ttyrec.xz", "game3.ttyrec",
+        "game4.ttyrec"]
+    with lzma.open(os.path.join(directory, "game1.ttyrec.xz")) as file:
+        assert len(file.read()) == 4096
+
+    # Nothing is left to do, and the directory comes from the manifest.
+    report = run(tmp_path, directory, policy(keep=1, compress_after=3,
+                                             max_age=5), False)
+    assert (report.scanned, report.compressed, report.deleted) == (0, 0, 0)
+
+@pytest.mark.parametrize("dry_run", [True, False])
+def test_trim_before_compressing(tmp_path, dry_run):
+    directory = str(tmp_path / "alice")
+    os.mkdir(directory)
+    make_recordings(directory, 6)
+    job_policy = policy(keep=1, compress_after=0, max_bytes=3 * 4096)
+    report = run(tmp_path, directory, job_policy, dry_run)
+
+    # The three oldest are deleted, and the rest but the newest compressed,
+    # so nothing is compressed and then deleted.
+    assert (report.deleted, report.compressed) == (3, 2)
+    assert report.compressed_bytes == 2 * 4096
+    if dry_run:
+        assert report.reclaimed == 3 * 4096
+        assert len(os.listdir(directory)) == 6
+    else:
+        assert report.reclaimed > 3 * 4096
+        assert sorted(os.listdir(directory)) == [
+            "game3.ttyrec.xz", "game4.ttyrec.xz", "game5.ttyrec"]
+
+def test_dry_run_matches(tmp_path):
+    directory = str(tmp_path / "alice")
+    os.mkdir(directory)
+    make_recordings(directory, 8)
+    job_policy = policy(keep=2, compress_after=3, max_age=7,
+                        max_bytes=4 * 4096)
+    dry = run(tmp_path, directory, job_policy, True)
+    real = run(tmp_path, directory, job_policy, False)
+    assert (dry.files, dry.compressed, dry.compressed_bytes, dry.deleted) == \
+        (real.files, real.compressed, real.compressed_bytes, real.deleted)
+
+def test_recompress(tmp_path):
+    path = str(tmp_path / "game.ttyrec.gz")
+    with gzip.open(path, "wb") as file:
+        file.write(b"frames")
+    os.utime(path, (1000, 1000))
+    name, size = retention.recompress(path, 1)
+    assert name == "game.ttyrec.xz" and not os.path.exists(path)
+    target = str(tmp_path / name)
+    assert size == os.path.getsize(target)
+    assert os.stat(target).st_mtime == 1000
+    with lzma.open(target) as file:
+        assert file.read() == b"frames"
+
+def test_directories(tmp_path):
+    for user in ("alice", "bob"):
+        os.makedirs(str(tmp_path / user / "ttyrec"))
+    (tmp_path / "file").write_text("")
+    config = {'retention': {'keep': 3}, 'games': [
+        {'recordings': str(tmp_path) + "/{{ user }}/ttyrec",
+         'retention': {'max_age': 9}},
+        {'recordings': "/srv/shared", 'retention': {}},
+        {'recordings': "/srv/none"},
+    ]}
+    found = sorted(retention.directories(config))
+    assert [directory for directory, _ in found] == [
+        "/srv/shared", str(tmp_path) + "/alice/ttyrec",
+        str(tmp_path) + "/bob/ttyrec"]
+    assert found[1][1].keep == 3 and found[1][1].max_age == 9
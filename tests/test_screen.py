@@ -0,0 +1,108 @@
+"""Tests for the terminal screen model and the renderer."""
+
+import random
+import pytest
+from gamelaunch import screen
+
+def text(model, row):
+    """The characters of a row, without trailing spaces."""
+    return "".join(char for char, _ in model.lines[row]).rstrip()
+
+def assert_same(viewer, game):
+    """The viewer's screen shows what the game's does."""
+    assert viewer.lines == game.lines
+    assert (viewer.y, viewer.x) == (game.y, game.x)
+    assert viewer.cursor_visible == game.cursor_visible
+
+def test_text_and_cursor():
+    model = screen.Screen(5, 10)
+    model.feed(b"hello\r\nworld\x1b[3;4Hx\x1b[1;1H\x1b[2Kbye")
+    assert [text(model, row) for row in range(3)] == ["bye", "world", "   x"]
+    assert (model.y, model.x) == (0, 3)
+
+def test_wrap_and_scroll():
+    model = screen.Screen(3, 4)
+    model.feed(b"abcdefgh\r\nij\r\nkl")
+    assert [text(model, row) for row in range(3)] == ["efgh", "ij", "kl"]
+
+def test_scroll_region():
+    model = screen.Screen(4, 5)
+    model.feed(b"top\r\none\r\ntwo\r\nend\x1b[2;3r\x1b[3;1H\nnew\x1b[r")
+    assert [text(model, row) for row in range(4)] == \
+        ["top", "two", "new", "end"]
+
+def test_line_drawing():
+    model = screen.Screen(2, 5)
+    model.feed(b"\x1b(0lqk\x1b(Bx")
+    assert text(model, 0) == "┌─┐x"
+
+def test_split_sequences():
+    """Escape sequences and characters split between reads still work."""
+    whole = screen.Screen(3, 10)
+    split = screen.Screen(3, 10)
+    data = "\x1b[1;31mé\x1b[2;5Hñ\x1b[0m\x1b[?25l".encode('utf-8')
+    whole.feed(data)
+    for i in range(len(data)):
+        split.feed(data[i:i + 1])
+    assert_same(split, whole)
+    assert whole.lines[0][0] == ("é", split.lines[0][0][1])
+    assert whole.lines[0][0][1] != screen.BLANK_ATTR
+    assert not whole.cursor_visible
+
+def test_frame_is_empty_when_up_to_date():
+    model = screen.Screen(3, 10)
+    model.feed(b"hello")
+    renderer = screen.Renderer(3, 10)
+    assert renderer.frame(model) != b""
+    assert renderer.frame(model) == b""
+    renderer.redraw()
+    assert renderer.frame(model).startswith(b"\x1b[0m\x1b[H\x1b[2J")
+
+def test_frame_draws_only_changes():
+    model = screen.Screen(3, 20)
+    model.feed(b"a long first line\r\nsecond")
+    renderer = screen.Renderer(3, 20)
+    renderer.frame(model)
+    model.feed(b"\x1b[1;3Hshort")
+    frame = renderer.frame(model)
+    assert b"short" in frame and b"second" not in frame
+
+GAME_OUTPUT = [
+    b"\x1b[H\x1b[2J\x1b[?25l",
+    b"\x1b[1;1H\x1b[7mNetHack\x1b[m",
+    b"\x1b[5;10H\x1b[1;32m@\x1b[0m",
+    b"\x1b[2;1H\x1b(0lqqqqk\x1b(B",
+    b"\x1b[3;1H\x1b[33;44mgold\x1b[m\x1b[K",
+    b"\x1b[10;1Hline\r\nline\r\nline",
+    b"\x1b[4;20r\x1b[20;1H\n\n\x1b[r",
+    b"\x1b[6;1H\x1b[2L\x1b[1P\x1b[3@",
+    b"\x1b[8;30Hunicode \xe2\x94\x80\xc3\xa9",
+    b"\x1b[24;1H\x1b[Jbottom\x1b[?25h",
+    b"\x1b[12;40H\x1b[1K\x1b[4mu\x1b[24m",
+]
+
+@pytest.mark.parametrize("seed", range(5))
+def test_round_trip(seed):
+    """A viewer fed the renderer's frames ends up with the game's screen,
+    however the game's output was split up."""
+    chooser = random.Random(seed)
+    game = screen.Screen()
+    viewer = screen.Screen()
+    renderer = screen.Renderer(game.rows, game.columns)
+    data = b"".join(GAME_OUTPUT) * 3
+    position = 0
+    while position < len(data):
+        step = chooser.randint(1, 40)
+        game.feed(data[position:position + step])
+        position += step
+        if chooser.random() < 0.5:
+            viewer.feed(renderer.frame(game))
+    viewer.feed(renderer.frame(game))
+    assert_same(viewer, game)
+
+def test_new_viewer_gets_whole_screen():
+    game = screen.Screen()
+    game.feed(b"".join(GAME_OUTPUT))
+    viewer = screen.Screen()
+    viewer.feed(screen.Renderer(game.rows, game.columns).frame(game))
+    assert_same(viewer, game)